@@ -0,0 +1,32 @@
+# benchmarks/compare.py
+# Show the change between two benchmarks.run reports
+
+import argparse
+import json
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "peak_traced_bytes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diff two benchmark reports.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"{before.get('revision')} -> {after.get('revision')}")
+    for scenario in sorted(set(before["results"]) | set(after["results"])):
+        old = before["results"].get(scenario, {})
+        new = after["results"].get(scenario, {})
+        for metric in METRICS:
+            if old.get(metric) is None or new.get(metric) is None:
+                continue
+            change = (new[metric] - old[metric]) / old[metric] * 100 if old[metric] else 0.0
+            print(f"{scenario:18} {metric:18} {old[metric]:12.2f} {new[metric]:12.2f} {change:+7.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+# benchmarks/run.py
+# Seed a temporary SQLite database and time the task and auth hot paths
+# through app.test_client().
+#
+#   python -m benchmarks.run --tasks 100000 --output bench.json
+#   python -m benchmarks.compare before.json after.json
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import bcrypt
+
+from project import create_app, db, fragment_cache
+
+PASSWORD = "benchmark"
+
+
+def seed(path, users, tasks, rounds, reserved=0, batch_size=50000):
+    # raw executemany: seeding a million rows through the ORM would take
+    # longer than the benchmark itself. The reserved tasks come on top,
+    # open and owned by bench000001, for the scenarios that use one up
+    # per request.
+    password = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds)).decode()
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        "INSERT INTO users (id, name, email, password, role) VALUES (?, ?, ?, ?, 'user')",
+        [(i, f"bench{i:06}", f"bench{i:06}@example.com", password)
+         for i in range(1, users + 1)]
+    )
+    rng = random.Random(42)
+    today = datetime.date.today()
+    for start in range(0, tasks, batch_size):
+        rows = []
+        for task_id in range(start + 1, min(start + batch_size, tasks) + 1):
+            rows.append((
+                task_id,
+                f"Task {task_id}",
+                (today + datetime.timedelta(days=rng.randint(-365, 365))).isoformat(),
+                rng.randint(1, 10),
+                today.isoformat(),
+                1 if rng.random() < 0.7 else 0,
+                (task_id - 1) % users + 1
+            ))
+        connection.executemany(
+            "INSERT INTO tasks (task_id, name, due_date, priority, posted_date, "
+            "status, user_id) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        connection.commit()
+    connection.executemany(
+        "INSERT INTO tasks (task_id, name, due_date, priority, posted_date, "
+        "status, user_id) VALUES (?, ?, ?, 5, ?, 1, 1)",
+        [(task_id, f"Task {task_id}",
+          (today + datetime.timedelta(days=30)).isoformat(), today.isoformat())
+         for task_id in range(tasks + 1, tasks + reserved + 1)]
+    )
+    connection.commit()
+    connection.execute("ANALYZE")
+    connection.commit()
+    connection.close()
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def measure(name, requests, call, trace_memory):
+    latencies = []
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    for number in range(requests):
+        before = time.perf_counter()
+        response = call(number)
+        latencies.append(time.perf_counter() - before)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{name}: HTTP {response.status_code}")
+    elapsed = time.perf_counter() - started
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return dict(
+        requests=requests,
+        p50_ms=percentile(latencies, 0.50) * 1000,
+        p95_ms=percentile(latencies, 0.95) * 1000,
+        p99_ms=percentile(latencies, 0.99) * 1000,
+        mean_ms=statistics.mean(latencies) * 1000,
+        throughput_rps=requests / elapsed,
+        peak_traced_bytes=peak,
+    )
+
+
+def owned_tasks(name, first, count):
+    # count reserved task ids from first on, one per request
+    task_ids = iter(range(first, first + count))
+
+    def take():
+        try:
+            return next(task_ids)
+        except StopIteration:
+            raise SystemExit(
+                f"{name}: all {count} reserved tasks are used up; "
+                f"seed more with a larger reserve")
+    return take
+
+
+def scenarios(client, tasks, requests):
+    # complete and delete each get their own reserved tasks (see seed), so
+    # every request succeeds however --tasks and --users are set
+    complete_id = owned_tasks("complete", tasks + 1, requests)
+    delete_id = owned_tasks("delete", tasks + requests + 1, requests)
+
+    def login(number):
+        return client.post("/", data=dict(name="bench000001", password=PASSWORD))
+
+    def tasks_cold(number):
+        fragment_cache.clear()
+        return client.get("/tasks/")
+
+    def tasks_warm(number):
+        return client.get("/tasks/")
+
+    def tasks_streamed(number):
+        # a long listing: TASKS_STREAM_PER_PAGE rows per list, no cache
+        response = client.get("/tasks/?stream=1")
+        response.get_data()
+        return response
+
+    def next_tasks(number):
+        return client.get("/api/tasks/next/")
+
+    def claim(number):
+        return client.post("/api/tasks/claim/")
+
+    def add(number):
+        return client.post("/add/", data=dict(
+            name=f"Bench task {number}", due_date="10/08/2030", priority="3"))
+
+    def complete(number):
+        return client.get(f"/complete/{complete_id()}/")
+
+    def delete(number):
+        return client.get(f"/delete/{delete_id()}/")
+
+    return [
+        ("login", login),
+        ("tasks_cold_cache", tasks_cold),
+        ("tasks_warm_cache", tasks_warm),
+        ("tasks_streamed", tasks_streamed),
+        ("next_tasks", next_tasks),
+        ("claim", claim),
+        ("add", add),
+        ("complete", complete),
+        ("delete", delete),
+    ]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the FlaskTaskr hot paths.")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--tasks", type=int, default=10000,
+                        help="rows to seed, e.g. 10000 up to 1000000")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests per scenario")
+    parser.add_argument("--bcrypt-rounds", type=int, default=None,
+                        help="defaults to BCRYPT_LOG_ROUNDS")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="report tracemalloc peaks (slows requests down)")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+    # deprecation noise from the form classes would drown the report
+    warnings.simplefilter("ignore")
+
+    workdir = tempfile.mkdtemp(prefix="flasktaskr-bench-")
+    path = os.path.join(workdir, "bench.db")
+    app = create_app(dict(
+        TESTING=True,
+        WTF_CSRF_ENABLED=False,
+        DEBUG=False,
+        SQLALCHEMY_DATABASE_URI="sqlite:///" + path,
+        TASKS_STREAM_PER_PAGE=2000
+    ))
+    rounds = args.bcrypt_rounds or app.config["BCRYPT_LOG_ROUNDS"]
+    app.config["BCRYPT_LOG_ROUNDS"] = rounds
+    try:
+        with app.app_context():
+            db.create_all()
+        started = time.perf_counter()
+        seed(path, args.users, args.tasks, rounds, reserved=2 * args.requests)
+        seed_seconds = time.perf_counter() - started
+
+        client = app.test_client()
+        results = {}
+        for name, call in scenarios(client, args.tasks, args.requests):
+            results[name] = measure(name, args.requests, call, args.trace_memory)
+            if name == "login":
+                # the remaining scenarios run as a logged in user
+                client.post("/", data=dict(name="bench000001", password=PASSWORD))
+        report = dict(
+            revision=git_revision(),
+            python=platform.python_version(),
+            sqlite=sqlite3.sqlite_version,
+            users=args.users,
+            tasks=args.tasks,
+            requests=args.requests,
+            bcrypt_rounds=rounds,
+            seed_seconds=seed_seconds,
+            peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            results=results,
+        )
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+# project/build_assets.py
+# Build step for the static assets: writes static/manifest.json with the
+# fingerprinted name of every file and precompressed gzip/brotli copies;
+# run it on every deploy
+
+from project import create_app
+from project.assets import build
+
+app = create_app()
+manifest = build(app.static_folder)
+for filename, name in sorted(manifest.items()):
+    print(f"{filename} -> {name}")
@@ -0,0 +1,27 @@
+# project/db_archive.py
+# Move old closed tasks into the archive table; meant to run from cron
+
+import argparse
+
+from project import create_app, db
+from project.archive import ARCHIVE_AFTER_DAYS, BATCH_SIZE, archive_closed_tasks
+from project.migrations import connect
+
+app = create_app()
+
+parser = argparse.ArgumentParser(description="Archive old closed tasks.")
+parser.add_argument("--after-days", type=int,
+                    default=app.config.get("ARCHIVE_AFTER_DAYS", ARCHIVE_AFTER_DAYS),
+                    help="archive closed tasks due more than this many days ago")
+parser.add_argument("--batch-size", type=int,
+                    default=app.config.get("ARCHIVE_BATCH_SIZE", BATCH_SIZE),
+                    help="tasks moved per transaction")
+args = parser.parse_args()
+
+with app.app_context():
+    connection = connect(db.engine.url.database)
+try:
+    moved = archive_closed_tasks(connection, args.after_days, args.batch_size)
+finally:
+    connection.close()
+print(f"{moved} task(s) archived")
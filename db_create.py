@@ -3,8 +3,13 @@
 
 from datetime import date
 
-from project import db
+from project import create_app, db
+from project.migrations import stamp
 from project.models import Task, User
+
+app = create_app()
+app.app_context().push()
+
 # create the database and the db table
 db.create_all()
 
@@ -19,3 +24,6 @@ db.create_all()
 
 # commit
 db.session.commit()
+
+# a fresh database already has the latest schema
+stamp(db.engine.url.database)
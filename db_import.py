@@ -0,0 +1,28 @@
+# project/db_import.py
+# Bulk-load tasks from a CSV or NDJSON file
+
+import argparse
+
+from project import create_app
+from project.tasks import transfer
+
+parser = argparse.ArgumentParser(description="Import tasks in batches.")
+parser.add_argument("path", help="a .csv or .ndjson file")
+parser.add_argument("--format", choices=sorted(transfer.READERS),
+                    help="defaults to the file extension")
+parser.add_argument("--user-id", type=int, default=None,
+                    help="owner of the imported tasks; "
+                         "without it the user_id column of each row is kept")
+parser.add_argument("--batch-size", type=int, default=transfer.BATCH_SIZE)
+args = parser.parse_args()
+
+fmt = args.format or args.path.rsplit(".", 1)[-1].lower()
+if fmt not in transfer.READERS:
+    parser.error("pass --format for files without a .csv/.ndjson extension")
+with create_app().app_context(), open(args.path, "rb") as stream:
+    imported, failed, errors = transfer.import_tasks(
+        transfer.READERS[fmt](stream), args.user_id, args.batch_size)
+
+print(f"{imported} task(s) imported, {failed} row(s) rejected")
+for number, messages in errors:
+    print(f"row {number}: {' '.join(messages)}")
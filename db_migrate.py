@@ -1,40 +1,19 @@
 # project/db_migrate.py
+# Bring an existing database up to the current schema version
 
-from views import db
-from _config import DATABASE_PATH
+import argparse
 
-import sqlite3
-from datetime import datetime
+from project import create_app, db
+from project.migrations import BATCH_SIZE, upgrade
 
-with sqlite3.connect(DATABASE_PATH) as connection:
-
-    c = connection.cursor()
-    # # change the name of tasks table
-    # c.execute("""ALTER TABLE tasks RENAME TO old_tasks""")
-    # # create a new tasks table with updated schema
-    # db.create_all()
-    # # retrieve data from old tasks table
-    # c.execute("""SELECT name,due_date, priority, status
-    #              FROM old_tasks ORDER BY task_id ASC""")
-    # # save all rows as a list of tuples with user+id = 1
-    # data = [(row[0], row[1], row[2], row[3],
-    #          datetime.now(), 1) for row in c.fetchall()]
-    # # insert data to tasks table
-    # c.executemany("""INSERT INTO tasks ( name, due_date, priority, status,
-    #                  posted_date, user_id) VALUES (?, ?, ?, ?, ?, ?)""", data)
-    # # delete old tasks table
-    # c.execute("DROP TABLE old_tasks")
-        # change the name of tasks table
-    c.execute("""ALTER TABLE Users RENAME TO old_users""")
-    # create a new tasks table with updated schema
-    db.create_all()
-    # retrieve data from old tasks table
-    c.execute("""SELECT name, email, password
-                 FROM old_users ORDER BY id ASC""")
-    # save all rows as a list of tuples with user+id = 1
-    data = [(row[0], row[1], row[2], "user") for row in c.fetchall()]
-    # insert data to tasks table
-    c.executemany("""INSERT INTO users ( name, email, password, role) VALUES (?, ?, ?, ?)""", data)
-    # delete old tasks table
-    c.execute("DROP TABLE old_users")
+parser = argparse.ArgumentParser(description="Apply pending schema migrations.")
+parser.add_argument("--target", type=int, default=None,
+                    help="stop after this schema version")
+parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                    help="rows copied per transaction when rebuilding tables")
+args = parser.parse_args()
 
+with create_app().app_context():
+    path = db.engine.url.database
+version = upgrade(path, args.target, args.batch_size)
+print(f"Database is at schema version {version}")
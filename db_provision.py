@@ -0,0 +1,21 @@
+# project/db_provision.py
+# Create user accounts in bulk from a CSV file (name, email, password and
+# optionally role); passwords are hashed across BCRYPT_WORKERS processes
+
+import argparse
+
+from project import create_app
+from project.users import provisioning
+
+parser = argparse.ArgumentParser(description="Provision users from a CSV file.")
+parser.add_argument("path", help="a .csv file with a header row")
+parser.add_argument("--batch-size", type=int, default=provisioning.BATCH_SIZE)
+args = parser.parse_args()
+
+with create_app().app_context(), open(args.path, "rb") as stream:
+    created, failed, errors = provisioning.provision_users(
+        provisioning.read_csv(stream), args.batch_size)
+
+print(f"{created} user(s) created, {failed} row(s) rejected")
+for number, messages in errors:
+    print(f"row {number}: {' '.join(messages)}")
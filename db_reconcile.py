@@ -0,0 +1,14 @@
+# project/db_reconcile.py
+# Recount the task summary table from tasks and repair any drift; safe to
+# run from cron while the app is serving
+
+from project import create_app, db
+from project.migrations import connect, reconcile_summary
+
+with create_app().app_context():
+    connection = connect(db.engine.url.database)
+try:
+    fixed = reconcile_summary(connection)
+finally:
+    connection.close()
+print(f"{fixed} summary row(s) repaired")
@@ -0,0 +1,13 @@
+# project/db_reindex.py
+# Rebuild the full-text search indexes from the tasks and tasks_archive tables
+
+from project import create_app, db
+from project.migrations import connect, rebuild_search_index
+
+with create_app().app_context():
+    connection = connect(db.engine.url.database)
+try:
+    rebuild_search_index(connection)
+finally:
+    connection.close()
+print("Search indexes rebuilt")
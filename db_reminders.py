@@ -0,0 +1,62 @@
+# project/db_reminders.py
+# Reminder worker: sends a reminder for every open task entering its lead
+# window. Any number of these can run side by side against one database.
+
+import argparse
+import signal
+import sys
+import threading
+
+from project import create_app, db
+from project.migrations import connect
+from project.reminders import (BATCH_SIZE, LEAD_DAYS, LEASE_SECONDS,
+                               POLL_INTERVAL, ReminderWorker, load_sink)
+
+app = create_app()
+metrics = app.extensions["metrics"]
+
+parser = argparse.ArgumentParser(description="Send task due-date reminders.")
+parser.add_argument("--sink", default=app.config.get("REMINDER_SINK", "stdout"),
+                    help="stdout, file:<path> or <module>:<factory>")
+parser.add_argument("--lead-days", type=int,
+                    default=app.config.get("REMINDER_LEAD_DAYS", LEAD_DAYS),
+                    help="remind about tasks due within this many days")
+parser.add_argument("--batch-size", type=int,
+                    default=app.config.get("REMINDER_BATCH_SIZE", BATCH_SIZE),
+                    help="reminders claimed per batch")
+parser.add_argument("--lease-seconds", type=int,
+                    default=app.config.get("REMINDER_LEASE_SECONDS", LEASE_SECONDS),
+                    help="how long a claimed batch is kept from other workers")
+parser.add_argument("--interval", type=float,
+                    default=app.config.get("REMINDER_POLL_INTERVAL", POLL_INTERVAL),
+                    help="seconds between polls once the backlog is drained")
+parser.add_argument("--once", action="store_true",
+                    help="drain the current backlog and exit")
+args = parser.parse_args()
+
+with app.app_context():
+    connection = connect(db.engine.url.database)
+worker = ReminderWorker(connection, load_sink(args.sink), args.batch_size,
+                        args.lease_seconds, args.lead_days,
+                        registry=metrics.registry)
+
+
+def report(stats):
+    # stderr, so the stdout sink's output stays clean
+    print(" ".join(f"{key}={value}" for key, value in stats.items()),
+          file=sys.stderr, flush=True)
+    metrics.flush()
+
+
+stopping = threading.Event()
+signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+try:
+    if args.once:
+        while worker.run_once() == args.batch_size and not stopping.is_set():
+            pass
+    else:
+        worker.run(stopping, args.interval, report)
+finally:
+    report(worker.stats())
+    connection.close()
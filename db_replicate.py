@@ -0,0 +1,34 @@
+# project/db_replicate.py
+# Keep the local read replica (SQLALCHEMY_READ_DATABASE_URI) in step with
+# the primary database by copying it over every few seconds
+
+import argparse
+import signal
+import threading
+
+from project import create_app, db
+from project.replica import REPLICA_BIND, SYNC_INTERVAL, has_replica, sync_replica
+
+app = create_app()
+
+parser = argparse.ArgumentParser(description="Refresh the read replica.")
+parser.add_argument("--interval", type=float,
+                    default=app.config.get("REPLICA_SYNC_INTERVAL", SYNC_INTERVAL),
+                    help="seconds between copies")
+parser.add_argument("--once", action="store_true", help="copy once and exit")
+args = parser.parse_args()
+
+if not has_replica(app):
+    parser.error("SQLALCHEMY_READ_DATABASE_URI is not set")
+with app.app_context():
+    primary = db.engine.url.database
+    replica = db.get_engine(app, bind=REPLICA_BIND).url.database
+
+stopping = threading.Event()
+signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+while True:
+    sync_replica(primary, replica)
+    if args.once or stopping.wait(args.interval):
+        break
+print(f"Replica {replica} is in step with {primary}")
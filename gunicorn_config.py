@@ -0,0 +1,109 @@
+# gunicorn_config.py
+# Production server settings, all overridable from the environment:
+#
+#     gunicorn -c gunicorn_config.py wsgi:app
+
+import logging
+import multiprocessing
+import os
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() in ("1", "true", "yes", "on")
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# WEB_CONCURRENCY is what Heroku sets from the dyno size
+workers = env_int("GUNICORN_WORKERS", os.environ.get(
+    "WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# sync, gthread or gevent; gthread overlaps requests waiting on I/O while
+# SQLite still serializes the writes
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = env_int("GUNICORN_THREADS", 4)
+
+# load the app once in the master and fork it: faster restarts and shared
+# memory pages; post_fork below drops whatever the master had opened
+preload_app = env_bool("GUNICORN_PRELOAD", True)
+
+# seconds an idle client connection is kept open (behind a proxy)
+keepalive = env_int("GUNICORN_KEEPALIVE", 5)
+# recycle workers now and then to cap slow leaks; the jitter keeps them
+# from all restarting at once
+max_requests = env_int("GUNICORN_MAX_REQUESTS", 1000)
+max_requests_jitter = env_int("GUNICORN_MAX_REQUESTS_JITTER", 100)
+timeout = env_int("GUNICORN_TIMEOUT", 30)
+graceful_timeout = env_int("GUNICORN_GRACEFUL_TIMEOUT", 30)
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+
+
+def app_logging(level):
+    # the app's own loggers (project.*) have no handler of their own, so
+    # Python drops anything below WARNING, the engine report at startup
+    # included; send them to stderr next to gunicorn's error log. This
+    # runs in the master before the app is loaded, workers inherit it.
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(
+        "%(asctime)s [%(process)d] [%(levelname)s] %(name)s: %(message)s",
+        "[%Y-%m-%d %H:%M:%S %z]"))
+    logger = logging.getLogger("project")
+    logger.setLevel(level)
+    logger.addHandler(handler)
+
+
+app_logging(os.environ.get("GUNICORN_APP_LOG_LEVEL", "INFO").upper())
+
+
+def load_config():
+    from flask import Config
+
+    # only the settings are needed here, not a whole app
+    config = Config(os.path.join(os.path.dirname(__file__), "project"))
+    config.from_pyfile("_config.py")
+    return config
+
+
+def on_starting(server):
+    from project.metrics import archive_snapshots
+    from project.selfcheck import worker_model_warnings
+
+    config = load_config()
+    cfg = server.cfg
+    for warning in worker_model_warnings(
+            config, cfg.workers, cfg.threads, cfg.worker_class_str,
+            cfg.timeout):
+        server.log.warning("Self-check: %s", warning)
+    # no worker is running yet, so every snapshot left is from a dead one
+    if config.get("METRICS_DIR") and os.path.isdir(config["METRICS_DIR"]):
+        archive_snapshots(config["METRICS_DIR"])
+
+
+def post_fork(server, worker):
+    # pooled SQLite connections must not cross a fork, the read replica's
+    # (and any other bind's) no more than the primary's
+    from project import db
+    from wsgi import app
+    with app.app_context():
+        for bind in [None, *(app.config.get("SQLALCHEMY_BINDS") or {})]:
+            db.get_engine(app, bind=bind).dispose()
+
+
+def worker_exit(server, worker):
+    # a clean exit (max_requests, restart): archive everything counted
+    from wsgi import app
+    app.extensions["metrics"].retire()
+
+
+def child_exit(server, worker):
+    # in the master; catches workers killed before worker_exit ran, with
+    # whatever they flushed last
+    from project.metrics import archive_snapshots
+
+    directory = load_config().get("METRICS_DIR")
+    if directory and os.path.isdir(directory):
+        archive_snapshots(directory, [worker.pid])
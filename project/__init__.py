@@ -1,40 +1,98 @@
 # project/__init__.py
 import datetime
-from flask import Flask, render_template, request
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, current_app, render_template, request
 from flask_bcrypt import Bcrypt
 
-app = Flask(__name__)
-app.config.from_pyfile("_config.py")
-bcrypt = Bcrypt(app)
-db = SQLAlchemy(app)
+from project.assets import Assets
+from project.cache import FragmentCache
+from project.compression import Compression
+from project.engine import configure_engine
+from project.hashing import HasherBusy, PasswordHasher
+from project.log_writer import ErrorLog
+from project.metrics import Metrics
+from project.profiling import SQLProfiler
+from project.replica import RoutingSQLAlchemy, configure_replica
 
-from project.users.views import users_blueprint
-from project.tasks.views import tasks_blueprint
+# extensions are created unbound and attached to each app by create_app
+bcrypt = Bcrypt()
+db = RoutingSQLAlchemy()
+fragment_cache = FragmentCache()
+error_log = ErrorLog()
+password_hasher = PasswordHasher()
+metrics = Metrics()
+compression = Compression()
+assets = Assets()
+sql_profiler = SQLProfiler()
+
+
+def create_app(config=None):
+    # config is an object, a dict or a module path whose settings override
+    # _config.py; with one given, _config.py is optional
+    app = Flask(__name__)
+    app.config.from_pyfile("_config.py", silent=config is not None)
+    if isinstance(config, dict):
+        app.config.from_mapping(config)
+    elif config is not None:
+        app.config.from_object(config)
+
+    bcrypt.init_app(app)
+    configure_replica(app)
+    db.init_app(app)
+    configure_engine(app)
+    fragment_cache.init_app(app)
+    error_log.init_app(app)
+    password_hasher.init_app(app)
+    metrics.init_app(app)
+    sql_profiler.init_app(app)
+    compression.init_app(app)
+    assets.init_app(app)
+
+    # the views (and the forms and models behind them) are only imported
+    # once an app is actually built
+    from project.users.views import users_blueprint
+    from project.tasks.views import tasks_blueprint
+    from project.api.views import api_blueprint
+
+    # register blueprints
+    app.register_blueprint(users_blueprint)
+    app.register_blueprint(tasks_blueprint)
+    app.register_blueprint(api_blueprint)
+
+    app.register_error_handler(404, page_not_found)
+    app.register_error_handler(500, internal_error)
+    app.register_error_handler(HasherBusy, hasher_busy)
+    return app
+
+
+def __getattr__(name):
+    # "from project import app" still works: the default app is built from
+    # _config.py on first use instead of at import time
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def log_error(code):
+    # queued for the background writer, the request never waits on the file
+    now = datetime.datetime.now()
+    current_timestamp = now.strftime("%d-%m-%Y %H:%M:%S")
+    error_log.write(f"{code} error at {current_timestamp}: {request.url}")
 
-# register blueprints
-app.register_blueprint(users_blueprint)
-app.register_blueprint(tasks_blueprint)
 
-@app.errorhandler(404)
 def page_not_found(error):
-    if app.debug is not True:
-        now = datetime.datetime.now()
-        r = request.url
-        with open("error.log", "a") as f:
-            current_timestamp = now.strftime("%d-%m-%Y %H:%M:%S")
-            f.write(f"\n404 error at {current_timestamp}: {r}")
+    if current_app.debug is not True:
+        log_error(404)
     return render_template("404.html"), 404
 
 
-@app.errorhandler(500)
 def internal_error(error):
     db.session.rollback()
-    if app.debug is not True:
-        now = datetime.datetime.now()
-        r = request.url
-        with open("error.log", "a") as f:
-            current_timestamp = now.strftime("%d-%m-%Y %H:%M:%S")
-            f.write(f"\n500 error at {current_timestamp}: {r}")
+    if current_app.debug is not True:
+        log_error(500)
     return render_template("500.html"), 500
 
+
+def hasher_busy(error):
+    # all password hashing slots are taken; fail fast instead of queueing
+    return render_template("503.html"), 503, {"Retry-After": "1"}
@@ -0,0 +1,177 @@
+import hashlib
+from functools import wraps
+from flask import jsonify, request, session, Blueprint, current_app
+from werkzeug.datastructures import MultiDict
+
+from project import db, fragment_cache, sql_profiler
+from project.csrf import generate_masked_csrf
+from project.models import TaskVersion, task_rows
+from project.pagination import keyset_page
+from project.replica import replica_reads
+from project.search import search_tasks
+from project.tasks.forms import ClaimTaskForm
+from project.tasks.views import open_tasks, closed_tasks, top_tasks, \
+    claim_next_task, LIST_ENTITIES, STATUS_CODES
+
+
+################
+#### config ####
+################
+
+api_blueprint = Blueprint("api", __name__, url_prefix="/api")
+
+
+##########################
+#### helper functions ####
+##########################
+
+def login_required(test):
+    @wraps(test)
+    def wrap(*args, **kwargs):
+        if "logged_in" in session:
+            return test(*args, **kwargs)
+        else:
+            response = jsonify(error="You need to login first.")
+            response.status_code = 401
+            return response
+    return wrap
+
+
+def task_etag(*parts):
+    # the viewer is part of the tag because can_modify depends on them
+    key = ":".join(str(part) for part in (
+        session["user_id"], session["role"]) + parts)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def csrf_valid():
+    # the same token the form routes check, sent as a csrf_token form field
+    # or an X-CSRFToken header
+    token = request.form.get("csrf_token") or request.headers.get("X-CSRFToken")
+    return ClaimTaskForm(formdata=MultiDict(dict(csrf_token=token or ""))).validate()
+
+
+def serialize(task):
+    return dict(
+        task_id=task.task_id,
+        name=task.name,
+        due_date=task.due_date.isoformat(),
+        priority=task.priority,
+        posted_date=task.posted_date.isoformat() if task.posted_date else None,
+        status=task.status,
+        user_id=task.user_id,
+        poster=task.poster_name,
+        claimed_by=task.claimed_by,
+        can_modify=task.user_id == session["user_id"] or session["role"] == "admin"
+    )
+
+
+################
+#### routes ####
+################
+
+@api_blueprint.route("/tasks/<any(open, closed):status>/")
+@login_required
+@replica_reads
+def tasks(status):
+    owner = request.args.get("owner", type=int)
+    cursor = request.args.get("after")
+    per_page = request.args.get(
+        "limit", current_app.config.get("TASKS_PER_PAGE", 25), type=int)
+    per_page = max(1, min(per_page, current_app.config.get("API_MAX_PER_PAGE", 100)))
+    # a conditional GET only costs the version lookup: no task query and no
+    # serialization when the client's copy is still current
+    version = TaskVersion.current(owner or 0)
+    etag = task_etag(status, owner, cursor, per_page, version)
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    query = open_tasks() if status == "open" else closed_tasks()
+    entity = LIST_ENTITIES[status]
+    if owner:
+        query = query.filter(entity.user_id == owner)
+    rows, next_cursor = keyset_page(
+        query, cursor, per_page, entity.due_date, entity.task_id)
+    response = jsonify(tasks=[serialize(task) for task in task_rows(rows)],
+                       next=next_cursor)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@api_blueprint.route("/tasks/next/")
+@login_required
+@replica_reads
+def next_tasks():
+    limit = request.args.get(
+        "limit", current_app.config.get("TASKS_NEXT_LIMIT", 10), type=int)
+    limit = max(1, min(limit, current_app.config.get("API_MAX_PER_PAGE", 100)))
+    rows = top_tasks(session["user_id"], limit)
+    # the token for claiming from the queue
+    return jsonify(tasks=[serialize(task) for task in task_rows(rows)],
+                   csrf_token=generate_masked_csrf())
+
+
+@api_blueprint.route("/tasks/claim/", methods=["POST"])
+@login_required
+def claim_next():
+    if not csrf_valid():
+        response = jsonify(error="The CSRF token is missing or invalid.")
+        response.status_code = 400
+        return response
+    task = claim_next_task(session["user_id"])
+    db.session.commit()
+    if task is None:
+        response = jsonify(error="There are no unclaimed open tasks.")
+        response.status_code = 404
+        return response
+    return jsonify(task=serialize(task))
+
+
+@api_blueprint.route("/tasks/search/")
+@login_required
+@replica_reads
+def search():
+    status = request.args.get("status")
+    if status is not None and status not in STATUS_CODES:
+        response = jsonify(error="status must be open or closed.")
+        response.status_code = 400
+        return response
+    page = max(1, request.args.get("page", 1, type=int))
+    per_page = request.args.get(
+        "limit", current_app.config.get("TASKS_PER_PAGE", 25), type=int)
+    per_page = max(1, min(per_page, current_app.config.get("API_MAX_PER_PAGE", 100)))
+    rows, has_more = search_tasks(
+        request.args.get("q", ""),
+        STATUS_CODES.get(status),
+        request.args.get("owner", type=int),
+        page,
+        per_page
+    )
+    return jsonify(
+        tasks=[serialize(task) for task in rows],
+        next=page + 1 if has_more else None
+    )
+
+
+@api_blueprint.route("/stats/cache/")
+@login_required
+def cache_stats():
+    if session["role"] != "admin":
+        response = jsonify(error="Only admins can see cache statistics.")
+        response.status_code = 403
+        return response
+    return jsonify(fragment_cache.stats())
+
+
+@api_blueprint.route("/stats/sql/")
+@login_required
+def sql_stats():
+    if session["role"] != "admin":
+        response = jsonify(error="Only admins can see SQL statistics.")
+        response.status_code = 403
+        return response
+    return jsonify(sql_profiler.stats())
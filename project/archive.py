@@ -0,0 +1,43 @@
+# project/archive.py
+# Move closed tasks out of the hot tasks table into tasks_archive, a small
+# batch per transaction so the app's writers are never locked out for long
+
+import datetime
+
+ARCHIVE_AFTER_DAYS = 90
+BATCH_SIZE = 500
+
+COLUMNS = ("task_id", "name", "due_date", "priority", "posted_date",
+           "status", "user_id")
+
+
+def archive_closed_tasks(connection, after_days=ARCHIVE_AFTER_DAYS,
+                         batch_size=BATCH_SIZE, today=None):
+    # Closed tasks whose due date is more than after_days in the past are
+    # copied and deleted in the same transaction. The triggers keep the
+    # summary counters unchanged: the archive insert adds back what the
+    # delete from tasks takes away. Returns the number of tasks moved.
+    cutoff = (today or datetime.date.today()) - datetime.timedelta(days=after_days)
+    column_list = ", ".join(COLUMNS)
+    moved = 0
+    while True:
+        connection.execute("BEGIN IMMEDIATE")
+        task_ids = [row[0] for row in connection.execute(
+            "SELECT task_id FROM tasks WHERE status = 0 AND due_date < ? "
+            "ORDER BY due_date LIMIT ?",
+            (cutoff.isoformat(), batch_size)
+        )]
+        if not task_ids:
+            connection.execute("COMMIT")
+            return moved
+        placeholders = ", ".join("?" * len(task_ids))
+        connection.execute(
+            f"INSERT INTO tasks_archive ({column_list}, archived_at) "
+            f"SELECT {column_list}, datetime('now') FROM tasks "
+            f"WHERE task_id IN ({placeholders})",
+            task_ids
+        )
+        connection.execute(
+            f"DELETE FROM tasks WHERE task_id IN ({placeholders})", task_ids)
+        connection.execute("COMMIT")
+        moved += len(task_ids)
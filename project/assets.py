@@ -0,0 +1,113 @@
+# project/assets.py
+# Fingerprinted static assets. Every file under static/ is also served as
+# <name>.<content hash>.<ext> with a year-long immutable Cache-Control, and
+# templates link to that name through asset_url(), so browsers only ever
+# fetch an asset again once its content has changed.
+#
+# build_assets.py writes the name mapping to static/manifest.json, along
+# with gzip (and brotli) copies of every asset; without a manifest the
+# static folder is hashed when the app starts.
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+from flask import current_app, request, send_from_directory, url_for
+
+from project.compression import accepted_encoding, brotli
+
+MANIFEST = "manifest.json"
+IMMUTABLE = "public, max-age=31536000, immutable"
+# precompressed copies next to each asset, by Content-Encoding
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def fingerprint(path):
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()[:12]
+
+
+def fingerprinted_name(filename, digest):
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.{digest}{ext}"
+
+
+def static_files(static_folder):
+    for root, _, files in os.walk(static_folder):
+        for name in sorted(files):
+            if name == MANIFEST or name.endswith(tuple(SUFFIXES.values())):
+                continue
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, static_folder).replace(os.sep, "/"), path
+
+
+def build_manifest(static_folder):
+    # {"css/main.css": "css/main.3f2a9c1be04d.css", ...}
+    return {filename: fingerprinted_name(filename, fingerprint(path))
+            for filename, path in static_files(static_folder)}
+
+
+def build(static_folder, brotli_quality=11):
+    # the build step: precompress every asset once, at the highest levels,
+    # then write the manifest; returns it
+    manifest = build_manifest(static_folder)
+    for filename, path in static_files(static_folder):
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(path + SUFFIXES["gzip"], "wb") as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(path + SUFFIXES["br"], "wb") as f:
+                f.write(brotli.compress(data, quality=brotli_quality))
+    with open(os.path.join(static_folder, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class Assets(object):
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        path = os.path.join(app.static_folder, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+        else:
+            manifest = build_manifest(app.static_folder)
+        app.extensions["assets"] = dict(
+            manifest=manifest,
+            sources={name: source for source, name in manifest.items()})
+        app.add_template_global(asset_url)
+        # fingerprinted names are answered by the static endpoint too
+        app.view_functions["static"] = static
+
+
+def asset_url(filename):
+    manifest = current_app.extensions["assets"]["manifest"]
+    return url_for("static", filename=manifest.get(filename, filename))
+
+
+def static(filename):
+    source = current_app.extensions["assets"]["sources"].get(filename)
+    if source is None:
+        return current_app.send_static_file(filename)
+    # the name changes with the content, so the file can be cached forever
+    folder = current_app.static_folder
+    available = [encoding for encoding, suffix in SUFFIXES.items()
+                 if os.path.exists(os.path.join(folder, source + suffix))]
+    encoding = accepted_encoding(request.accept_encodings, available) \
+        if available else None
+    response = send_from_directory(
+        folder, source + SUFFIXES[encoding] if encoding else source,
+        mimetype=mimetypes.guess_type(source)[0] or "application/octet-stream")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = IMMUTABLE
+    response.expires = None
+    return response
@@ -0,0 +1,172 @@
+# project/cache.py
+# Size-bounded LRU cache for rendered page fragments, with an optional
+# SQLite-file backend shared by every worker process
+
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class SQLiteBackend(object):
+    # Keys carry the data version, so stale entries are never read again;
+    # the table only has to be trimmed to max_entries now and then.
+
+    def __init__(self, path, max_entries=1024):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS fragments "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _connection(self):
+        # per thread and per process: a preloaded app forks with the
+        # master's connection still in its thread-local
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        try:
+            row = self._connection().execute(
+                "SELECT value FROM fragments WHERE key = ?", (key,)).fetchone()
+        except sqlite3.OperationalError:
+            # locked or unreadable: a miss, the fragment is rendered again
+            return None
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        connection = self._connection()
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO fragments (key, value) VALUES (?, ?)",
+                (key, json.dumps(value)))
+            self._writes += 1
+            if self._writes % 64 == 0:
+                connection.execute(
+                    "DELETE FROM fragments WHERE rowid <= "
+                    "(SELECT max(rowid) FROM fragments) - ?",
+                    (self.max_entries,))
+        except sqlite3.OperationalError:
+            # a busy shared cache must never fail the request
+            pass
+
+    def clear(self):
+        self._connection().execute("DELETE FROM fragments")
+
+
+class FragmentStore(object):
+    # one app's cache: the in-process LRU in front of the optional backend
+
+    def __init__(self, max_entries=128, max_bytes=16 * 1024 * 1024, backend=None):
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self.size = 0
+        self.hits = self.shared_hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+        value = self.backend.get(key) if self.backend is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+        self._store(key, value)
+        return value
+
+    def set(self, key, value):
+        self._store(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value)
+
+    def _store(self, key, value):
+        cost = self._cost(key, value)
+        if cost > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.size -= self._cost(key, self._items.pop(key))
+            self._items[key] = value
+            self.size += cost
+            while len(self._items) > self.max_entries or self.size > self.max_bytes:
+                old_key, old_value = self._items.popitem(last=False)
+                self.size -= self._cost(old_key, old_value)
+                self.evictions += 1
+
+    @staticmethod
+    def _cost(key, value):
+        return len(key) + sum(len(part or "") for part in value)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return dict(
+                entries=len(self._items),
+                max_entries=self.max_entries,
+                bytes=self.size,
+                max_bytes=self.max_bytes,
+                hits=self.hits,
+                shared_hits=self.shared_hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hit_ratio=(self.hits + self.shared_hits) / lookups if lookups else 0.0
+            )
+
+
+class FragmentCache(object):
+    # The extension. Every app gets its own FragmentStore, kept in
+    # app.extensions, so building a second app never touches the first.
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        path = config.get("FRAGMENT_CACHE_BACKEND")
+        backend = SQLiteBackend(
+            path, config.get("FRAGMENT_CACHE_BACKEND_ENTRIES", 1024)) if path else None
+        app.extensions["fragment_cache"] = FragmentStore(
+            config.get("FRAGMENT_CACHE_ENTRIES", 128),
+            config.get("FRAGMENT_CACHE_MAX_BYTES", 16 * 1024 * 1024),
+            backend)
+
+    @property
+    def store(self):
+        return current_app.extensions["fragment_cache"]
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value):
+        self.store.set(key, value)
+
+    def clear(self):
+        self.store.clear()
+
+    def stats(self):
+        return self.store.stats()
@@ -0,0 +1,119 @@
+# project/compression.py
+# gzip/brotli response compression, plus ETags on JSON responses so a
+# repeat request for unchanged data is answered with an empty 304. Brotli is
+# used when the brotli package is installed and the client asks for it.
+#
+# Pages with forms are compressed too: their CSRF token is masked afresh
+# for every response (project/csrf.py), so BREACH has no stable secret to
+# recover from the compressed size. HTML pages get no ETag, since the
+# masked token makes each copy different anyway.
+
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULTS = dict(
+    COMPRESS_MIN_SIZE=500,
+    COMPRESS_LEVEL=6,
+    # brotli's 0-11 scale; 11 is for precompressed assets, not per request
+    COMPRESS_BROTLI_QUALITY=4,
+    COMPRESS_MIMETYPES=("text/html", "text/css", "text/csv", "text/plain",
+                        "application/json", "application/x-ndjson",
+                        "application/javascript"),
+)
+
+
+def accepted_encoding(accept_encodings, available):
+    # the client's preferred encoding among those on offer, if any
+    best = max(available, key=lambda encoding: accept_encodings[encoding])
+    return best if accept_encodings[best] else None
+
+
+def encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def gzip_compressor(config):
+    # wbits 31: a gzip header and trailer rather than a bare zlib stream
+    return zlib.compressobj(config["COMPRESS_LEVEL"], zlib.DEFLATED, 31)
+
+
+def compress(data, encoding, config):
+    if encoding == "br":
+        return brotli.compress(data, quality=config["COMPRESS_BROTLI_QUALITY"])
+    compressor = gzip_compressor(config)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding, config):
+    # every chunk is flushed as it comes so streamed pages still render
+    # progressively; the sync flushes cost a few bytes each
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=config["COMPRESS_BROTLI_QUALITY"])
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = gzip_compressor(config)
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+class Compression(object):
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        for key, value in DEFAULTS.items():
+            app.config.setdefault(key, value)
+        app.after_request(self._after_request)
+        app.extensions["compression"] = self
+
+    def _after_request(self, response):
+        if request.method == "GET" and response.status_code == 200 and \
+                response.mimetype == "application/json" and \
+                not response.is_streamed and "ETag" not in response.headers:
+            response.add_etag()
+            response.make_conditional(request)
+        return self.compress_response(response)
+
+    def compress_response(self, response):
+        config = current_app.config
+        response.vary.add("Accept-Encoding")
+        if response.status_code < 200 or response.status_code in (204, 304) or \
+                response.direct_passthrough or \
+                "Content-Encoding" in response.headers or \
+                response.mimetype not in config["COMPRESS_MIMETYPES"] or \
+                "no-transform" in response.headers.get("Cache-Control", ""):
+            return response
+        encoding = accepted_encoding(request.accept_encodings, encodings())
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = compress_stream(
+                response.iter_encoded(), encoding, config)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < config["COMPRESS_MIN_SIZE"]:
+                return response
+            response.set_data(compress(data, encoding, config))
+        response.headers["Content-Encoding"] = encoding
+        # the compressed bytes are a different representation of the same
+        # content, so a strong validator would be wrong
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
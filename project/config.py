@@ -0,0 +1,30 @@
+# project/config.py
+# Settings profiles for create_app; _config.py holds the deployment's own
+
+from sqlalchemy.pool import StaticPool
+
+
+class TestConfig(object):
+    TESTING = True
+    DEBUG = False
+    WTF_CSRF_ENABLED = False
+    SECRET_KEY = "test"
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # one in-memory database, shared by every session through a single
+    # connection; tests/base.py wraps each test in a transaction on it
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    SQLALCHEMY_ENGINE_OPTIONS = dict(
+        poolclass=StaticPool,
+        # the test transaction is driven by hand, see tests/base.py
+        connect_args=dict(check_same_thread=False, isolation_level=None)
+    )
+    # the cheapest work factor bcrypt accepts, hashed inline
+    BCRYPT_LOG_ROUNDS = 4
+    BCRYPT_WORKERS = 0
+    # every view is held to a query budget and must not scan the big
+    # tables; see project/profiling.py
+    SQL_PROFILING = True
+    SQL_QUERY_BUDGET_STRICT = True
+    SQL_QUERY_BUDGET = 6
+    SQL_FULL_SCAN_TABLES = ("tasks", "tasks_archive", "users")
+    SQL_FULL_SCAN_EXEMPT = ("tasks.export_tasks",)
@@ -0,0 +1,131 @@
+# project/engine.py
+# SQLite engine tuning: connection pool sizing and per-connection pragmas,
+# all driven by app config
+
+import logging
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+DEFAULTS = dict(
+    # WAL lets readers and a writer work at the same time
+    SQLITE_JOURNAL_MODE="WAL",
+    # NORMAL is durable across app crashes in WAL mode, only an OS crash
+    # can lose the last transactions
+    SQLITE_SYNCHRONOUS="NORMAL",
+    # milliseconds a connection waits on a lock before "database is locked"
+    SQLITE_BUSY_TIMEOUT=5000,
+    # negative values are KiB: 20 MB of page cache per connection
+    SQLITE_CACHE_SIZE=-20000,
+    SQLITE_MMAP_SIZE=256 * 1024 * 1024,
+    SQLITE_POOL_SIZE=5,
+    SQLITE_POOL_MAX_OVERFLOW=10,
+    SQLITE_POOL_TIMEOUT=30,
+)
+
+# what PRAGMA synchronous reads back for each level
+SYNCHRONOUS_LEVELS = dict(OFF=0, NORMAL=1, FULL=2, EXTRA=3)
+
+logger = logging.getLogger(__name__)
+
+
+def is_file_database(uri):
+    url = make_url(uri)
+    return url.drivername.startswith("sqlite") and \
+        url.database not in (None, "", ":memory:")
+
+
+def pragmas(config):
+    return [
+        ("journal_mode", config["SQLITE_JOURNAL_MODE"]),
+        ("synchronous", config["SQLITE_SYNCHRONOUS"]),
+        ("busy_timeout", int(config["SQLITE_BUSY_TIMEOUT"])),
+        ("cache_size", int(config["SQLITE_CACHE_SIZE"])),
+        ("mmap_size", int(config["SQLITE_MMAP_SIZE"])),
+    ]
+
+
+def ignored_pragmas(cursor, settings):
+    # the settings SQLite did not take, e.g. WAL on a filesystem without
+    # shared memory or an mmap_size above the compiled-in limit
+    ignored = []
+    for name, wanted in settings:
+        actual = cursor.execute(f"PRAGMA {name}").fetchone()[0]
+        if name == "journal_mode":
+            wanted, actual = str(wanted).lower(), str(actual).lower()
+        elif name == "synchronous":
+            wanted = SYNCHRONOUS_LEVELS.get(str(wanted).upper(), wanted)
+        if str(actual) != str(wanted):
+            ignored.append((name, wanted, actual))
+    return ignored
+
+
+def tune_engine(engine, settings, check):
+    # the listener belongs to this engine only, with its settings in the
+    # closure; other engines in the process keep SQLite's defaults
+    checked = []
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in settings:
+            cursor.execute(f"PRAGMA {name} = {value}")
+        if check and not checked:
+            checked.append(True)
+            for name, wanted, actual in ignored_pragmas(cursor, settings):
+                logger.warning(
+                    "SQLite %s is %s, not %s (%s)", name, actual, wanted, engine.url)
+        cursor.close()
+
+    return set_sqlite_pragmas
+
+
+def configure_engine(app):
+    config = app.config
+    for key, value in DEFAULTS.items():
+        config.setdefault(key, value)
+    settings = pragmas(config)
+
+    options = config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    if is_file_database(config["SQLALCHEMY_DATABASE_URI"]):
+        # SQLAlchemy defaults to NullPool for SQLite files, which reopens
+        # the file and replays the pragmas on every checkout
+        options.setdefault("poolclass", QueuePool)
+        options.setdefault("pool_size", config["SQLITE_POOL_SIZE"])
+        options.setdefault("max_overflow", config["SQLITE_POOL_MAX_OVERFLOW"])
+        options.setdefault("pool_timeout", config["SQLITE_POOL_TIMEOUT"])
+        # pooled connections move between threads, one thread at a time
+        options.setdefault("connect_args", {}).setdefault("check_same_thread", False)
+
+    # the primary and any binds (the read replica) of this app; the engines
+    # are created here, after the pool options above are in place
+    db = app.extensions["sqlalchemy"].db
+    uris = dict(config.get("SQLALCHEMY_BINDS") or {})
+    uris[None] = config["SQLALCHEMY_DATABASE_URI"]
+    for bind, uri in uris.items():
+        # in-memory databases keep journal_mode=memory whatever is asked
+        tune_engine(db.get_engine(app, bind=bind), settings, is_file_database(uri))
+
+    report = dict(settings)
+    report.update(
+        pool=getattr(options.get("poolclass"), "__name__", "default"),
+        pool_size=options.get("pool_size"),
+        max_overflow=options.get("max_overflow")
+    )
+    app.extensions["sqlite_engine"] = report
+    logger.info(
+        "SQLite engine: " + " ".join(f"{k}={v}" for k, v in report.items()))
+    return report
+
+
+def effective_pragmas(connection):
+    # what SQLite actually applied, e.g. journal_mode stays "memory" for
+    # in-memory databases whatever was asked for
+    return {
+        name: connection.execute(f"PRAGMA {name}").scalar()
+        for name, _ in pragmas(DEFAULTS)
+    }
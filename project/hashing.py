@@ -0,0 +1,115 @@
+# project/hashing.py
+# Password hashing on a bounded process pool, so bcrypt's key stretching
+# does not tie up web workers
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+from flask import current_app
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def _to_bytes(value):
+    return value.encode("utf-8") if isinstance(value, str) else value
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(
+        _to_bytes(password), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def check_password(pw_hash, password):
+    return bcrypt.checkpw(_to_bytes(password), _to_bytes(pw_hash))
+
+
+def hash_cost(pw_hash):
+    # "$2b$12$..." -> 12
+    try:
+        return int(_to_bytes(pw_hash).split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher(object):
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.pending = 0
+        self.bulk_pending = 0
+        self.rejected = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("BCRYPT_LOG_ROUNDS", 12)
+        # per web process: gunicorn already runs a process per CPU or more,
+        # so more than one here oversubscribes the CPUs (see selfcheck.py)
+        app.config.setdefault("BCRYPT_WORKERS", 1)
+        app.extensions["password_hasher"] = self
+
+    @property
+    def rounds(self):
+        return current_app.config["BCRYPT_LOG_ROUNDS"]
+
+    def _pool(self, workers):
+        # one pool per process, created after any fork
+        if self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+            self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, func, *args):
+        workers = current_app.config["BCRYPT_WORKERS"]
+        if not workers:
+            return func(*args)
+        max_pending = current_app.config.get("BCRYPT_QUEUE_DEPTH", workers * 4)
+        with self._lock:
+            if self.pending >= max_pending:
+                self.rejected += 1
+                raise HasherBusy()
+            self.pending += 1
+            pool = self._pool(workers)
+        try:
+            return pool.submit(func, *args).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def hash(self, password, rounds=None):
+        return self._run(hash_password, password, rounds or self.rounds)
+
+    def hash_many(self, passwords, rounds=None):
+        # Bulk hashing spread over the pool, one chunk of at most a hash per
+        # worker at a time. The chunks are not counted against the queue
+        # depth, which stays for logins alone; a login arriving meanwhile
+        # waits behind one chunk at most instead of being turned away.
+        rounds = rounds or self.rounds
+        workers = current_app.config["BCRYPT_WORKERS"]
+        if not workers:
+            return [hash_password(password, rounds) for password in passwords]
+        hashes = []
+        for start in range(0, len(passwords), workers):
+            chunk = passwords[start:start + workers]
+            with self._lock:
+                self.bulk_pending += len(chunk)
+                pool = self._pool(workers)
+            try:
+                hashes.extend(pool.map(
+                    hash_password, chunk, [rounds] * len(chunk)))
+            finally:
+                with self._lock:
+                    self.bulk_pending -= len(chunk)
+        return hashes
+
+    def check(self, pw_hash, password):
+        return self._run(check_password, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        return hash_cost(pw_hash) != self.rounds
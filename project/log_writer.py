@@ -0,0 +1,172 @@
+# project/log_writer.py
+# Queue-backed error log: request handlers only enqueue a line, a
+# background thread writes them out in batches and rotates the file by size
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+import weakref
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+
+# every writer in the process, flushed once at exit
+_writers = weakref.WeakSet()
+
+
+@atexit.register
+def _close_writers():
+    for writer in list(_writers):
+        writer.close()
+
+
+class ErrorLogWriter(object):
+    # one app's log file, its queue and its writer thread
+
+    def __init__(self):
+        self.path = "error.log"
+        self.max_bytes = 10 * 1024 * 1024
+        self.backup_count = 5
+        self.queue_size = 10000
+        self.batch_size = 500
+        # above this fill ratio only every sample_rate-th line is kept
+        self.sample_above = 0.8
+        self.sample_rate = 10
+        # seconds flush() (and so exit) waits for the writer at most
+        self.flush_timeout = 5.0
+        self.written = self.dropped = 0
+        self._seen_under_pressure = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        _writers.add(self)
+
+    def configure(self, config):
+        self.path = config.get("ERROR_LOG_PATH", self.path)
+        self.max_bytes = config.get("ERROR_LOG_MAX_BYTES", self.max_bytes)
+        self.backup_count = config.get("ERROR_LOG_BACKUP_COUNT", self.backup_count)
+        self.queue_size = config.get("ERROR_LOG_QUEUE_SIZE", self.queue_size)
+        self.batch_size = config.get("ERROR_LOG_BATCH_SIZE", self.batch_size)
+        self.sample_above = config.get("ERROR_LOG_SAMPLE_ABOVE", self.sample_above)
+        self.sample_rate = config.get("ERROR_LOG_SAMPLE_RATE", self.sample_rate)
+        self.flush_timeout = config.get("ERROR_LOG_FLUSH_TIMEOUT", self.flush_timeout)
+        return self
+
+    def _start(self):
+        # started lazily and again after a fork, since threads do not
+        # survive into preforked worker processes
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.queue_size)
+            self._thread = threading.Thread(
+                target=self._run, name="error-log-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def write(self, entry):
+        # never blocks: under back-pressure lines are sampled, then dropped
+        if self._pid != os.getpid():
+            self._start()
+        if self._queue.qsize() >= self.queue_size * self.sample_above:
+            self._seen_under_pressure += 1
+            if self._seen_under_pressure % self.sample_rate:
+                self.dropped += 1
+                return False
+        try:
+            self._queue.put_nowait("\n" + entry)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            lines = [self._queue.get()]
+            while len(lines) < self.batch_size:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(lines)
+            except Exception:
+                # one line at a time, so a bad line only costs itself and
+                # the thread keeps going whatever went wrong
+                for line in lines:
+                    try:
+                        self._write_batch([line])
+                    except Exception as error:
+                        self.dropped += 1
+                        logger.warning("Error log writer dropped a line: %r", error)
+            finally:
+                for _ in lines:
+                    self._queue.task_done()
+
+    def _write_batch(self, lines):
+        data = "".join(lines)
+        if self.max_bytes and os.path.exists(self.path) and \
+                os.path.getsize(self.path) + len(data) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "a") as f:
+            f.write(data)
+        self.written += len(lines)
+        self._seen_under_pressure = 0
+
+    def _rotate(self):
+        if self.backup_count < 1:
+            os.remove(self.path)
+            return
+        for number in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{number}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{number + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def flush(self, timeout=None):
+        # waits for the queued lines to be written, for flush_timeout seconds
+        # at most; False if they were not all written by then
+        if self._pid != os.getpid():
+            return True
+        timeout = self.flush_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        done = self._queue.all_tasks_done
+        with done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                done.wait(remaining)
+        return True
+
+    def close(self):
+        self.flush()
+
+    def stats(self):
+        return dict(
+            queued=self._queue.qsize() if self._pid == os.getpid() else 0,
+            written=self.written,
+            dropped=self.dropped
+        )
+
+
+class ErrorLog(object):
+    # The extension: each app writes through its own ErrorLogWriter, kept
+    # in app.extensions, so apps with different ERROR_LOG_* settings can
+    # live in one process.
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["error_log"] = ErrorLogWriter().configure(app.config)
+
+    def write(self, entry):
+        return current_app.extensions["error_log"].write(entry)
@@ -0,0 +1,367 @@
+# project/metrics.py
+# Request, SQL and template instrumentation exposed as Prometheus text on
+# /metrics. With METRICS_DIR set, every worker process drops a snapshot of
+# its (cumulative) metrics there and a scrape of any worker sums them all.
+# A process that exits folds its metrics into one archive snapshot, so the
+# directory does not grow with every worker ever started and a new process
+# reusing an old pid does not overwrite (and so lower) its counters.
+
+import atexit
+import fcntl
+import hmac
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import weakref
+
+from flask import current_app, g, has_request_context, request, session
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760)
+
+ARCHIVE = "metrics-archive.json"
+SNAPSHOT = re.compile(r"metrics-(\d+)\.json$")
+
+HELP = {
+    "flasktaskr_requests_total": ("counter", "Requests by endpoint and status."),
+    "flasktaskr_request_duration_seconds": ("histogram", "Time spent in the view and after-request hooks."),
+    "flasktaskr_response_size_bytes": ("histogram", "Size of non-streamed response bodies."),
+    "flasktaskr_sql_queries_per_request": ("histogram", "SQL statements executed per request."),
+    "flasktaskr_sql_seconds_per_request": ("histogram", "Time spent in SQL per request."),
+    "flasktaskr_template_render_seconds": ("histogram", "Time spent rendering each top-level template."),
+    "flasktaskr_reminders_total": ("counter", "Reminders handed to the sink, by outcome."),
+    "flasktaskr_reminder_delay_seconds": ("histogram", "Time from a reminder becoming due to it being sent."),
+}
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = dict(
+                    buckets=list(buckets), counts=[0] * len(buckets), sum=0.0, count=0)
+            for index, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][index] += 1
+                    break
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def snapshot(self, clear=False):
+        with self._lock:
+            snapshot = dict(
+                counters=[[name, list(labels), value]
+                          for (name, labels), value in self.counters.items()],
+                histograms=[[name, list(labels), dict(h, counts=list(h["counts"]))]
+                            for (name, labels), h in self.histograms.items()]
+            )
+            if clear:
+                self.counters = {}
+                self.histograms = {}
+            return snapshot
+
+
+def merge(snapshots):
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, histogram in snapshot["histograms"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            total = histograms.setdefault(key, dict(
+                buckets=histogram["buckets"],
+                counts=[0] * len(histogram["buckets"]), sum=0.0, count=0))
+            total["counts"] = [a + b for a, b in zip(total["counts"], histogram["counts"])]
+            total["sum"] += histogram["sum"]
+            total["count"] += histogram["count"]
+    return counters, histograms
+
+
+def unmerge(counters, histograms):
+    # merge() output back in snapshot form
+    return dict(
+        counters=[[name, list(labels), value]
+                  for (name, labels), value in counters.items()],
+        histograms=[[name, list(labels), histogram]
+                    for (name, labels), histogram in histograms.items()]
+    )
+
+
+def write_json(directory, name, data):
+    handle, path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(handle, "w") as f:
+        json.dump(data, f)
+    os.replace(path, os.path.join(directory, name))
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def directory_lock(directory, operation):
+    # scrapes read under a shared lock, archiving writes under an exclusive
+    # one, so a scrape never sees a snapshot both archived and still in place
+    handle = open(os.path.join(directory, "metrics.lock"), "a")
+    fcntl.flock(handle, operation)
+    return handle
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # running, as another user
+        pass
+    return True
+
+
+def archive_snapshots(directory, pids=None, current=None):
+    # fold the snapshots of exited processes (with pids=None, those of every
+    # process no longer running, e.g. from before a restart) into the
+    # archive; current is an exiting process's own registry, newer than
+    # the snapshot it last flushed
+    with directory_lock(directory, fcntl.LOCK_EX):
+        paths = []
+        for name in os.listdir(directory):
+            match = SNAPSHOT.match(name)
+            if not match:
+                continue
+            pid = int(match.group(1))
+            exited = not is_running(pid) if pids is None else pid in pids
+            if exited:
+                paths.append(os.path.join(directory, name))
+        if current is None:
+            snapshots = [read_json(path) for path in paths]
+        else:
+            snapshots = [current]
+        snapshots = [snapshot for snapshot in snapshots if snapshot and
+                     (snapshot["counters"] or snapshot["histograms"])]
+        if snapshots:
+            archive = read_json(os.path.join(directory, ARCHIVE))
+            if archive:
+                snapshots.append(archive)
+            write_json(directory, ARCHIVE, unmerge(*merge(snapshots)))
+        for path in paths:
+            os.remove(path)
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def render(counters, histograms):
+    lines = []
+    described = set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in described and name in HELP:
+            described.add(name)
+            lines.append(f"# HELP {name} {HELP[name][1]}")
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{format_labels(labels)} {value}")
+    for (name, labels), histogram in sorted(histograms.items()):
+        if name not in described and name in HELP:
+            described.add(name)
+            lines.append(f"# HELP {name} {HELP[name][1]}")
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, count in zip(histogram["buckets"], histogram["counts"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+        lines.append(f"{name}_sum{format_labels(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{format_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+# every app's metrics in the process, archived once at exit
+_stores = weakref.WeakSet()
+
+
+@atexit.register
+def _retire_stores():
+    for store in list(_stores):
+        store.retire()
+
+
+class MetricsStore(object):
+    # one app's registry and where its worker snapshots go
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.registry = Registry()
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._last_flush = 0.0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        _stores.add(self)
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.directory, f"metrics-{pid}.json")
+
+    def _maybe_flush(self, force=False):
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+        write_json(self.directory, os.path.basename(self._snapshot_path(os.getpid())),
+                   self.registry.snapshot())
+
+    def flush(self):
+        # for processes outside the request cycle, e.g. the reminder worker
+        self._maybe_flush(force=True)
+
+    def retire(self):
+        # on exit (atexit, gunicorn's worker_exit): hand everything counted
+        # so far to the archive; anything counted after starts from zero
+        if self.directory:
+            archive_snapshots(self.directory, [os.getpid()],
+                              self.registry.snapshot(clear=True))
+
+    def collect(self):
+        snapshots = [self.registry.snapshot()]
+        if self.directory:
+            own = self._snapshot_path(os.getpid())
+            with directory_lock(self.directory, fcntl.LOCK_SH):
+                for name in os.listdir(self.directory):
+                    path = os.path.join(self.directory, name)
+                    if not name.endswith(".json") or path == own:
+                        continue
+                    snapshot = read_json(path)
+                    if snapshot:
+                        snapshots.append(snapshot)
+        return merge(snapshots)
+
+
+class Metrics(object):
+    # The extension. Each app counts into its own MetricsStore, kept in
+    # app.extensions; the engine hooks are process-wide and only tally the
+    # current request's SQL on g.
+
+    def __init__(self, app=None):
+        self._engine_hooked = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        store = app.extensions["metrics"] = MetricsStore(
+            app.config.get("METRICS_DIR"),
+            app.config.get("METRICS_FLUSH_INTERVAL", 5.0))
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if not self._engine_hooked:
+            event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+            self._engine_hooked = True
+        app.jinja_env.template_class = timed_template_class(store.registry)
+        app.add_url_rule("/metrics", "metrics", self.view)
+
+    @property
+    def store(self):
+        return current_app.extensions["metrics"]
+
+    #### hooks ####
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.sql_queries = 0
+        g.sql_seconds = 0.0
+
+    def _after_request(self, response):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return response
+        endpoint = request.endpoint or "unmatched"
+        labels = dict(endpoint=endpoint)
+        store = self.store
+        registry = store.registry
+        registry.observe("flasktaskr_request_duration_seconds", labels,
+                         time.perf_counter() - started, LATENCY_BUCKETS)
+        registry.inc("flasktaskr_requests_total",
+                     dict(endpoint=endpoint, status=response.status_code))
+        registry.observe("flasktaskr_sql_queries_per_request", labels,
+                         g.sql_queries, QUERY_BUCKETS)
+        registry.observe("flasktaskr_sql_seconds_per_request", labels,
+                         g.sql_seconds, LATENCY_BUCKETS)
+        if not response.is_streamed:
+            registry.observe("flasktaskr_response_size_bytes", labels,
+                             response.calculate_content_length() or 0, SIZE_BUCKETS)
+        store._maybe_flush()
+        return response
+
+    # the start time rides on the execution context, so a statement that
+    # raises takes its own along instead of leaving it for the next one
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        if context is not None:
+            context.metrics_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        started = getattr(context, "metrics_started", None)
+        if started is None:
+            return
+        if has_request_context() and "sql_queries" in g:
+            g.sql_queries += 1
+            g.sql_seconds += time.perf_counter() - started
+
+    def view(self):
+        # for admins, and for scrapers sending METRICS_TOKEN as a bearer token
+        token = current_app.config.get("METRICS_TOKEN")
+        sent = request.headers.get("Authorization", "")
+        if not (token and hmac.compare_digest(sent, f"Bearer {token}")) and \
+                session.get("role") != "admin":
+            return "Only admins can see metrics.\n", 403, {
+                "Content-Type": "text/plain; charset=utf-8"}
+        return render(*self.store.collect()), 200, {
+            "Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+def timed_template_class(registry):
+
+    class TimedTemplate(Template):
+        def render(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return Template.render(self, *args, **kwargs)
+            finally:
+                registry.observe(
+                    "flasktaskr_template_render_seconds",
+                    dict(template=self.name or "string"),
+                    time.perf_counter() - started, LATENCY_BUCKETS)
+
+    return TimedTemplate
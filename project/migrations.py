@@ -0,0 +1,610 @@
+# project/migrations.py
+# Versioned schema migrations for the SQLite database.
+#
+# The schema version lives in PRAGMA user_version. Each migration is a
+# function taking an autocommit sqlite3 connection and a batch size; it is
+# expected to be safe to re-run if it was interrupted halfway.
+
+import re
+import sqlite3
+
+BATCH_SIZE = 5000
+
+MIGRATIONS = []
+
+INDEX_NAME = re.compile(r'INDEX\s+(?:IF NOT EXISTS\s+)?"?(\w+)"?', re.I)
+CREATE_TABLE = re.compile(r'^CREATE TABLE\s+"?\w+"?', re.I)
+
+
+def migration(version):
+    def register(func):
+        MIGRATIONS.append((version, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return register
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def connect(database_path):
+    # autocommit mode: every transaction below is opened explicitly and kept
+    # as short as possible so the app's workers are not locked out
+    connection = sqlite3.connect(database_path, timeout=30, isolation_level=None)
+    connection.execute("PRAGMA foreign_keys = OFF")
+    return connection
+
+
+def schema_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def set_schema_version(connection, version):
+    connection.execute(f"PRAGMA user_version = {int(version)}")
+
+
+def table_columns(connection, table):
+    return [row[1] for row in connection.execute(f"PRAGMA table_info({table})")]
+
+
+def copy_in_batches(connection, source, target, columns, expressions,
+                    start_after=0, batch_size=BATCH_SIZE):
+    # copy rows by rowid range, one short transaction per batch; rows that
+    # already exist in the target (written by the mirror triggers) win
+    column_list = ", ".join(columns)
+    select_list = ", ".join(e.format(src="src") for e in expressions)
+    last_rowid = start_after
+    copied = 0
+    while True:
+        upper = connection.execute(
+            f"SELECT max(rowid) FROM (SELECT rowid FROM {source} "
+            f"WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+            (last_rowid, batch_size)
+        ).fetchone()[0]
+        if upper is None:
+            return copied
+        connection.execute("BEGIN IMMEDIATE")
+        cursor = connection.execute(
+            f"INSERT OR IGNORE INTO {target} ({column_list}) "
+            f"SELECT {select_list} FROM {source} AS src "
+            f"WHERE src.rowid > ? AND src.rowid <= ?",
+            (last_rowid, upper)
+        )
+        connection.execute("COMMIT")
+        copied += cursor.rowcount
+        last_rowid = upper
+
+
+def table_sql(connection, table):
+    return connection.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (table,)).fetchone()[0]
+
+
+def index_name(index_sql):
+    return INDEX_NAME.search(index_sql).group(1)
+
+
+def table_indexes(connection, table):
+    # the table's own CREATE INDEX statements, with the table name replaced
+    # by {table}; indexes behind UNIQUE/PRIMARY KEY constraints have no SQL
+    # and come back with the table itself
+    on_table = re.compile(rf'\bON\s+"?{table}"?\s*\(')
+    return [on_table.sub("ON {table} (", sql, count=1) for (sql,) in connection.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? "
+        "AND sql IS NOT NULL ORDER BY name", (table,))]
+
+
+def table_triggers(connection, table):
+    return [sql for name, sql in connection.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' "
+        "AND tbl_name = ? ORDER BY name", (table,))
+        if not name.startswith(f"{table}_mirror_")]
+
+
+def table_sequence(connection, table):
+    # the last id an AUTOINCREMENT table handed out, or None
+    try:
+        row = connection.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    except sqlite3.OperationalError:
+        # no AUTOINCREMENT table exists yet
+        return None
+    return row[0] if row else None
+
+
+def rebuild_table(connection, table, create_sql, columns, expressions,
+                  batch_size=BATCH_SIZE, indexes=(), drop_indexes=(),
+                  after_swap=None):
+    # Online rebuild: create "<table>_new", mirror every write on the old
+    # table into it with triggers, backfill in batches, then swap the two
+    # inside one short transaction. The table's INTEGER PRIMARY KEY must be
+    # among the copied columns so rowids line up between old and new.
+    #
+    # The old table's indexes, plus the new ones in indexes (CREATE INDEX
+    # statements on {table}), are built on the empty new table before the
+    # backfill, so no index build ever holds the write lock over a full
+    # table. Index names are unique per database, so the old table loses
+    # its copies up front: until the swap its reads are slower, not
+    # blocked. The old table's own triggers are recreated at the swap;
+    # after_swap(connection), if given, runs in the same transaction.
+    new_table = f"{table}_new"
+    column_list = ", ".join(columns)
+    new_values = ", ".join(e.format(src="NEW") for e in expressions)
+    indexes = [sql for sql in table_indexes(connection, table) + list(indexes)
+               if index_name(sql) not in drop_indexes]
+
+    connection.execute("BEGIN IMMEDIATE")
+    for action in ("insert", "update", "delete"):
+        connection.execute(f"DROP TRIGGER IF EXISTS {table}_mirror_{action}")
+    connection.execute(f"DROP TABLE IF EXISTS {new_table}")
+    connection.execute(create_sql.format(table=new_table))
+    for index_sql in indexes:
+        connection.execute(f"DROP INDEX IF EXISTS {index_name(index_sql)}")
+        connection.execute(index_sql.format(table=new_table))
+    for name in drop_indexes:
+        connection.execute(f"DROP INDEX IF EXISTS {name}")
+    connection.execute(
+        f"CREATE TRIGGER {table}_mirror_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT OR REPLACE INTO {new_table} ({column_list}) "
+        f"VALUES ({new_values}); END"
+    )
+    connection.execute(
+        f"CREATE TRIGGER {table}_mirror_update AFTER UPDATE ON {table} BEGIN "
+        f"DELETE FROM {new_table} WHERE rowid = OLD.rowid; "
+        f"INSERT OR REPLACE INTO {new_table} ({column_list}) "
+        f"VALUES ({new_values}); END"
+    )
+    connection.execute(
+        f"CREATE TRIGGER {table}_mirror_delete AFTER DELETE ON {table} BEGIN "
+        f"DELETE FROM {new_table} WHERE rowid = OLD.rowid; END"
+    )
+    connection.execute("COMMIT")
+
+    copied = copy_in_batches(
+        connection, table, new_table, columns, expressions,
+        batch_size=batch_size
+    )
+
+    connection.execute("BEGIN IMMEDIATE")
+    # created only now, so the backfill did not fire them a second time
+    triggers = table_triggers(connection, table)
+    sequence = table_sequence(connection, table)
+    connection.execute(f"DROP TABLE {table}")
+    connection.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+    for trigger_sql in triggers:
+        connection.execute(trigger_sql)
+    if sequence:
+        # an AUTOINCREMENT table keeps its place, not just max(rowid)
+        connection.execute(
+            "UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?",
+            (sequence, table))
+    if after_swap is not None:
+        after_swap(connection)
+    connection.execute("COMMIT")
+    return copied
+
+
+def add_indexes(connection, table, indexes, batch_size=BATCH_SIZE,
+                drop_indexes=()):
+    # CREATE INDEX on a live table holds the write lock for the whole
+    # build; new indexes go in through an online rebuild of the table
+    # instead, with its schema unchanged. A no-op once they all exist.
+    existing = {index_name(sql) for sql in table_indexes(connection, table)}
+    missing = [sql for sql in indexes if index_name(sql) not in existing]
+    if not missing and not existing.intersection(drop_indexes):
+        return 0
+    columns = table_columns(connection, table)
+    create_sql = CREATE_TABLE.sub(
+        "CREATE TABLE {table}", table_sql(connection, table), count=1)
+    return rebuild_table(
+        connection, table, create_sql, columns,
+        ["{src}." + column for column in columns], batch_size,
+        indexes=missing, drop_indexes=drop_indexes)
+
+
+def rebuild_search_index(connection, tables=("tasks", "tasks_archive")):
+    # re-read every task name into the full-text indexes, e.g. after rows
+    # were written with the triggers missing; "optimize" then merges the
+    # index segments
+    for table in tables:
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+        connection.execute("COMMIT")
+        connection.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('optimize')")
+
+
+def reconcile_summary(connection):
+    # Recount task_summary from tasks one owner at a time, each in its own
+    # short transaction, and rewrite the owners whose counts drifted.
+    # Returns the number of (owner, priority, due date) rows that were off.
+    # archived tasks still count as closed, so both tables are recounted
+    has_archive = "tasks_archive" in {row[0] for row in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'")}
+    source = "(SELECT user_id, priority, due_date, status FROM tasks " \
+        "UNION ALL SELECT user_id, priority, due_date, status " \
+        "FROM tasks_archive)" if has_archive else "tasks"
+    owners = {row[0] for row in connection.execute(
+        f"SELECT DISTINCT coalesce(user_id, -1) FROM {source}")}
+    owners.update(row[0] for row in connection.execute(
+        "SELECT DISTINCT user_id FROM task_summary"))
+    fixed = 0
+    for owner in sorted(owners):
+        connection.execute("BEGIN IMMEDIATE")
+        expected = {
+            (priority, due_date): (open_count, closed_count)
+            for priority, due_date, open_count, closed_count in connection.execute(
+                "SELECT priority, due_date, sum(coalesce(status = 1, 0)), "
+                f"sum(coalesce(status = 0, 0)) FROM {source} WHERE user_id IS ? "
+                "GROUP BY priority, due_date HAVING sum(status IN (0, 1)) > 0",
+                (None if owner == -1 else owner,))
+        }
+        actual = {
+            (priority, due_date): (open_count, closed_count)
+            for priority, due_date, open_count, closed_count in connection.execute(
+                "SELECT priority, due_date, open_count, closed_count "
+                "FROM task_summary WHERE user_id = ? "
+                "AND (open_count != 0 OR closed_count != 0)", (owner,))
+        }
+        drifted = set(expected.items()) ^ set(actual.items())
+        if drifted:
+            fixed += len({key for key, _ in drifted})
+            connection.execute(
+                "DELETE FROM task_summary WHERE user_id = ?", (owner,))
+            connection.executemany(
+                "INSERT INTO task_summary (user_id, priority, due_date, "
+                "open_count, closed_count) VALUES (?, ?, ?, ?, ?)",
+                [(owner,) + key + counts for key, counts in expected.items()])
+        connection.execute("COMMIT")
+    return fixed
+
+
+def upgrade(database_path, target=None, batch_size=BATCH_SIZE, log=print):
+    connection = connect(database_path)
+    try:
+        current = schema_version(connection)
+        for version, func in MIGRATIONS:
+            if version <= current or (target is not None and version > target):
+                continue
+            log(f"Applying migration {version}: {func.__name__}")
+            func(connection, batch_size)
+            set_schema_version(connection, version)
+            current = version
+        return current
+    finally:
+        connection.close()
+
+
+def stamp(database_path, version=None):
+    # mark a freshly created database as up to date
+    connection = connect(database_path)
+    try:
+        set_schema_version(
+            connection, latest_version() if version is None else version)
+    finally:
+        connection.close()
+
+
+####################
+#### migrations ####
+####################
+
+@migration(1)
+def legacy_columns(connection, batch_size):
+    # databases created before tasks were owned by users and users had roles
+    if "role" not in table_columns(connection, "users"):
+        connection.execute(
+            "ALTER TABLE users ADD COLUMN role VARCHAR DEFAULT 'user'")
+    if "user_id" not in table_columns(connection, "tasks"):
+        rebuild_table(
+            connection,
+            "tasks",
+            """CREATE TABLE {table} (
+                task_id INTEGER NOT NULL,
+                name VARCHAR NOT NULL,
+                due_date DATE NOT NULL,
+                priority INTEGER NOT NULL,
+                posted_date DATE,
+                status INTEGER,
+                user_id INTEGER,
+                PRIMARY KEY (task_id),
+                FOREIGN KEY(user_id) REFERENCES users (id)
+            )""",
+            ["task_id", "name", "due_date", "priority", "posted_date",
+             "status", "user_id"],
+            ["{src}.task_id", "{src}.name", "{src}.due_date",
+             "{src}.priority", "date('now')", "{src}.status", "1"],
+            batch_size=batch_size
+        )
+
+
+@migration(2)
+def task_indexes(connection, batch_size):
+    # the open/closed lists filter on status and order by due_date; per-user
+    # lookups and ownership checks filter on user_id
+    add_indexes(connection, "tasks", [
+        "CREATE INDEX ix_tasks_status_due_date ON {table} (status, due_date)",
+        "CREATE INDEX ix_tasks_user_id_status ON {table} (user_id, status)",
+    ], batch_size)
+
+
+@migration(3)
+def task_versions(connection, batch_size):
+    # change counters behind the API's ETags
+    connection.execute("BEGIN IMMEDIATE")
+    connection.execute("""CREATE TABLE IF NOT EXISTS task_versions (
+        user_id INTEGER NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (user_id)
+    )""")
+    for action, old_new in (("insert", ["NEW"]), ("update", ["OLD", "NEW"]),
+                            ("delete", ["OLD"])):
+        of_columns = "OF name, due_date, priority, posted_date, status, user_id " \
+            if action == "update" else ""
+        values = ", ".join(
+            ["(0, 1)"] + [f"(coalesce({row}.user_id, -1), 1)" for row in old_new])
+        connection.execute(
+            f"CREATE TRIGGER IF NOT EXISTS tasks_version_{action} "
+            f"AFTER {action.upper()} {of_columns}ON tasks BEGIN "
+            f"INSERT INTO task_versions (user_id, version) VALUES {values} "
+            f"ON CONFLICT (user_id) DO UPDATE SET version = version + 1; END"
+        )
+    connection.execute("COMMIT")
+
+
+def create_search_index(connection, table):
+    # FTS5 index over the task names in table, kept in sync by triggers
+    connection.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+        name,
+        content='{table}',
+        content_rowid='task_id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""")
+    connection.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} "
+        f"BEGIN INSERT INTO {table}_fts (rowid, name) "
+        f"VALUES (NEW.task_id, NEW.name); END"
+    )
+    connection.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_update "
+        f"AFTER UPDATE OF task_id, name ON {table} "
+        f"BEGIN INSERT INTO {table}_fts ({table}_fts, rowid, name) "
+        f"VALUES ('delete', OLD.task_id, OLD.name); "
+        f"INSERT INTO {table}_fts (rowid, name) VALUES (NEW.task_id, NEW.name); END"
+    )
+    connection.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} "
+        f"BEGIN INSERT INTO {table}_fts ({table}_fts, rowid, name) "
+        f"VALUES ('delete', OLD.task_id, OLD.name); END"
+    )
+
+
+@migration(4)
+def task_search(connection, batch_size):
+    # FTS5 index over task names
+    connection.execute("BEGIN IMMEDIATE")
+    create_search_index(connection, "tasks")
+    connection.execute("COMMIT")
+    rebuild_search_index(connection, ["tasks"])
+
+
+def create_summary_triggers(connection, table):
+    # task_summary bookkeeping for writes to tasks and tasks_archive
+    new_values = (
+        "VALUES (coalesce(NEW.user_id, -1), NEW.priority, NEW.due_date, "
+        "coalesce(NEW.status = 1, 0), coalesce(NEW.status = 0, 0)) "
+        "ON CONFLICT (user_id, priority, due_date) DO UPDATE SET "
+        "open_count = open_count + excluded.open_count, "
+        "closed_count = closed_count + excluded.closed_count; "
+    )
+    subtract_old = (
+        "UPDATE task_summary SET "
+        "open_count = open_count - coalesce(OLD.status = 1, 0), "
+        "closed_count = closed_count - coalesce(OLD.status = 0, 0) "
+        "WHERE user_id = coalesce(OLD.user_id, -1) "
+        "AND priority = OLD.priority AND due_date = OLD.due_date; "
+    )
+    add_new = ("INSERT INTO task_summary (user_id, priority, due_date, "
+               "open_count, closed_count) " + new_values)
+    connection.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {table}_summary_insert "
+        f"AFTER INSERT ON {table} BEGIN {add_new}END"
+    )
+    connection.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {table}_summary_update "
+        f"AFTER UPDATE OF priority, due_date, status, user_id ON {table} "
+        f"BEGIN {subtract_old}{add_new}END"
+    )
+    connection.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {table}_summary_delete "
+        f"AFTER DELETE ON {table} BEGIN {subtract_old}END"
+    )
+
+
+@migration(5)
+def task_summary(connection, batch_size):
+    # per owner/priority/due date counters behind the dashboard
+    connection.execute("BEGIN IMMEDIATE")
+    connection.execute("""CREATE TABLE IF NOT EXISTS task_summary (
+        user_id INTEGER NOT NULL,
+        priority INTEGER NOT NULL,
+        due_date DATE NOT NULL,
+        open_count INTEGER NOT NULL,
+        closed_count INTEGER NOT NULL,
+        PRIMARY KEY (user_id, priority, due_date)
+    )""")
+    create_summary_triggers(connection, "tasks")
+    connection.execute("COMMIT")
+    reconcile_summary(connection)
+
+
+@migration(6)
+def tasks_archive(connection, batch_size):
+    # closed tasks moved out of the hot table by project/archive.py
+    connection.execute("BEGIN IMMEDIATE")
+    connection.execute("""CREATE TABLE IF NOT EXISTS tasks_archive (
+        task_id INTEGER NOT NULL,
+        name VARCHAR NOT NULL,
+        due_date DATE NOT NULL,
+        priority INTEGER NOT NULL,
+        posted_date DATE,
+        status INTEGER,
+        user_id INTEGER,
+        archived_at DATETIME NOT NULL,
+        PRIMARY KEY (task_id),
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )""")
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS ix_tasks_archive_due_date "
+        "ON tasks_archive (due_date)")
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS ix_tasks_archive_user_id_due_date "
+        "ON tasks_archive (user_id, due_date)")
+    # archived tasks still count as closed on the dashboard
+    create_summary_triggers(connection, "tasks_archive")
+    connection.execute(
+        "CREATE TRIGGER IF NOT EXISTS tasks_archive_version_delete "
+        "AFTER DELETE ON tasks_archive BEGIN "
+        "INSERT INTO task_versions (user_id, version) "
+        "VALUES (0, 1), (coalesce(OLD.user_id, -1), 1) "
+        "ON CONFLICT (user_id) DO UPDATE SET version = version + 1; END"
+    )
+    connection.execute("COMMIT")
+
+
+@migration(7)
+def task_reminders(connection, batch_size):
+    # lease and delivery columns for the reminder worker; adding nullable
+    # columns only touches the schema, not the rows
+    columns = table_columns(connection, "tasks")
+    for column, column_type in (("reminded_at", "DATETIME"),
+                                ("lease_owner", "VARCHAR"),
+                                ("lease_expires", "DATETIME")):
+        if column not in columns:
+            connection.execute(
+                f"ALTER TABLE tasks ADD COLUMN {column} {column_type}")
+    # tasks already overdue at upgrade time would otherwise all be reminded
+    # about at once on the worker's first pass
+    last_task_id = 0
+    while True:
+        upper = connection.execute(
+            "SELECT max(task_id) FROM (SELECT task_id FROM tasks "
+            "WHERE task_id > ? ORDER BY task_id LIMIT ?)",
+            (last_task_id, batch_size)
+        ).fetchone()[0]
+        if upper is None:
+            break
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute(
+            "UPDATE tasks SET reminded_at = datetime('now') "
+            "WHERE task_id > ? AND task_id <= ? AND reminded_at IS NULL "
+            "AND status = 1 AND due_date < date('now')",
+            (last_task_id, upper)
+        )
+        connection.execute("COMMIT")
+        last_task_id = upper
+    add_indexes(connection, "tasks", [
+        "CREATE INDEX ix_tasks_reminder_due ON {table} (due_date) "
+        "WHERE status = 1 AND reminded_at IS NULL",
+    ], batch_size)
+
+
+@migration(8)
+def task_queue(connection, batch_size):
+    # claims on the shared queue, and the indexes behind the "next task"
+    # reads; ix_tasks_user_next starts with (user_id, status), which makes
+    # ix_tasks_user_id_status redundant
+    columns = table_columns(connection, "tasks")
+    for column, column_type in (("claimed_by", "INTEGER REFERENCES users (id)"),
+                                ("claimed_at", "DATETIME")):
+        if column not in columns:
+            connection.execute(
+                f"ALTER TABLE tasks ADD COLUMN {column} {column_type}")
+    add_indexes(connection, "tasks", [
+        "CREATE INDEX ix_tasks_user_next "
+        "ON {table} (user_id, status, priority DESC, due_date)",
+        "CREATE INDEX ix_tasks_queue ON {table} (priority DESC, due_date) "
+        "WHERE status = 1 AND claimed_by IS NULL",
+    ], batch_size, drop_indexes=("ix_tasks_user_id_status",))
+
+
+@migration(9)
+def task_ids_never_reused(connection, batch_size):
+    # Without AUTOINCREMENT SQLite hands out max(task_id) + 1, which is the
+    # id of a task that was archived while it was the newest. The sequence
+    # starts past the archive's ids as well as the table's own.
+    if "AUTOINCREMENT" in table_sql(connection, "tasks").upper():
+        return
+
+    def start_sequence(connection):
+        connection.execute("DELETE FROM sqlite_sequence WHERE name = 'tasks'")
+        connection.execute(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'tasks', max("
+            "coalesce((SELECT max(task_id) FROM tasks), 0), "
+            "coalesce((SELECT max(task_id) FROM tasks_archive), 0))")
+
+    columns = ["task_id", "name", "due_date", "priority", "posted_date",
+               "status", "user_id", "reminded_at", "lease_owner",
+               "lease_expires", "claimed_by", "claimed_at"]
+    rebuild_table(
+        connection,
+        "tasks",
+        """CREATE TABLE {table} (
+            task_id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            name VARCHAR NOT NULL,
+            due_date DATE NOT NULL,
+            priority INTEGER NOT NULL,
+            posted_date DATE,
+            status INTEGER,
+            user_id INTEGER,
+            reminded_at DATETIME,
+            lease_owner VARCHAR,
+            lease_expires DATETIME,
+            claimed_by INTEGER,
+            claimed_at DATETIME,
+            FOREIGN KEY(user_id) REFERENCES users (id),
+            FOREIGN KEY(claimed_by) REFERENCES users (id)
+        )""",
+        columns,
+        ["{src}." + column for column in columns],
+        batch_size,
+        after_swap=start_sequence
+    )
+
+
+@migration(10)
+def claimed_task_index(connection, batch_size):
+    # the tasks a user claimed, read next to their own on the next-task list
+    add_indexes(connection, "tasks", [
+        "CREATE INDEX ix_tasks_claimed_next "
+        "ON {table} (claimed_by, status, priority DESC, due_date)",
+    ], batch_size)
+
+
+@migration(11)
+def archive_search(connection, batch_size):
+    # archived tasks stay searchable through an index of their own
+    connection.execute("BEGIN IMMEDIATE")
+    create_search_index(connection, "tasks_archive")
+    connection.execute("COMMIT")
+    rebuild_search_index(connection, ["tasks_archive"])
+
+
+@migration(12)
+def claims_change_versions(connection, batch_size):
+    # claiming a task changes the lists and the API output, so it has to
+    # move the owner's and the claimer's versions on like any other edit
+    connection.execute("BEGIN IMMEDIATE")
+    connection.execute("DROP TRIGGER IF EXISTS tasks_version_update")
+    connection.execute(
+        "CREATE TRIGGER tasks_version_update AFTER UPDATE OF name, due_date, "
+        "priority, posted_date, status, user_id, claimed_by, claimed_at "
+        "ON tasks BEGIN "
+        "INSERT INTO task_versions (user_id, version) VALUES (0, 1), "
+        "(coalesce(OLD.user_id, -1), 1), (coalesce(NEW.user_id, -1), 1), "
+        "(coalesce(NEW.claimed_by, -1), 1) "
+        "ON CONFLICT (user_id) DO UPDATE SET version = version + 1; END"
+    )
+    connection.execute("COMMIT")
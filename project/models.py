@@ -1,10 +1,33 @@
 # project/models.py
 
+from collections import namedtuple
+
+from sqlalchemy.orm import aliased
+
 from project import db
 import datetime
 
 class Task(db.Model):
     __tablename__ = "tasks"
+    __table_args__ = (
+        db.Index("ix_tasks_status_due_date", "status", "due_date"),
+        # each user's open tasks in "what next" order, most urgent priority
+        # then earliest due date, so the top K are the head of one range
+        db.Index("ix_tasks_user_next", "user_id", "status",
+                 db.text("priority DESC"), "due_date"),
+        # only the open tasks still waiting for a reminder, in due order
+        db.Index("ix_tasks_reminder_due", "due_date",
+                 sqlite_where=db.text("status = 1 AND reminded_at IS NULL")),
+        # open tasks someone claimed, in the same order, for their own list
+        db.Index("ix_tasks_claimed_next", "claimed_by", "status",
+                 db.text("priority DESC"), "due_date"),
+        # the shared queue: open tasks nobody has claimed, most urgent first
+        db.Index("ix_tasks_queue", db.text("priority DESC"), "due_date",
+                 sqlite_where=db.text("status = 1 AND claimed_by IS NULL")),
+        # ids are never handed out twice, so an archived task's id cannot
+        # come back on a new task
+        {"sqlite_autoincrement": True},
+    )
 
     task_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -13,6 +36,13 @@ class Task(db.Model):
     posted_date = db.Column(db.Date, default=datetime.datetime.utcnow())
     status = db.Column(db.Integer)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    # bookkeeping for the reminder worker, see project/reminders.py
+    reminded_at = db.Column(db.DateTime)
+    lease_owner = db.Column(db.String)
+    lease_expires = db.Column(db.DateTime)
+    # who took the task off the shared queue, see claim_next_task()
+    claimed_by = db.Column(db.Integer, db.ForeignKey("users.id"))
+    claimed_at = db.Column(db.DateTime)
 
 
     def __init__(self, name, due_date, priority, posted_date, status, user_id):
@@ -33,7 +63,7 @@ class User(db.Model):
     name = db.Column(db.String, unique=True, nullable=False)
     email = db.Column(db.String, unique=True, nullable=False)
     password = db.Column(db.String, nullable=False)
-    tasks = db.relationship("Task", backref="poster")
+    tasks = db.relationship("Task", backref="poster", foreign_keys=[Task.user_id])
     role = db.Column(db.String, default="user")
 
     def __init__(self, name=None, email=None, password=None, role=None):
@@ -46,3 +76,213 @@ class User(db.Model):
         return f"<User {self.name}>"
 
 
+class TaskVersion(db.Model):
+    # change counters for the tasks table, kept by the triggers below:
+    # user_id 0 counts every change, other rows count changes to one
+    # user's tasks
+    __tablename__ = "task_versions"
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def current(user_id=0):
+        version = db.session.query(TaskVersion.version).filter_by(
+            user_id=user_id).scalar()
+        return version or 0
+
+
+TASK_VERSION_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS tasks_version_insert
+    AFTER INSERT ON tasks
+    BEGIN
+        INSERT INTO task_versions (user_id, version)
+        VALUES (0, 1), (coalesce(NEW.user_id, -1), 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+    END""",
+    # a claim changes what the lists show too, for the owner and claimer
+    """CREATE TRIGGER IF NOT EXISTS tasks_version_update
+    AFTER UPDATE OF name, due_date, priority, posted_date, status, user_id,
+        claimed_by, claimed_at
+    ON tasks
+    BEGIN
+        INSERT INTO task_versions (user_id, version)
+        VALUES (0, 1), (coalesce(OLD.user_id, -1), 1),
+               (coalesce(NEW.user_id, -1), 1),
+               (coalesce(NEW.claimed_by, -1), 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tasks_version_delete
+    AFTER DELETE ON tasks
+    BEGIN
+        INSERT INTO task_versions (user_id, version)
+        VALUES (0, 1), (coalesce(OLD.user_id, -1), 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+    END""",
+)
+
+for trigger in TASK_VERSION_TRIGGERS:
+    db.event.listen(Task.__table__, "after_create", db.DDL(trigger))
+
+
+class TaskSummary(db.Model):
+    # task counts per owner, priority and due date, kept by the triggers
+    # below in the same transaction as the write to tasks (archived tasks
+    # included, see TaskArchive); the due date
+    # granularity is what lets overdue counts be summed without tasks
+    __tablename__ = "task_summary"
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    priority = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    due_date = db.Column(db.Date, primary_key=True)
+    open_count = db.Column(db.Integer, nullable=False, default=0)
+    closed_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class TaskArchive(db.Model):
+    # closed tasks moved out of tasks by project/archive.py, so the hot
+    # table and its indexes only carry what is still being worked on
+    __tablename__ = "tasks_archive"
+    __table_args__ = (
+        db.Index("ix_tasks_archive_due_date", "due_date"),
+        db.Index("ix_tasks_archive_user_id_due_date", "user_id", "due_date"),
+    )
+
+    task_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String, nullable=False)
+    due_date = db.Column(db.Date, nullable=False)
+    priority = db.Column(db.Integer, nullable=False)
+    posted_date = db.Column(db.Date)
+    status = db.Column(db.Integer)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+
+TASK_SUMMARY_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS {table}_summary_insert
+    AFTER INSERT ON {table}
+    BEGIN
+        INSERT INTO task_summary
+            (user_id, priority, due_date, open_count, closed_count)
+        VALUES (coalesce(NEW.user_id, -1), NEW.priority, NEW.due_date,
+                coalesce(NEW.status = 1, 0), coalesce(NEW.status = 0, 0))
+        ON CONFLICT (user_id, priority, due_date) DO UPDATE SET
+            open_count = open_count + excluded.open_count,
+            closed_count = closed_count + excluded.closed_count;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS {table}_summary_update
+    AFTER UPDATE OF priority, due_date, status, user_id ON {table}
+    BEGIN
+        UPDATE task_summary SET
+            open_count = open_count - coalesce(OLD.status = 1, 0),
+            closed_count = closed_count - coalesce(OLD.status = 0, 0)
+        WHERE user_id = coalesce(OLD.user_id, -1)
+            AND priority = OLD.priority AND due_date = OLD.due_date;
+        INSERT INTO task_summary
+            (user_id, priority, due_date, open_count, closed_count)
+        VALUES (coalesce(NEW.user_id, -1), NEW.priority, NEW.due_date,
+                coalesce(NEW.status = 1, 0), coalesce(NEW.status = 0, 0))
+        ON CONFLICT (user_id, priority, due_date) DO UPDATE SET
+            open_count = open_count + excluded.open_count,
+            closed_count = closed_count + excluded.closed_count;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS {table}_summary_delete
+    AFTER DELETE ON {table}
+    BEGIN
+        UPDATE task_summary SET
+            open_count = open_count - coalesce(OLD.status = 1, 0),
+            closed_count = closed_count - coalesce(OLD.status = 0, 0)
+        WHERE user_id = coalesce(OLD.user_id, -1)
+            AND priority = OLD.priority AND due_date = OLD.due_date;
+    END""",
+)
+
+for table in (Task.__table__, TaskArchive.__table__):
+    for trigger in TASK_SUMMARY_TRIGGERS:
+        db.event.listen(table, "after_create", db.DDL(trigger.format(table=table.name)))
+
+# archived tasks can still be deleted, which has to invalidate the cached
+# closed task tables like any other write
+db.event.listen(TaskArchive.__table__, "after_create", db.DDL(
+    """CREATE TRIGGER IF NOT EXISTS tasks_archive_version_delete
+    AFTER DELETE ON tasks_archive
+    BEGIN
+        INSERT INTO task_versions (user_id, version)
+        VALUES (0, 1), (coalesce(OLD.user_id, -1), 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+    END"""))
+
+# closed tasks live in both tables; ClosedTask maps the union of the two
+# onto Task so the closed list can be filtered and paginated as one
+closed_task_rows = db.union_all(
+    db.select([Task.__table__]).where(Task.__table__.c.status == 0),
+    # archived tasks have no reminder bookkeeping; the NULLs are cast to the
+    # column types because SQLite only merges branches whose affinities match
+    db.select([TaskArchive.__table__.c[column.name]
+               if column.name in TaskArchive.__table__.c
+               else db.cast(db.null(), column.type).label(column.name)
+               for column in Task.__table__.c])
+).alias("closed_tasks")
+
+ClosedTask = aliased(Task, closed_task_rows)
+
+
+# What the task lists render. A TaskRow is a namedtuple: one tuple per row,
+# no per-instance __dict__, identity map entry or change tracking.
+ROW_COLUMNS = ("task_id", "name", "due_date", "priority", "posted_date",
+               "status", "user_id", "claimed_by")
+TaskRow = namedtuple("TaskRow", ROW_COLUMNS + ("poster_name",))
+
+
+def row_columns(entity):
+    return [getattr(entity, name) for name in ROW_COLUMNS]
+
+
+def task_rows(rows):
+    # TaskRow tuples from column rows; rows without a poster_name get theirs
+    # from a single IN-list query over the distinct owners
+    rows = list(rows)
+    if not rows or "poster_name" in rows[0].keys():
+        return [TaskRow._make(row) for row in rows]
+    names = dict(db.session.query(User.id, User.name).filter(
+        User.id.in_({row.user_id for row in rows})))
+    return [TaskRow(*row, names.get(row.user_id)) for row in rows]
+
+
+# Full-text indexes over task names, one for tasks and one for the archive.
+# Each is an external content table: the text lives in the task table only
+# and the triggers keep the index in step. A leftover index from a dropped
+# table would point at the wrong rows, so creating the table always starts
+# its index from scratch.
+TASK_SEARCH_DDL = (
+    "DROP TABLE IF EXISTS {table}_fts",
+    """CREATE VIRTUAL TABLE {table}_fts USING fts5(
+        name,
+        content='{table}',
+        content_rowid='task_id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS {table}_fts_insert
+    AFTER INSERT ON {table}
+    BEGIN
+        INSERT INTO {table}_fts (rowid, name) VALUES (NEW.task_id, NEW.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS {table}_fts_update
+    AFTER UPDATE OF task_id, name ON {table}
+    BEGIN
+        INSERT INTO {table}_fts ({table}_fts, rowid, name)
+        VALUES ('delete', OLD.task_id, OLD.name);
+        INSERT INTO {table}_fts (rowid, name) VALUES (NEW.task_id, NEW.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS {table}_fts_delete
+    AFTER DELETE ON {table}
+    BEGIN
+        INSERT INTO {table}_fts ({table}_fts, rowid, name)
+        VALUES ('delete', OLD.task_id, OLD.name);
+    END""",
+)
+
+for table in (Task.__table__, TaskArchive.__table__):
+    for statement in TASK_SEARCH_DDL:
+        db.event.listen(table, "after_create", db.DDL(statement.format(table=table.name)))
@@ -0,0 +1,82 @@
+# project/pagination.py
+# Keyset (cursor) pagination over (due_date, task_id)
+
+import datetime
+from itertools import islice
+
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(due_date, task_id):
+    return f"{due_date.isoformat()}_{task_id}"
+
+
+def decode_cursor(cursor):
+    try:
+        due_date, task_id = cursor.split("_")
+        return datetime.date.fromisoformat(due_date), int(task_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def seek(query, cursor, due_column, id_column):
+    key = decode_cursor(cursor)
+    if key is None:
+        return query
+    due_date, task_id = key
+    return query.filter(or_(
+        due_column > due_date,
+        and_(due_column == due_date, id_column > task_id)
+    ))
+
+
+def keyset_page(query, cursor, per_page, due_column, id_column):
+    # the query must already be ordered by (due_column, id_column); we only
+    # seek past the cursor and fetch one extra row to know if there is more;
+    # a page always has room for one row, or the cursor has none to point at
+    per_page = max(1, per_page)
+    query = seek(query, cursor, due_column, id_column)
+    rows = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.due_date, last.task_id)
+    return rows, next_cursor
+
+
+class KeysetPage(object):
+    # Lazy keyset_page for streamed rendering: rows are fetched batch by
+    # batch while the template iterates, next_cursor is set once it is done.
+    # convert, if given, turns each batch of rows into what is yielded.
+
+    def __init__(self, query, cursor, per_page, due_column, id_column,
+                 batch_size=500, convert=None):
+        self.query = seek(query, cursor, due_column, id_column)
+        self.per_page = per_page
+        self.batch_size = batch_size
+        self.convert = convert
+        self.next_cursor = None
+
+    def __iter__(self):
+        query = self.query
+        if self.per_page:
+            query = query.limit(self.per_page + 1)
+        last = None
+        for count, row in enumerate(self._rows(query), 1):
+            if self.per_page and count > self.per_page:
+                self.next_cursor = encode_cursor(last.due_date, last.task_id)
+                break
+            last = row
+            yield row
+
+    def _rows(self, query):
+        rows = iter(query.yield_per(self.batch_size))
+        if self.convert is None:
+            yield from rows
+            return
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                return
+            yield from self.convert(batch)
@@ -0,0 +1,173 @@
+# project/profiling.py
+# Opt-in SQL profiling (SQL_PROFILING = True). Statements slower than
+# SQL_SLOW_QUERY_MS are logged with their bind parameters, the view that
+# ran them and SQLite's EXPLAIN QUERY PLAN, and the most recent ones are
+# kept for /api/stats/sql/. Every request is also held to a query budget,
+# and with SQL_FULL_SCAN_TABLES set, to never scanning those tables whole.
+#
+# TestConfig turns all of it on in strict mode, where going over budget
+# raises QueryBudgetExceeded, so the test that adds an N+1 loop or a full
+# scan fails instead of the regression reaching production.
+
+import collections
+import logging
+import re
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# transaction control, not queries
+CONTROL_STATEMENTS = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE")
+
+# "SCAN tasks" or "SCAN tasks_1": a table read row by row, no index used;
+# the suffix is SQLAlchemy's numbering of aliased tables
+FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+?)(?:_\d+)?(?: AS \w+)?$")
+
+
+class QueryBudgetExceeded(Exception):
+
+    def __init__(self, endpoint, problems, statements):
+        self.endpoint = endpoint
+        self.problems = problems
+        self.statements = statements
+        super().__init__(
+            f"{endpoint}: " + "; ".join(problems) + "\n" + "\n".join(statements))
+
+
+def explain(cursor, statement, parameters):
+    # the plan SQLite picks for the statement, one line per step; EXPLAIN
+    # never runs the statement itself
+    try:
+        rows = cursor.connection.execute(
+            "EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+    except Exception:
+        return []
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan, tables):
+    scanned = []
+    for step in plan:
+        match = FULL_SCAN.match(step)
+        if match and match.group(1) in tables:
+            scanned.append(match.group(1))
+    return scanned
+
+
+class ProfilerState(object):
+    # one app's settings and its slow query history
+
+    def __init__(self, config):
+        self.enabled = config.get("SQL_PROFILING", False)
+        self.slow_ms = config.get("SQL_SLOW_QUERY_MS", 100)
+        # SQL_QUERY_BUDGET for every view, SQL_QUERY_BUDGETS by endpoint
+        self.budget = config.get("SQL_QUERY_BUDGET")
+        self.budgets = config.get("SQL_QUERY_BUDGETS", {})
+        self.scan_tables = tuple(config.get("SQL_FULL_SCAN_TABLES", ()))
+        # endpoints that read whole tables on purpose, like the export
+        self.scan_exempt = tuple(config.get("SQL_FULL_SCAN_EXEMPT", ()))
+        self.strict = config.get("SQL_QUERY_BUDGET_STRICT", False)
+        self.slow_queries = collections.deque(
+            maxlen=config.get("SQL_SLOW_QUERY_HISTORY", 100))
+
+
+class SQLProfiler(object):
+    # The extension. Settings live in each app's ProfilerState in
+    # app.extensions; the engine hooks are process-wide and look up the
+    # state of the app they run under.
+
+    def __init__(self, app=None):
+        self._engine_hooked = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        state = app.extensions["sql_profiler"] = ProfilerState(app.config)
+        if not state.enabled:
+            return
+        app.before_request(self._before_request)
+        # teardown, not after_request: streamed pages query after the view
+        # has returned
+        app.teardown_request(self._teardown_request)
+        if not self._engine_hooked:
+            event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+            self._engine_hooked = True
+
+    @staticmethod
+    def _state():
+        if has_app_context():
+            return current_app.extensions.get("sql_profiler")
+        return None
+
+    #### hooks ####
+
+    def _before_request(self):
+        g.sql_profile = dict(statements=[], scans=[])
+
+    # the start time rides on the execution context, so a statement that
+    # raises takes its own along instead of leaving it for the next one
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        if context is not None:
+            context.profiling_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        started = getattr(context, "profiling_started", None)
+        state = self._state()
+        if started is None or state is None or not state.enabled or \
+                statement.lstrip().upper().startswith(CONTROL_STATEMENTS):
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        profile = g.get("sql_profile") if has_request_context() else None
+        slow = elapsed_ms >= state.slow_ms
+        plan = None
+        if conn.dialect.name == "sqlite" and not executemany and \
+                (slow or (profile is not None and state.scan_tables)):
+            plan = explain(cursor, statement, parameters)
+        if profile is not None:
+            profile["statements"].append(statement)
+            if plan:
+                profile["scans"].extend(full_scans(plan, state.scan_tables))
+        if slow:
+            entry = dict(
+                statement=statement,
+                parameters=repr(parameters),
+                duration_ms=round(elapsed_ms, 3),
+                view=request.endpoint if has_request_context() else None,
+                plan=plan or []
+            )
+            state.slow_queries.append(entry)
+            logger.warning(
+                "Slow query (%.1f ms) in %s: %s %s\n  plan: %s",
+                elapsed_ms, entry["view"], statement, entry["parameters"],
+                " / ".join(entry["plan"]))
+
+    def _teardown_request(self, exception):
+        profile = g.pop("sql_profile", None)
+        if profile is None or exception is not None:
+            return
+        state = current_app.extensions["sql_profiler"]
+        endpoint = request.endpoint or "unmatched"
+        budget = state.budgets.get(endpoint, state.budget)
+        problems = []
+        if budget is not None and len(profile["statements"]) > budget:
+            problems.append(
+                f"{len(profile['statements'])} queries, budget is {budget}")
+        if profile["scans"] and endpoint not in state.scan_exempt:
+            problems.append("full scan of " + ", ".join(sorted(set(profile["scans"]))))
+        if not problems:
+            return
+        if state.strict:
+            raise QueryBudgetExceeded(endpoint, problems, profile["statements"])
+        logger.warning("Query budget exceeded in %s: %s", endpoint, "; ".join(problems))
+
+    def stats(self):
+        state = current_app.extensions["sql_profiler"]
+        return dict(slow_ms=state.slow_ms, slow_queries=list(state.slow_queries))
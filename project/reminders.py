@@ -0,0 +1,241 @@
+# project/reminders.py
+# Due-date reminders, sent by a worker process outside the web app
+# (db_reminders.py).
+#
+# Open tasks nobody has been reminded about yet sit in a partial index
+# ordered by due date, so the next batch is a short range scan at the head
+# of that index however many tasks there are. A worker claims a batch by
+# writing a lease on it; other workers skip leased rows until the lease
+# expires, so a batch from a worker that died is picked up again later.
+# Delivery is at least once.
+#
+# The scans name the partial index: without statistics the planner prefers
+# ix_tasks_status_due_date, which also walks every open task already
+# reminded about.
+
+import datetime
+import importlib
+import json
+import logging
+import os
+import socket
+import sys
+import time
+import uuid
+
+LEAD_DAYS = 1
+BATCH_SIZE = 500
+LEASE_SECONDS = 60
+POLL_INTERVAL = 5
+
+DELAY_BUCKETS = (60, 300, 900, 3600, 4 * 3600, 12 * 3600, 86400, 7 * 86400)
+
+logger = logging.getLogger(__name__)
+
+
+###############
+#### sinks ####
+###############
+
+class StdoutSink(object):
+    # one JSON line per reminder
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def send(self, reminders):
+        for reminder in reminders:
+            self.stream.write(json.dumps(reminder) + "\n")
+        self.stream.flush()
+
+
+class FileSink(object):
+    # JSON lines appended to a file
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, reminders):
+        with open(self.path, "a") as f:
+            StdoutSink(f).send(reminders)
+
+
+def load_sink(spec):
+    # "stdout", "file:<path>" or "<module>:<callable>" returning a sink, that
+    # is anything with a send(reminders) method
+    if spec == "stdout":
+        return StdoutSink()
+    kind, _, argument = spec.partition(":")
+    if kind == "file" and argument:
+        return FileSink(argument)
+    if not argument:
+        raise ValueError(f"unknown reminder sink {spec!r}")
+    return getattr(importlib.import_module(kind), argument)()
+
+
+################
+#### worker ####
+################
+
+def timestamp(moment):
+    # the format SQLAlchemy's DateTime stores, so ORM reads still work
+    return moment.isoformat(" ")
+
+
+class ReminderWorker(object):
+
+    def __init__(self, connection, sink, batch_size=BATCH_SIZE,
+                 lease_seconds=LEASE_SECONDS, lead_days=LEAD_DAYS,
+                 owner=None, registry=None):
+        # connection is an autocommit sqlite3 connection (migrations.connect);
+        # registry, when given, is a metrics Registry fed per batch
+        self.connection = connection
+        self.sink = sink
+        self.batch_size = batch_size
+        self.lease = datetime.timedelta(seconds=lease_seconds)
+        self.lead = datetime.timedelta(days=lead_days)
+        self.owner = owner or \
+            f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.registry = registry
+        self.started = time.monotonic()
+        self.counts = dict(batches=0, sent=0, failed=0, lost=0)
+
+    def horizon(self, now):
+        return (now.date() + self.lead).isoformat()
+
+    def claim(self, now):
+        # leases the next batch of due reminders and returns their details
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            task_ids = [row[0] for row in connection.execute(
+                "SELECT task_id FROM tasks INDEXED BY ix_tasks_reminder_due "
+                "WHERE status = 1 AND reminded_at IS NULL AND due_date <= ? "
+                "AND (lease_expires IS NULL OR lease_expires < ?) "
+                "ORDER BY due_date LIMIT ?",
+                (self.horizon(now), timestamp(now), self.batch_size)
+            )]
+            if not task_ids:
+                connection.execute("COMMIT")
+                return []
+            placeholders = ", ".join("?" * len(task_ids))
+            connection.execute(
+                f"UPDATE tasks SET lease_owner = ?, lease_expires = ? "
+                f"WHERE task_id IN ({placeholders})",
+                [self.owner, timestamp(now + self.lease)] + task_ids
+            )
+            rows = connection.execute(
+                f"SELECT tasks.task_id, tasks.name, tasks.due_date, "
+                f"tasks.priority, tasks.posted_date, tasks.user_id, "
+                f"users.name, users.email FROM tasks "
+                f"LEFT JOIN users ON users.id = tasks.user_id "
+                f"WHERE tasks.task_id IN ({placeholders}) "
+                f"ORDER BY tasks.due_date, tasks.task_id",
+                task_ids
+            ).fetchall()
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        today = now.date().isoformat()
+        return [dict(task_id=task_id, name=name, due_date=due_date,
+                     priority=priority, posted_date=posted_date,
+                     user_id=user_id, user_name=user_name, email=email,
+                     overdue=due_date < today)
+                for task_id, name, due_date, priority, posted_date, user_id,
+                user_name, email in rows]
+
+    def finish(self, task_ids, now, delivered):
+        # marks a delivered batch as reminded, or hands a failed one back;
+        # only rows still leased by this worker are touched
+        placeholders = ", ".join("?" * len(task_ids))
+        if delivered:
+            assignment, values = "reminded_at = ?, ", [timestamp(now)]
+        else:
+            assignment, values = "", []
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        cursor = connection.execute(
+            f"UPDATE tasks SET {assignment}lease_owner = NULL, "
+            f"lease_expires = NULL "
+            f"WHERE task_id IN ({placeholders}) AND lease_owner = ?",
+            values + list(task_ids) + [self.owner]
+        )
+        connection.execute("COMMIT")
+        return cursor.rowcount
+
+    def run_once(self, now=None):
+        # claims, sends and settles one batch; returns how many were sent
+        now = now or datetime.datetime.utcnow()
+        reminders = self.claim(now)
+        if not reminders:
+            return 0
+        task_ids = [reminder["task_id"] for reminder in reminders]
+        self.counts["batches"] += 1
+        try:
+            self.sink.send(reminders)
+        except Exception:
+            logger.exception("Reminder sink failed, %d reminder(s) released",
+                             len(reminders))
+            self.finish(task_ids, now, delivered=False)
+            self.counts["failed"] += len(reminders)
+            self._record("failed", len(reminders))
+            return 0
+        # a lease that ran out mid-send may have been claimed again: those
+        # reminders go out twice
+        settled = self.finish(task_ids, now, delivered=True)
+        self.counts["sent"] += len(reminders)
+        self.counts["lost"] += len(reminders) - settled
+        self._record("sent", len(reminders))
+        if self.registry is not None:
+            for reminder in reminders:
+                self.registry.observe(
+                    "flasktaskr_reminder_delay_seconds", {},
+                    self.delay(reminder, now), DELAY_BUCKETS)
+        return len(reminders)
+
+    def delay(self, reminder, now):
+        # seconds between a reminder becoming due and going out: it is due
+        # once the task enters the lead window, or when it was posted if that
+        # was later
+        due = datetime.datetime.strptime(reminder["due_date"], "%Y-%m-%d") - self.lead
+        if reminder["posted_date"]:
+            due = max(due, datetime.datetime.strptime(
+                reminder["posted_date"][:10], "%Y-%m-%d"))
+        return max((now - due).total_seconds(), 0.0)
+
+    def _record(self, outcome, count):
+        if self.registry is not None:
+            self.registry.inc("flasktaskr_reminders_total",
+                              dict(outcome=outcome), count)
+
+    def stats(self, now=None):
+        # pending is the backlog within the lead window and lag_seconds how
+        # long its oldest reminder has been due; both read the partial index
+        now = now or datetime.datetime.utcnow()
+        pending, oldest = self.connection.execute(
+            "SELECT count(*), min(due_date) "
+            "FROM tasks INDEXED BY ix_tasks_reminder_due "
+            "WHERE status = 1 AND reminded_at IS NULL AND due_date <= ?",
+            (self.horizon(now),)
+        ).fetchone()
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        lag = self.delay(dict(due_date=oldest, posted_date=None), now) \
+            if oldest else 0.0
+        return dict(self.counts, pending=pending, lag_seconds=round(lag),
+                    throughput=round(self.counts["sent"] / elapsed, 1))
+
+    def run(self, stopping, interval=POLL_INTERVAL, report=None,
+            report_every=60):
+        # works batch after batch while there is a backlog and polls every
+        # interval seconds once it is drained, until stopping (an Event) is
+        # set; report, if given, gets the stats every report_every seconds
+        last_report = time.monotonic()
+        while not stopping.is_set():
+            sent = self.run_once()
+            if report is not None and \
+                    time.monotonic() - last_report >= report_every:
+                report(self.stats())
+                last_report = time.monotonic()
+            if sent < self.batch_size:
+                stopping.wait(interval)
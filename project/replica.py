@@ -0,0 +1,99 @@
+# project/replica.py
+# Read replica routing. With SQLALCHEMY_READ_DATABASE_URI set, the read-only
+# views send their queries to the replica; everything else, and every query
+# in a request once it has written, goes to the primary. A client that has
+# just written reads from the primary for REPLICA_STICKY_SECONDS, long
+# enough for the replica to catch up with its own changes.
+#
+# Locally the replica is a second SQLite file refreshed from the primary
+# with the online backup API (db_replicate.py).
+
+import sqlite3
+import time
+from functools import wraps
+
+import flask
+from flask import current_app, has_request_context
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_BIND = "replica"
+STICKY_SECONDS = 10
+SYNC_INTERVAL = 5
+
+
+def configure_replica(app):
+    uri = app.config.get("SQLALCHEMY_READ_DATABASE_URI")
+    if uri:
+        binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+        binds[REPLICA_BIND] = uri
+    app.config.setdefault("REPLICA_STICKY_SECONDS", STICKY_SECONDS)
+
+
+def has_replica(app):
+    return REPLICA_BIND in (app.config.get("SQLALCHEMY_BINDS") or {})
+
+
+#################
+#### session ####
+#################
+
+class RoutingSession(SignallingSession):
+    # info["replica"] asks for reads from the replica; info["wrote"] pins the
+    # rest of the session to the primary
+
+    def __init__(self, db, **options):
+        self._db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if isinstance(clause, UpdateBase):
+            wrote(self)
+        if self.info.get("replica") and not self.info.get("wrote"):
+            return self._db.get_engine(self.app, bind=REPLICA_BIND)
+        return super().get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def wrote(session, *args):
+    session.info["wrote"] = True
+    if has_request_context() and has_replica(session.app):
+        flask.session["read_primary_until"] = \
+            time.time() + session.app.config["REPLICA_STICKY_SECONDS"]
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def replica_reads(view):
+    # for views that only read; must run before the view's first query so
+    # everything it reads (versions included) comes from the same database
+    @wraps(view)
+    def wrap(*args, **kwargs):
+        app = current_app._get_current_object()
+        sticky = flask.session.get("read_primary_until", 0) > time.time()
+        if has_replica(app) and not sticky:
+            app.extensions["sqlalchemy"].db.session.info["replica"] = True
+        return view(*args, **kwargs)
+    return wrap
+
+
+#################
+#### syncing ####
+#################
+
+def sync_replica(primary_path, replica_path):
+    # Copies a consistent snapshot of the primary over the replica in one
+    # backup step. In WAL mode the primary's writers carry on meanwhile;
+    # the replica's readers wait on its lock until the copy is done.
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(replica_path, timeout=30)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
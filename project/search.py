@@ -0,0 +1,68 @@
+# project/search.py
+# Ranked full-text search over task names, served by the tasks_fts and
+# tasks_archive_fts indexes so archived tasks can still be found
+
+import re
+
+from sqlalchemy.sql import column, table
+
+from project import db
+from project.models import ROW_COLUMNS, Task, TaskArchive, User, task_rows
+
+tasks_fts = table("tasks_fts", column("rowid"), column("rank"), column("tasks_fts"))
+tasks_archive_fts = table("tasks_archive_fts", column("rowid"), column("rank"),
+                          column("tasks_archive_fts"))
+
+# pages further than this are not worth the OFFSET scan behind them
+MAX_PAGE = 50
+
+
+def match_expression(text):
+    # every word of the query must appear, the last letters may be missing;
+    # words are quoted so user input is never parsed as FTS5 syntax
+    words = re.findall(r"\w+", text or "")
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def matches(model, fts, source, expression, status, owner):
+    # the task rows of one table matching expression, with their rank;
+    # columns the table lacks (the archive has no claims) come back NULL
+    task_table = model.__table__
+    columns = [task_table.c[name] if name in task_table.c
+               else db.cast(db.null(), Task.__table__.c[name].type).label(name)
+               for name in ROW_COLUMNS]
+    query = db.select(columns + [
+        db.literal(source).label("source"), fts.c.rank.label("rank")
+    ]).select_from(
+        task_table.join(fts, fts.c.rowid == task_table.c.task_id)
+    ).where(fts.c[fts.name].match(expression))
+    if status is not None:
+        query = query.where(task_table.c.status == status)
+    if owner:
+        query = query.where(task_table.c.user_id == owner)
+    return query
+
+
+def search_tasks(text, status=None, owner=None, page=1, per_page=25):
+    # returns one page of TaskRows, best match first, and whether there is
+    # more
+    expression = match_expression(text)
+    if not expression:
+        return [], False
+    page = max(1, min(page, MAX_PAGE))
+    # the views pass the status as it came in the query string
+    status = None if status is None else int(status)
+    branches = [matches(Task, tasks_fts, 0, expression, status, owner)]
+    if status != 1:
+        # the archive only holds closed tasks
+        branches.append(matches(
+            TaskArchive, tasks_archive_fts, 1, expression, status, owner))
+    found = db.union_all(*branches).alias("found")
+    query = db.session.query(
+        *[found.c[name] for name in ROW_COLUMNS], User.name.label("poster_name")
+    ).outerjoin(User, User.id == found.c.user_id)
+    # bm25 ranks are only comparable within one index, so the live tasks
+    # come first, best match first, and the archived ones after them
+    rows = query.order_by(found.c.source, found.c.rank, found.c.task_id).offset(
+        (page - 1) * per_page).limit(per_page + 1).all()
+    return task_rows(rows[:per_page]), len(rows) > per_page and page < MAX_PAGE
@@ -0,0 +1,78 @@
+# project/selfcheck.py
+# Startup sanity checks for the production server: does the gunicorn
+# worker model fit SQLite's one-writer-at-a-time locking?
+
+import os
+
+from sqlalchemy.engine.url import make_url
+
+from project.engine import DEFAULTS, is_file_database
+
+
+def worker_model_warnings(config, workers, threads, worker_class, timeout,
+                          cpus=None):
+    # config is the app config; the rest are gunicorn settings. Returns a
+    # list of human readable warnings, empty when everything fits.
+    def setting(key):
+        return config.get(key, DEFAULTS[key])
+
+    warnings = []
+    uri = config["SQLALCHEMY_DATABASE_URI"]
+    concurrency = workers * max(threads, 1)
+    worker_class = worker_class.rsplit(".", 1)[-1].lower()
+
+    # every web worker has its own bcrypt pool
+    cpus = cpus or os.cpu_count() or 1
+    hashers = config.get("BCRYPT_WORKERS", 1)
+    if hashers > 1 and workers * hashers > cpus:
+        warnings.append(
+            f"{workers} workers with BCRYPT_WORKERS = {hashers} each start "
+            f"{workers * hashers} bcrypt processes on {cpus} CPUs: hashes "
+            "fight over the CPUs long before BCRYPT_QUEUE_DEPTH turns a "
+            "login away. Use BCRYPT_WORKERS = 1.")
+
+    if not make_url(uri).drivername.startswith("sqlite"):
+        return warnings
+
+    if not is_file_database(uri):
+        if workers > 1:
+            warnings.append(
+                f"{workers} workers on an in-memory SQLite database: every "
+                "worker gets its own, empty database.")
+        return warnings
+
+    journal_mode = str(setting("SQLITE_JOURNAL_MODE")).upper()
+    if concurrency > 1 and journal_mode != "WAL":
+        warnings.append(
+            f"SQLITE_JOURNAL_MODE is {journal_mode} with {concurrency} "
+            "concurrent requests: every write locks out all readers. "
+            "Use WAL.")
+
+    busy_timeout = int(setting("SQLITE_BUSY_TIMEOUT"))
+    if concurrency > 1 and busy_timeout == 0:
+        warnings.append(
+            "SQLITE_BUSY_TIMEOUT is 0: concurrent writers fail at once with "
+            "'database is locked' instead of waiting their turn.")
+    if timeout and busy_timeout >= timeout * 1000:
+        warnings.append(
+            f"SQLITE_BUSY_TIMEOUT ({busy_timeout} ms) is not below the worker "
+            f"timeout ({timeout} s): a worker waiting on a lock is killed "
+            "before it gives up.")
+
+    pool_limit = setting("SQLITE_POOL_SIZE") + setting("SQLITE_POOL_MAX_OVERFLOW")
+    if worker_class in ("gthreadworker", "gthread") and threads > pool_limit:
+        warnings.append(
+            f"{threads} threads per worker but only {pool_limit} pooled "
+            "connections: extra threads queue for a connection.")
+
+    if worker_class in ("geventworker", "gevent", "eventlet", "eventletworker"):
+        warnings.append(
+            f"{worker_class} workers: sqlite3 and bcrypt calls do not yield to "
+            "the event loop, so one slow query or lock wait stalls every "
+            "request in that worker. Prefer gthread.")
+
+    if workers > 1 and not config.get("METRICS_DIR"):
+        warnings.append(
+            "METRICS_DIR is not set: /metrics only reports the worker that "
+            "happens to serve the scrape.")
+    return warnings
@@ -1,8 +1,10 @@
-from flask_wtf import Form
+from flask_wtf.file import FileField, FileRequired
 from wtforms import StringField, DateField, IntegerField, \
-    SelectField
+    SelectField, SelectMultipleField
 from wtforms.validators import DataRequired
 
+from project.csrf import Form
+
 
 class AddTaskForm(Form):
     task_id = IntegerField()
@@ -20,3 +22,22 @@ class AddTaskForm(Form):
         ]
     )
     status = IntegerField("Status")
+
+
+class TaskIdsField(SelectMultipleField):
+    # any integer id is acceptable; ownership is checked by the query itself
+    def pre_validate(self, form):
+        pass
+
+
+class BulkTaskForm(Form):
+    task_ids = TaskIdsField("Tasks", coerce=int, validators=[DataRequired()])
+
+
+class ClaimTaskForm(Form):
+    # nothing to fill in, the queue decides which task
+    pass
+
+
+class ImportTasksForm(Form):
+    file = FileField("Tasks file (.csv or .ndjson)", validators=[FileRequired()])
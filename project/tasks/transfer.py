@@ -0,0 +1,155 @@
+# project/tasks/transfer.py
+# Streaming bulk export and import of tasks (CSV and NDJSON)
+
+import codecs
+import csv
+import datetime
+import io
+import json
+
+from sqlalchemy import select
+from werkzeug.datastructures import MultiDict
+
+from .forms import AddTaskForm
+from project import db
+from project.models import Task, TaskArchive
+
+COLUMNS = ("task_id", "name", "due_date", "priority", "posted_date",
+           "status", "user_id")
+# dates travel in the same format AddTaskForm accepts
+DATE_FORMAT = "%m/%d/%Y"
+CHUNK_SIZE = 1000
+BATCH_SIZE = 1000
+# only the first few bad rows are reported back, the rest are just counted
+MAX_REPORTED_ERRORS = 100
+
+
+################
+#### export ####
+################
+
+def export_chunks(chunk_size=CHUNK_SIZE):
+    # one cursor per table, read chunk_size rows at a time; archived tasks
+    # follow the live ones so an export is still a complete backup
+    for table in (Task.__table__, TaskArchive.__table__):
+        result = db.session.execute(
+            select([table.c[column] for column in COLUMNS])
+            .order_by(table.c.task_id)
+            .execution_options(stream_results=True)
+        )
+        try:
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [serialize(row) for row in rows]
+        finally:
+            result.close()
+
+
+def serialize(row):
+    values = dict(zip(COLUMNS, row))
+    for column in ("due_date", "posted_date"):
+        if values[column] is not None:
+            values[column] = values[column].strftime(DATE_FORMAT)
+    return values
+
+
+def export_csv(chunk_size=CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, COLUMNS)
+    writer.writeheader()
+    for rows in export_chunks(chunk_size):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_ndjson(chunk_size=CHUNK_SIZE):
+    for rows in export_chunks(chunk_size):
+        yield "".join(json.dumps(row) + "\n" for row in rows)
+
+
+################
+#### import ####
+################
+
+def read_csv(stream):
+    # stream is a binary file object; rows are decoded and parsed lazily
+    return csv.DictReader(codecs.iterdecode(stream, "utf-8"))
+
+
+def read_ndjson(stream):
+    for line in codecs.iterdecode(stream, "utf-8"):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+READERS = {"csv": read_csv, "ndjson": read_ndjson}
+
+
+def validate(row, owner_id):
+    if not isinstance(row, dict):
+        return None, ["Not a valid record."]
+    data = MultiDict(
+        (key, str(value)) for key, value in row.items()
+        if key in ("name", "due_date", "priority") and value is not None
+    )
+    form = AddTaskForm(formdata=data, meta={"csrf": False})
+    if not form.validate():
+        return None, [f"{field}: {', '.join(errors)}"
+                      for field, errors in form.errors.items()]
+    try:
+        # NDJSON carries status as a number: 0 is closed, not missing
+        status = row.get("status")
+        status = 1 if status in (None, "") else int(status)
+        posted_date = row.get("posted_date")
+        posted_date = datetime.datetime.strptime(posted_date, DATE_FORMAT).date() \
+            if posted_date else datetime.date.today()
+        user_id = int(row.get("user_id") or 0) if owner_id is None else owner_id
+    except (TypeError, ValueError):
+        return None, ["status, posted_date or user_id is not valid."]
+    if status not in (0, 1) or not user_id:
+        return None, ["status must be 0 or 1 and the task needs an owner."]
+    return dict(
+        name=form.name.data,
+        due_date=form.due_date.data,
+        priority=int(form.priority.data),
+        posted_date=posted_date,
+        status=status,
+        user_id=user_id
+    ), None
+
+
+def import_tasks(rows, owner_id=None, batch_size=BATCH_SIZE):
+    # rows is any iterable of dicts; only one batch is held in memory.
+    # With owner_id=None the user_id column of each row is kept.
+    imported = 0
+    failed = 0
+    errors = []
+    batch = []
+    insert = Task.__table__.insert()
+    for number, row in enumerate(rows, start=1):
+        values, messages = validate(row, owner_id)
+        if messages:
+            failed += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append((number, messages))
+            continue
+        batch.append(values)
+        if len(batch) >= batch_size:
+            db.session.execute(insert, batch)
+            db.session.commit()
+            imported += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(insert, batch)
+        db.session.commit()
+        imported += len(batch)
+    return imported, failed, errors
@@ -1,11 +1,19 @@
 import datetime
 from functools import wraps
 from flask import flash, redirect, render_template, \
-    request, session, url_for, Blueprint
+    request, session, url_for, Blueprint, current_app, Response, \
+    stream_with_context, get_flashed_messages
+from jinja2 import Markup
+from sqlalchemy import case, func, or_
 
-from .forms import AddTaskForm
-from project import db
-from project.models import Task
+from . import transfer
+from .forms import AddTaskForm, BulkTaskForm, ClaimTaskForm, ImportTasksForm
+from project import db, fragment_cache
+from project.models import ClosedTask, Task, TaskArchive, TaskSummary, \
+    TaskVersion, User, ROW_COLUMNS, row_columns, task_rows
+from project.pagination import keyset_page, KeysetPage
+from project.replica import replica_reads, wrote
+from project.search import search_tasks
 
 
 ################
@@ -14,6 +22,12 @@ from project.models import Task
 
 tasks_blueprint = Blueprint("tasks", __name__)
 
+STATUS_CODES = {"open": "1", "closed": "0"}
+
+# ids per statement in the bulk endpoints, well below SQLite's bound
+# parameter limit
+BULK_CHUNK_SIZE = 500
+
 
 ##########################
 #### helper functions ####
@@ -31,13 +45,175 @@ def login_required(test):
 
 
 def open_tasks():
-    return db.session.query(Task).filter_by(
-        status="1").order_by(Task.due_date.asc())
+    # the listing's columns as plain tuples: no ORM instances, identity map
+    # or change tracking for rows that are only ever printed
+    return db.session.query(
+        *row_columns(Task), User.name.label("poster_name")
+    ).outerjoin(Task.poster).filter(Task.status == "1").order_by(
+        Task.due_date.asc(), Task.task_id.asc())
 
 
 def closed_tasks():
-    return db.session.query(Task).filter_by(
-        status="0").order_by(Task.due_date.asc())
+    # Hot and archived closed tasks as one list. SQLite merges the two
+    # ordered index scans and stops at the LIMIT, so a page never reads the
+    # whole archive; a join in the same statement would stop it flattening
+    # the union, hence task_rows() looks the posters up separately.
+    return db.session.query(*row_columns(ClosedTask)).order_by(
+        ClosedTask.due_date.asc(), ClosedTask.task_id.asc())
+
+
+def top_tasks(user_id, limit):
+    # The user's most urgent open tasks, their own and those they claimed.
+    # Each half is the head of one index range (ix_tasks_user_next,
+    # ix_tasks_claimed_next) cut off at the limit, so only the at most
+    # 2 * limit rows of the union are sorted.
+    def head(*criteria):
+        return db.session.query(*row_columns(Task)).filter(
+            Task.status == "1", *criteria
+        ).order_by(
+            Task.priority.desc(), Task.due_date.asc(), Task.task_id.asc()
+        ).limit(limit).subquery()
+
+    both = db.union_all(
+        db.select([head(Task.user_id == user_id)]),
+        db.select([head(Task.claimed_by == user_id, Task.user_id.isnot(user_id))])
+    ).alias("next_tasks")
+    return db.session.query(
+        *[both.c[name] for name in ROW_COLUMNS], User.name.label("poster_name")
+    ).outerjoin(User, User.id == both.c.user_id).order_by(
+        both.c.priority.desc(), both.c.due_date.asc(), both.c.task_id.asc()
+    ).limit(limit)
+
+
+# The pick and the claim are one statement, so two users claiming at once
+# can never get the same task. The literal status and the IS NULL let the
+# partial index apply, and naming it stops the planner walking every open
+# task instead.
+CLAIM_NEXT = db.text(
+    "UPDATE tasks SET claimed_by = :user_id, claimed_at = :now "
+    "WHERE task_id = (SELECT task_id FROM tasks INDEXED BY ix_tasks_queue "
+    "WHERE status = 1 AND claimed_by IS NULL "
+    "ORDER BY priority DESC, due_date, task_id LIMIT 1)"
+).bindparams(db.bindparam("now", type_=db.DateTime))
+
+
+def claim_next_task(user_id):
+    # takes the most urgent unclaimed open task off the shared queue for
+    # user_id and returns it, or None when the queue is empty; the caller
+    # commits
+    session = db.session()
+    # a text UPDATE is not seen by the replica routing on its own
+    wrote(session)
+    now = datetime.datetime.utcnow()
+    if not session.execute(CLAIM_NEXT, dict(user_id=user_id, now=now)).rowcount:
+        return None
+    # the UPDATE took the write lock, so nobody else can have claimed or
+    # changed the task before this read in the same transaction
+    return task_rows(open_tasks().filter(
+        Task.claimed_by == user_id, Task.claimed_at == now))[0]
+
+
+# the entity each list query selects, for filtering and keyset columns
+LIST_ENTITIES = {"open": Task, "closed": ClosedTask}
+
+
+def owned_tasks(*task_ids, model=Task, claimed=False):
+    # the ownership check is part of the statement, so a single conditional
+    # UPDATE/DELETE decides the outcome by its rowcount; with claimed, the
+    # user who claimed a task off the shared queue counts as well
+    query = db.session.query(model).filter(model.task_id.in_(task_ids))
+    if session["role"] != "admin":
+        if claimed:
+            query = query.filter(or_(model.user_id == session["user_id"],
+                                     model.claimed_by == session["user_id"]))
+        else:
+            query = query.filter(model.user_id == session["user_id"])
+    return query
+
+
+def delete_owned(*task_ids):
+    # a task is in exactly one of the two tables: ids are AUTOINCREMENT,
+    # so an archived task's id is never given to a new one
+    return sum(
+        owned_tasks(*task_ids, model=model).delete(synchronize_session=False)
+        for model in (Task, TaskArchive)
+    )
+
+
+def chunked(items, size=BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def task_tables():
+    # The rendered tables are cached per viewer; the global tasks version
+    # is bumped by every write to tasks, so stale entries are never read.
+    per_page = current_app.config.get("TASKS_PER_PAGE", 25)
+    version = TaskVersion.current()
+    viewer = "admin" if session["role"] == "admin" else "user:" + session["name"]
+    tables = {}
+    for status, query in (("open", open_tasks), ("closed", closed_tasks)):
+        cursor = request.args.get(f"{status}_after")
+        key = f"tasks:{status}:{viewer}:{per_page}:{cursor}:{version}"
+        cached = fragment_cache.get(key)
+        if cached is None:
+            entity = LIST_ENTITIES[status]
+            rows, next_cursor = keyset_page(
+                query(), cursor, per_page, entity.due_date, entity.task_id)
+            html = render_template(
+                "_task_table.html", tasks=task_rows(rows), status=status)
+            cached = (html, next_cursor)
+            fragment_cache.set(key, cached)
+        tables[f"{status}_table"] = Markup(cached[0])
+        tables[f"{status}_next"] = cached[1]
+    return tables
+
+
+def task_streams():
+    # Lazy pages for streamed rendering: rows are read from the cursor as
+    # the template reaches them. TASKS_STREAM_PER_PAGE=0 streams every row.
+    per_page = current_app.config.get("TASKS_STREAM_PER_PAGE", 0)
+    batch_size = current_app.config.get("TASKS_STREAM_BATCH_SIZE", 500)
+    return dict(
+        open_page=KeysetPage(
+            open_tasks(), request.args.get("open_after"), per_page,
+            Task.due_date, Task.task_id, batch_size, task_rows),
+        closed_page=KeysetPage(
+            closed_tasks(), request.args.get("closed_after"), per_page,
+            ClosedTask.due_date, ClosedTask.task_id, batch_size, task_rows)
+    )
+
+
+def summary_counts(*group_by):
+    # open, closed and overdue totals straight from task_summary; overdue
+    # is what is still open past its due date
+    today = datetime.date.today()
+    return db.session.query(
+        *group_by,
+        func.coalesce(func.sum(TaskSummary.open_count), 0).label("open"),
+        func.coalesce(func.sum(TaskSummary.closed_count), 0).label("closed"),
+        func.coalesce(func.sum(case(
+            [(TaskSummary.due_date < today, TaskSummary.open_count)], else_=0
+        )), 0).label("overdue")
+    ).group_by(*group_by)
+
+
+def streaming_requested():
+    default = current_app.config.get("TASKS_STREAMING", False)
+    return request.args.get("stream", type=int, default=int(default)) == 1
+
+
+def stream_template(template_name, **context):
+    # Flask 1.1 has no stream_template; the page header and forms go out
+    # before the first task row is read, rows follow in buffered chunks
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    # flashes are popped from the session now, while the cookie can still
+    # be updated, instead of halfway through the body
+    get_flashed_messages()
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(app.config.get("TASKS_STREAM_BUFFER", 16))
+    return Response(stream_with_context(stream), mimetype="text/html")
 
 
 ################
@@ -46,12 +222,92 @@ def closed_tasks():
 
 @tasks_blueprint.route("/tasks/")
 @login_required
+@replica_reads
 def tasks():
+    if streaming_requested():
+        return stream_template(
+            "tasks.html",
+            form=AddTaskForm(request.form),
+            import_form=ImportTasksForm(),
+            username=session["name"],
+            **task_streams()
+        )
     return render_template(
         "tasks.html",
         form=AddTaskForm(request.form),
-        open_tasks=open_tasks(),
-        closed_tasks=closed_tasks(),
+        import_form=ImportTasksForm(),
+        username=session["name"],
+        **task_tables()
+    )
+
+
+@tasks_blueprint.route("/tasks/next/")
+@login_required
+@replica_reads
+def next_tasks():
+    limit = current_app.config.get("TASKS_NEXT_LIMIT", 10)
+    return render_template(
+        "next.html",
+        form=ClaimTaskForm(),
+        tasks=task_rows(top_tasks(session["user_id"], limit)),
+        username=session["name"]
+    )
+
+
+@tasks_blueprint.route("/tasks/claim/", methods=["POST"])
+@login_required
+def claim_next():
+    form = ClaimTaskForm(request.form)
+    if form.validate_on_submit():
+        task = claim_next_task(session["user_id"])
+        db.session.commit()
+        if task is None:
+            flash("There are no unclaimed open tasks.")
+        else:
+            flash(f"You claimed \"{task.name}\", due {task.due_date}, "
+                  f"posted by {task.poster_name}.")
+    return redirect(url_for("tasks.next_tasks"))
+
+
+@tasks_blueprint.route("/dashboard/")
+@login_required
+@replica_reads
+def dashboard():
+    by_user = summary_counts(TaskSummary.user_id).subquery()
+    users = db.session.query(
+        User.name, by_user.c.open, by_user.c.closed, by_user.c.overdue
+    ).join(by_user, by_user.c.user_id == User.id).order_by(User.name).all()
+    return render_template(
+        "dashboard.html",
+        users=users,
+        priorities=summary_counts(TaskSummary.priority).order_by(
+            TaskSummary.priority.desc()).all(),
+        totals=summary_counts().one(),
+        username=session["name"]
+    )
+
+
+@tasks_blueprint.route("/tasks/search/")
+@login_required
+@replica_reads
+def search():
+    query = request.args.get("q", "")
+    status = request.args.get("status")
+    page = request.args.get("page", 1, type=int)
+    rows, has_more = search_tasks(
+        query,
+        STATUS_CODES.get(status),
+        request.args.get("owner", type=int),
+        page,
+        current_app.config.get("TASKS_PER_PAGE", 25)
+    )
+    return render_template(
+        "search.html",
+        tasks=rows,
+        query=query,
+        status=status if status in STATUS_CODES else None,
+        page=max(page, 1),
+        has_more=has_more,
         username=session["name"]
     )
 
@@ -78,37 +334,114 @@ def new_task():
     return render_template(
         "tasks.html",
         form=form,
+        import_form=ImportTasksForm(),
         error=error,
-        open_tasks=open_tasks(),
-        closed_tasks=closed_tasks()
+        username=session["name"],
+        **task_tables()
     )
 
 
 @tasks_blueprint.route("/complete/<int:task_id>/")
 @login_required
 def complete(task_id):
-    new_id = task_id
-    task = db.session.query(Task).filter_by(task_id=new_id)
-    if session["user_id"] == task.first().user_id or session["role"] == "admin":
-        task.update({"status": "0"})
-        db.session.commit()
+    updated = owned_tasks(task_id, claimed=True).update(
+        {"status": "0"}, synchronize_session=False)
+    db.session.commit()
+    if updated:
         flash("Task was marked as complete.")
-        return redirect(url_for("tasks.tasks"))
     else:
         flash("You can only update tasks that belong to you.")
-        return redirect(url_for("tasks.tasks"))
+    return redirect(url_for("tasks.tasks"))
 
 
 @tasks_blueprint.route("/delete/<int:task_id>/")
 @login_required
 def delete_entry(task_id):
-    new_id = task_id
-    task = db.session.query(Task).filter_by(task_id=new_id)
-    if session["user_id"] == task.first().user_id or session["role"] == "admin":
-        task.delete()
-        db.session.commit()
+    deleted = delete_owned(task_id)
+    db.session.commit()
+    if deleted:
         flash("The task was deleted.")
-        return redirect(url_for('tasks.tasks'))
     else:
         flash("You can only delete tasks that belong to you.")
+    return redirect(url_for("tasks.tasks"))
+
+
+@tasks_blueprint.route("/complete/", methods=["POST"])
+@login_required
+def complete_many():
+    form = BulkTaskForm(request.form)
+    if not form.validate_on_submit():
+        flash("Select at least one task.")
+        return redirect(url_for("tasks.tasks"))
+    task_ids = sorted(set(form.task_ids.data))
+    updated = 0
+    for chunk in chunked(task_ids):
+        updated += owned_tasks(*chunk, claimed=True).update(
+            {"status": "0"}, synchronize_session=False)
+    db.session.commit()
+    flash(f"{updated} task(s) marked as complete.")
+    if updated < len(task_ids):
+        flash("You can only update tasks that belong to you.")
+    return redirect(url_for("tasks.tasks"))
+
+
+@tasks_blueprint.route("/delete/", methods=["POST"])
+@login_required
+def delete_many():
+    form = BulkTaskForm(request.form)
+    if not form.validate_on_submit():
+        flash("Select at least one task.")
+        return redirect(url_for("tasks.tasks"))
+    task_ids = sorted(set(form.task_ids.data))
+    deleted = 0
+    for chunk in chunked(task_ids):
+        deleted += delete_owned(*chunk)
+    db.session.commit()
+    flash(f"{deleted} task(s) deleted.")
+    if deleted < len(task_ids):
+        flash("You can only delete tasks that belong to you.")
+    return redirect(url_for("tasks.tasks"))
+
+
+@tasks_blueprint.route("/tasks/export.<any(csv, ndjson):fmt>")
+@login_required
+@replica_reads
+def export_tasks(fmt):
+    chunk_size = current_app.config.get("TASKS_EXPORT_CHUNK_SIZE", transfer.CHUNK_SIZE)
+    if fmt == "csv":
+        chunks, mimetype = transfer.export_csv(chunk_size), "text/csv"
+    else:
+        chunks, mimetype = transfer.export_ndjson(chunk_size), "application/x-ndjson"
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=tasks.{fmt}"}
+    )
+
+
+@tasks_blueprint.route("/tasks/import/", methods=["POST"])
+@login_required
+def import_tasks():
+    form = ImportTasksForm()
+    if not form.validate_on_submit():
+        flash("Choose a .csv or .ndjson file to import.")
         return redirect(url_for("tasks.tasks"))
+    upload = form.file.data
+    fmt = upload.filename.rsplit(".", 1)[-1].lower()
+    if fmt not in transfer.READERS:
+        flash("Choose a .csv or .ndjson file to import.")
+        return redirect(url_for("tasks.tasks"))
+    # admins restore backups with their original owners, everybody else
+    # imports tasks as their own
+    owner_id = None if session["role"] == "admin" else session["user_id"]
+    imported, failed, errors = transfer.import_tasks(
+        transfer.READERS[fmt](upload.stream),
+        owner_id,
+        current_app.config.get("TASKS_IMPORT_BATCH_SIZE", transfer.BATCH_SIZE)
+    )
+    flash(f"{imported} task(s) imported.")
+    if failed:
+        flash(f"{failed} row(s) were rejected.")
+        for number, messages in errors[:10]:
+            flash(f"Row {number}: {' '.join(messages)}")
+    return redirect(url_for("tasks.tasks"))
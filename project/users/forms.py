@@ -1,7 +1,9 @@
-from flask_wtf import Form
+from flask_wtf.file import FileField, FileRequired
 from wtforms import StringField, PasswordField
 from wtforms.validators import DataRequired, Length, EqualTo, Email
 
+from project.csrf import Form
+
 
 class RegisterForm(Form):
     name = StringField(
@@ -30,3 +32,7 @@ class LoginForm(Form):
         "Password",
         validators=[DataRequired()]
     )
+
+
+class ProvisionUsersForm(Form):
+    file = FileField("Users file (.csv)", validators=[FileRequired()])
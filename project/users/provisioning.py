@@ -0,0 +1,143 @@
+# project/users/provisioning.py
+# Bulk account creation from a CSV file with name, email, password and an
+# optional role column, for admins onboarding a whole team at once
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import MultiDict
+
+from .forms import RegisterForm
+from project import db, password_hasher
+from project.models import User
+from project.tasks.transfer import read_csv
+
+ROLES = ("user", "admin")
+# the duplicate check binds two IN lists per batch, well below SQLite's
+# bound parameter limit
+BATCH_SIZE = 250
+# the most rows the web form takes: hashing them has to fit in the request
+# timeout, larger files go through db_provision.py
+MAX_WEB_ROWS = 200
+# only the first few bad rows are reported back, the rest are just counted
+MAX_REPORTED_ERRORS = 100
+UNIQUE_COLUMNS = ("name", "email")
+
+
+def validate(row):
+    # the same rules as the register form
+    if not isinstance(row, dict):
+        return None, ["Not a valid record."]
+    password = row.get("password") or ""
+    data = MultiDict(dict(name=row.get("name") or "",
+                          email=row.get("email") or "",
+                          password=password, confirm=password))
+    form = RegisterForm(formdata=data, meta={"csrf": False})
+    if not form.validate():
+        return None, [f"{field}: {', '.join(errors)}"
+                      for field, errors in form.errors.items()]
+    role = (row.get("role") or "user").strip()
+    if role not in ROLES:
+        return None, [f"role must be one of {', '.join(ROLES)}."]
+    return dict(name=form.name.data, email=form.email.data,
+                password=password, role=role), None
+
+
+def taken(batch):
+    # the batch's names and emails that already exist, read with one query
+    # over the two unique indexes
+    rows = db.session.query(User.name, User.email).filter(or_(
+        User.name.in_([values["name"] for _, values in batch]),
+        User.email.in_([values["email"] for _, values in batch])
+    ))
+    existing = dict(name=set(), email=set())
+    for name, email in rows:
+        existing["name"].add(name)
+        existing["email"].add(email)
+    return existing
+
+
+def insert(batch):
+    # One transaction per batch. A registration that slips in between the
+    # check and the insert fails the whole statement; the batch is then
+    # inserted row by row so only the conflicting row is rejected.
+    # Returns the number created and the rejected rows.
+    insert = User.__table__.insert()
+    try:
+        db.session.execute(insert, [values for _, values in batch])
+        db.session.commit()
+        return len(batch), []
+    except IntegrityError:
+        db.session.rollback()
+    created = 0
+    rejected = []
+    for number, values in batch:
+        try:
+            db.session.execute(insert, values)
+            db.session.commit()
+            created += 1
+        except IntegrityError:
+            db.session.rollback()
+            rejected.append(
+                (number, ["That username and/or email already exists."]))
+    return created, rejected
+
+
+def provision_users(rows, batch_size=BATCH_SIZE):
+    # rows is any iterable of dicts; only one batch of plain text passwords
+    # is held in memory at a time. Rows that are invalid, repeat a name or
+    # email from earlier in the file or clash with an existing account are
+    # reported by row number and the rest are still created.
+    created = 0
+    failed = 0
+    errors = []
+    seen = dict(name=set(), email=set())
+
+    def reject(number, messages):
+        nonlocal failed
+        failed += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append((number, messages))
+
+    def flush(batch):
+        nonlocal created
+        existing = taken(batch)
+        accepted = []
+        for number, values in batch:
+            messages = [f"{column}: {values[column]} is already taken."
+                        for column in UNIQUE_COLUMNS
+                        if values[column] in existing[column]]
+            if messages:
+                reject(number, messages)
+            else:
+                accepted.append((number, values))
+        if not accepted:
+            return
+        # the expensive part, spread over the hashing pool
+        hashes = password_hasher.hash_many(
+            [values["password"] for _, values in accepted])
+        for (_, values), pw_hash in zip(accepted, hashes):
+            values["password"] = pw_hash
+        inserted, rejected = insert(accepted)
+        created += inserted
+        for number, messages in rejected:
+            reject(number, messages)
+
+    batch = []
+    for number, row in enumerate(rows, start=1):
+        values, messages = validate(row)
+        if not messages:
+            messages = [f"{column}: {values[column]} appears earlier in the file."
+                        for column in UNIQUE_COLUMNS
+                        if values[column] in seen[column]]
+        if messages:
+            reject(number, messages)
+            continue
+        for column in UNIQUE_COLUMNS:
+            seen[column].add(values[column])
+        batch.append((number, values))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    return created, failed, errors
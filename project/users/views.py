@@ -3,12 +3,15 @@
 #################
 
 from functools import wraps
+from itertools import islice
 from flask import flash, redirect, render_template, \
-    request, session, url_for, Blueprint
+    request, session, url_for, Blueprint, current_app
 from sqlalchemy.exc import IntegrityError
 
-from .forms import RegisterForm, LoginForm
-from project import db, bcrypt
+from . import provisioning
+from .forms import RegisterForm, LoginForm, ProvisionUsersForm
+from project import db, password_hasher
+from project.hashing import HasherBusy
 from project.models import User
 
 ################
@@ -66,7 +69,15 @@ def login():
     if request.method == "POST":
         if form.validate_on_submit():
             user = User.query.filter_by(name=request.form["name"]).first()
-            if user is not None and bcrypt.check_password_hash(user.password, request.form["password"]):
+            if user is not None and password_hasher.check(user.password, request.form["password"]):
+                if password_hasher.needs_rehash(user.password):
+                    # the work factor changed since this hash was made; with
+                    # the hasher busy it waits for a later login
+                    try:
+                        user.password = password_hasher.hash(request.form["password"])
+                        db.session.commit()
+                    except HasherBusy:
+                        pass
                 session["logged_in"] = True
                 session["user_id"] = user.id
                 session["role"] = user.role
@@ -88,7 +99,7 @@ def register():
             new_user = User(
                 form.name.data,
                 form.email.data,
-                bcrypt.generate_password_hash(form.password.data)
+                password_hasher.hash(form.password.data)
             )
             try:
                 db.session.add(new_user)
@@ -99,3 +110,30 @@ def register():
                 error = "That username and/or email already exists."
                 return render_template("register.html", form=form, error=error)
     return render_template("register.html", form=form, error=error)
+
+
+@users_blueprint.route("/users/provision/", methods=["GET", "POST"])
+@login_required
+def provision():
+    if session["role"] != "admin":
+        flash("Only admins can provision users.")
+        return redirect(url_for("tasks.tasks"))
+    form = ProvisionUsersForm()
+    result = None
+    if form.validate_on_submit():
+        max_rows = current_app.config.get(
+            "USERS_PROVISION_MAX_ROWS", provisioning.MAX_WEB_ROWS)
+        rows = list(islice(
+            provisioning.read_csv(form.file.data.stream), max_rows + 1))
+        if len(rows) > max_rows:
+            form.file.errors.append(
+                f"Files over {max_rows} rows have to be provisioned "
+                "with db_provision.py.")
+        else:
+            created, failed, errors = provisioning.provision_users(
+                rows, current_app.config.get(
+                    "USERS_PROVISION_BATCH_SIZE", provisioning.BATCH_SIZE)
+            )
+            result = dict(created=created, failed=failed, errors=errors)
+    return render_template(
+        "provision.html", form=form, result=result, username=session["name"])
@@ -0,0 +1,89 @@
+# tests/base.py
+# Shared test setup: one app on an in-memory database, created once, with
+# every test run inside a transaction that is rolled back afterwards; and a
+# pre-migration database file for the migration, archive and reminder tests
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from flask import _app_ctx_stack
+from sqlalchemy import event, orm
+
+from project import create_app, db
+from project.config import TestConfig
+from project.replica import RoutingSession
+
+app = create_app(TestConfig)
+# sessions opened by the tests themselves, outside any request
+db.app = app
+
+with app.app_context():
+    db.create_all()
+    connection = db.engine.connect()
+
+
+@event.listens_for(connection, "begin")
+def begin(conn):
+    # pysqlite runs with isolation_level=None (see TestConfig), so the
+    # transaction is opened here rather than by the driver
+    conn.execute("BEGIN")
+
+
+class TestSession(RoutingSession):
+    # Each session works inside a savepoint of the test's transaction: the
+    # app's commits release it and its rollbacks roll back to it, and a new
+    # one is started straight away, so nothing ever reaches the database.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.begin_nested()
+        event.listen(self, "after_transaction_end", self.restart_savepoint)
+
+    @staticmethod
+    def restart_savepoint(session, transaction):
+        if transaction.nested and not transaction._parent.nested:
+            session.expire_all()
+            session.begin_nested()
+
+
+db.session = orm.scoped_session(
+    orm.sessionmaker(class_=TestSession, db=db, bind=connection, binds={}),
+    scopefunc=_app_ctx_stack.__ident_func__
+)
+
+
+class FlaskTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.transaction = connection.begin()
+        app.extensions["fragment_cache"].clear()
+        self.app = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        self.transaction.rollback()
+
+
+class LegacyDatabaseTestCase(unittest.TestCase):
+    # a database file as the app left it before any migration: no roles, no
+    # task owners, and eleven open tasks that are all due on 2020-10-08
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        with sqlite3.connect(self.path) as connection:
+            connection.execute("""CREATE TABLE users (
+                id INTEGER PRIMARY KEY, name VARCHAR, email VARCHAR,
+                password VARCHAR)""")
+            connection.execute("""CREATE TABLE tasks (
+                task_id INTEGER PRIMARY KEY, name VARCHAR, due_date DATE,
+                priority INTEGER, status INTEGER)""")
+            connection.executemany(
+                "INSERT INTO tasks VALUES (?, ?, '2020-10-08', 1, 1)",
+                [(i, f"task {i}") for i in range(1, 12)]
+            )
+
+    def tearDown(self):
+        os.remove(self.path)
@@ -0,0 +1,238 @@
+# tests/test_api.py
+
+import os
+import unittest
+
+from sqlalchemy import event
+
+from base import FlaskTestCase, app
+from project import db
+from project.models import Task, TaskVersion
+from project.tasks.views import top_tasks
+
+
+
+class ApiTests(FlaskTestCase):
+
+    # helper methods
+    def register(self, name, email, password, confirm):
+        return self.app.post(
+            "register/",
+            data=dict(name=name, email=email, password=password,
+                confirm=confirm),
+            follow_redirects=True
+        )
+
+    def login(self, name, password):
+        return self.app.post('/', data=dict(
+        name=name, password=password), follow_redirects=True)
+
+    def logout(self):
+        return self.app.get("logout/", follow_redirects=True)
+
+    def get_in(self, name, email):
+        self.register(name, email, "python", "python")
+        self.login(name, "python")
+
+    def create_task(self, due_date="10/08/2020", priority="1"):
+        return self.app.post("add/", data=dict(
+            name="Test task",
+            due_date=due_date,
+            priority=priority,
+            posted_date="09/10/2020",
+            status="1"
+            ), follow_redirects=True)
+
+    def test_api_requires_login(self):
+        response = self.app.get("api/tasks/open/")
+        self.assertEqual(response.status_code, 401)
+
+    def test_api_lists_open_and_closed_tasks(self):
+        self.get_in("Marek1", "marek@rp.com")
+        self.create_task()
+        self.create_task()
+        self.app.get("complete/2/")
+        response = self.app.get("api/tasks/open/")
+        self.assertEqual(response.status_code, 200)
+        tasks = response.get_json()["tasks"]
+        self.assertEqual([task["task_id"] for task in tasks], [1])
+        self.assertEqual(tasks[0]["poster"], "Marek1")
+        self.assertTrue(tasks[0]["can_modify"])
+        response = self.app.get("api/tasks/closed/")
+        self.assertEqual([task["task_id"] for task in response.get_json()["tasks"]], [2])
+
+    def test_api_paginates_and_filters_by_owner(self):
+        self.get_in("Marek1", "marek@rp.com")
+        self.create_task("10/08/2020")
+        self.create_task("10/09/2020")
+        self.logout()
+        self.get_in("Marek2", "marek2@rp.com")
+        self.create_task("10/07/2020")
+        response = self.app.get("api/tasks/open/?limit=2")
+        data = response.get_json()
+        self.assertEqual([task["task_id"] for task in data["tasks"]], [3, 1])
+        self.assertEqual(data["next"], "2020-10-08_1")
+        response = self.app.get("api/tasks/open/?limit=2&after=" + data["next"])
+        self.assertEqual([task["task_id"] for task in response.get_json()["tasks"]], [2])
+        response = self.app.get("api/tasks/open/?owner=1")
+        self.assertEqual([task["task_id"] for task in response.get_json()["tasks"]], [1, 2])
+
+    def test_conditional_get_returns_304_without_querying_tasks(self):
+        self.get_in("Marek1", "marek@rp.com")
+        self.create_task()
+        response = self.app.get("api/tasks/open/")
+        etag = response.headers["ETag"]
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            response = self.app.get(
+                "api/tasks/open/", headers={"If-None-Match": etag})
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([s for s in statements if "FROM tasks" in s])
+
+    def test_writes_change_the_etag(self):
+        self.get_in("Marek1", "marek@rp.com")
+        self.create_task()
+        etag = self.app.get("api/tasks/open/").headers["ETag"]
+        self.app.get("complete/1/")
+        response = self.app.get(
+            "api/tasks/open/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_task_versions_are_kept_per_user(self):
+        self.get_in("Marek1", "marek@rp.com")
+        self.create_task()
+        self.create_task()
+        self.app.get("delete/2/")
+        self.assertEqual(TaskVersion.current(), 3)
+        self.assertEqual(TaskVersion.current(1), 3)
+        self.assertEqual(TaskVersion.current(2), 0)
+
+    def test_api_search_is_ranked_and_paginated(self):
+        self.get_in("Marek1", "marek@rp.com")
+        for name in ("milk", "milk milk", "bread"):
+            self.app.post("add/", data=dict(
+                name=name, due_date="10/08/2020", priority="1"))
+        response = self.app.get("api/tasks/search/?q=milk&limit=1")
+        data = response.get_json()
+        self.assertEqual([task["task_id"] for task in data["tasks"]], [2])
+        self.assertEqual(data["next"], 2)
+        response = self.app.get("api/tasks/search/?q=milk&limit=1&page=2")
+        data = response.get_json()
+        self.assertEqual([task["task_id"] for task in data["tasks"]], [1])
+        self.assertIsNone(data["next"])
+        response = self.app.get("api/tasks/search/?q=milk&owner=2")
+        self.assertEqual(response.get_json()["tasks"], [])
+        response = self.app.get("api/tasks/search/?q=milk&status=done")
+        self.assertEqual(response.status_code, 400)
+
+    def test_next_tasks_are_ordered_by_priority_then_due_date(self):
+        self.get_in("Marek1", "marek@rp.com")
+        self.create_task("10/09/2020", "5")
+        self.create_task("10/08/2020", "1")
+        self.create_task("10/10/2020", "5")
+        self.create_task("10/07/2020", "10")
+        self.create_task("10/08/2020", "5")
+        self.app.get("complete/4/")
+        self.logout()
+        self.get_in("Marek2", "marek2@rp.com")
+        self.create_task("10/01/2020", "10")
+        self.logout()
+        self.login("Marek1", "python")
+        response = self.app.get("api/tasks/next/?limit=3")
+        tasks = response.get_json()["tasks"]
+        self.assertEqual([task["task_id"] for task in tasks], [5, 1, 3])
+        self.assertEqual(tasks[0]["poster"], "Marek1")
+        response = self.app.get("api/tasks/next/")
+        self.assertEqual(
+            [task["task_id"] for task in response.get_json()["tasks"]],
+            [5, 1, 3, 2])
+
+    def test_next_tasks_read_two_index_ranges(self):
+        with app.test_request_context():
+            query = top_tasks(1, 10)
+            statement = str(query.statement.compile(
+                db.engine, compile_kwargs={"literal_binds": True}))
+            plan = [row[-1] for row in db.session.execute(
+                "EXPLAIN QUERY PLAN " + statement)]
+        searches = [step for step in plan if step.startswith("SEARCH tasks")]
+        self.assertIn("ix_tasks_user_next", searches[0])
+        self.assertIn("ix_tasks_claimed_next", searches[1])
+        self.assertFalse([step for step in plan if step.startswith("SCAN tasks")])
+
+    def test_claims_hand_out_each_open_task_once(self):
+        self.get_in("Marek1", "marek@rp.com")
+        self.create_task("10/09/2020", "1")
+        self.create_task("10/08/2020", "3")
+        self.create_task("10/07/2020", "2")
+        self.app.get("complete/2/")
+        self.logout()
+        self.get_in("Marek2", "marek2@rp.com")
+        claimed = []
+        for _ in range(2):
+            response = self.app.post("api/tasks/claim/")
+            self.assertEqual(response.status_code, 200)
+            claimed.append(response.get_json()["task"]["task_id"])
+        self.assertEqual(claimed, [3, 1])
+        response = self.app.post("api/tasks/claim/")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(
+            [task.claimed_by for task in Task.query.order_by(Task.task_id)],
+            [2, None, 2])
+
+    def test_claimers_see_and_complete_their_claimed_tasks(self):
+        self.get_in("Marek1", "marek@rp.com")
+        self.create_task("10/09/2020", "1")
+        self.logout()
+        self.get_in("Marek2", "marek2@rp.com")
+        self.app.post("api/tasks/claim/")
+        tasks = self.app.get("api/tasks/next/").get_json()["tasks"]
+        self.assertEqual([task["task_id"] for task in tasks], [1])
+        self.assertEqual(tasks[0]["claimed_by"], 2)
+        self.logout()
+        self.get_in("Marek3", "marek3@rp.com")
+        self.app.get("complete/1/")
+        self.assertEqual(Task.query.get(1).status, 1)
+        self.logout()
+        self.login("Marek2", "python")
+        self.app.get("complete/1/")
+        self.assertEqual(Task.query.get(1).status, 0)
+
+    def test_claims_change_the_task_list_and_the_etag(self):
+        self.get_in("Marek1", "marek@rp.com")
+        self.create_task()
+        self.logout()
+        self.get_in("Marek2", "marek2@rp.com")
+        self.assertNotIn(b"complete/1/", self.app.get("tasks/").data)
+        etag = self.app.get("api/tasks/open/").headers["ETag"]
+        self.app.post("api/tasks/claim/")
+        self.assertIn(b"complete/1/", self.app.get("tasks/").data)
+        response = self.app.get(
+            "api/tasks/open/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["tasks"][0]["claimed_by"], 2)
+
+    def test_claims_need_the_csrf_token(self):
+        self.get_in("Marek1", "marek@rp.com")
+        self.create_task()
+        app.config["WTF_CSRF_ENABLED"] = True
+        self.addCleanup(app.config.__setitem__, "WTF_CSRF_ENABLED", False)
+        response = self.app.post("api/tasks/claim/")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("CSRF", response.get_json()["error"])
+        token = self.app.get("api/tasks/next/").get_json()["csrf_token"]
+        response = self.app.post(
+            "api/tasks/claim/", headers={"X-CSRFToken": token})
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+# tests/test_archive.py
+
+import unittest
+
+from base import LegacyDatabaseTestCase
+from project import migrations
+from project.archive import archive_closed_tasks
+
+
+class ArchiveTests(LegacyDatabaseTestCase):
+
+    def test_archived_tasks_keep_their_search_index(self):
+        migrations.upgrade(self.path, target=10, log=lambda m: None)
+        connection = migrations.connect(self.path)
+        connection.execute("UPDATE tasks SET status = 0 WHERE task_id <= 2")
+        archive_closed_tasks(connection, after_days=0)
+        migrations.upgrade(self.path, log=lambda m: None)
+        match = "SELECT rowid FROM tasks_archive_fts " \
+            "WHERE tasks_archive_fts MATCH ? ORDER BY rowid"
+        self.assertEqual(connection.execute(match, ("task",)).fetchall(), [(1,), (2,)])
+        connection.execute("UPDATE tasks SET status = 0 WHERE task_id = 3")
+        archive_closed_tasks(connection, after_days=0)
+        connection.execute("DELETE FROM tasks_archive WHERE task_id = 1")
+        self.assertEqual(connection.execute(match, ("task",)).fetchall(), [(2,), (3,)])
+        connection.close()
+
+    def test_archiving_moves_old_closed_tasks_in_batches(self):
+        migrations.upgrade(self.path, log=lambda m: None)
+        connection = migrations.connect(self.path)
+        connection.execute("UPDATE tasks SET status = 0 WHERE task_id <= 5")
+        connection.execute(
+            "UPDATE tasks SET due_date = '2999-01-01' WHERE task_id = 5")
+        moved = archive_closed_tasks(connection, after_days=30, batch_size=2)
+        self.assertEqual(moved, 4)
+        archived = [row[0] for row in connection.execute(
+            "SELECT task_id FROM tasks_archive ORDER BY task_id")]
+        self.assertEqual(archived, [1, 2, 3, 4])
+        self.assertEqual(
+            connection.execute("SELECT count(*) FROM tasks").fetchone()[0], 7)
+        self.assertEqual(migrations.reconcile_summary(connection), 0)
+        connection.close()
+
+    def test_task_ids_are_not_reused_after_archiving(self):
+        migrations.upgrade(self.path, log=lambda m: None)
+        connection = migrations.connect(self.path)
+        connection.execute("UPDATE tasks SET status = 0 WHERE task_id = 11")
+        archive_closed_tasks(connection, after_days=0)
+        connection.execute("INSERT INTO tasks (name, due_date, priority, status) "
+                           "VALUES ('new', '2020-10-08', 1, 1)")
+        self.assertEqual(connection.execute(
+            "SELECT task_id FROM tasks WHERE name = 'new'").fetchone()[0], 12)
+        connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
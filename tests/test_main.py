@@ -1,33 +1,41 @@
+import datetime
+import gzip
+import json
 import os
+import queue
+import re
+import sqlite3
+import tempfile
+import time
 import unittest
+from unittest import mock
 
-from project import app, db
-from project._config import basedir
-from project.models import User
+import sqlalchemy
 
-TEST_DB = "test.db"
+import project
+from base import FlaskTestCase, app
+from project import create_app, db, password_hasher
+from project.assets import build, build_manifest
+from project.config import TestConfig
+from project.log_writer import ErrorLogWriter
+from project.metrics import MetricsStore, Registry, archive_snapshots
+from project.models import Task, User
+from project.profiling import QueryBudgetExceeded
+from project.replica import sync_replica
+from project.selfcheck import worker_model_warnings
 
-class MainTests(unittest.TestCase):
+
+class MainTests(FlaskTestCase):
     ############################
     #### setup and teardown ####
     ############################
 
     # executed prior to each test
     def setUp(self):
-        app.config["TESTING"] = True
-        app.config["WTF_CSRF_ENABLED"] = False
-        app.config["DEBUG"] = False
-        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + \
-            os.path.join(basedir, TEST_DB)
-        self.app = app.test_client()
-        db.create_all()
+        super().setUp()
 
         self.assertEquals(app.debug, False)
 
-    def tearDown(self):
-        db.session.remove()
-        db.drop_all()
-
     ########################
     #### helper methods ####
     ########################
@@ -44,6 +52,356 @@ class MainTests(unittest.TestCase):
         response = self.app.get("/this-route-does-not-exist/")
         self.assertEquals(response.status_code, 404)
 
+    def test_404_error_is_logged_in_the_old_format(self):
+        writer = ErrorLogWriter()
+        writer.path = os.path.join(tempfile.mkdtemp(), "error.log")
+        with open(writer.path, "w") as f:
+            f.write("old line")
+        with mock.patch.object(project, "error_log", writer):
+            self.app.get("/nope/")
+        writer.flush()
+        with open(writer.path) as f:
+            lines = f.read().split("\n")
+        self.assertEqual(lines[0], "old line")
+        self.assertRegex(
+            lines[1],
+            r"^404 error at \d\d-\d\d-\d{4} \d\d:\d\d:\d\d: http://localhost/nope/$")
+
+    def test_error_log_rotates_by_size(self):
+        writer = ErrorLogWriter()
+        writer.path = os.path.join(tempfile.mkdtemp(), "error.log")
+        writer.max_bytes = 100
+        writer.backup_count = 2
+        for number in range(20):
+            writer.write(f"404 error at 05-03-2020 13:30:40: /{number:02}")
+            writer.flush()
+        self.assertTrue(os.path.exists(writer.path + ".1"))
+        self.assertTrue(os.path.exists(writer.path + ".2"))
+        self.assertFalse(os.path.exists(writer.path + ".3"))
+        self.assertLessEqual(os.path.getsize(writer.path), 100)
+
+    def test_error_log_drops_instead_of_blocking_when_full(self):
+        writer = ErrorLogWriter()
+        writer.path = os.path.join(tempfile.mkdtemp(), "error.log")
+        writer.queue_size = 1
+        writer.sample_above = 1
+        writer._pid = os.getpid()
+        writer._queue = queue.Queue(1)
+        writer._queue.put("\nblocker")
+        self.assertFalse(writer.write("404 error at 05-03-2020 13:30:40: /"))
+        self.assertEqual(writer.dropped, 1)
+
+    def test_error_log_writer_survives_a_bad_line(self):
+        writer = ErrorLogWriter()
+        writer.path = os.path.join(tempfile.mkdtemp(), "error.log")
+        write_batch = writer._write_batch
+
+        def failing(lines):
+            if any("bad" in line for line in lines):
+                raise UnicodeEncodeError("ascii", "bad", 0, 1, "not ascii")
+            write_batch(lines)
+
+        writer._write_batch = failing
+        with self.assertLogs("project.log_writer", "WARNING") as logged:
+            for entry in ("first", "bad", "last"):
+                writer.write(entry)
+            self.assertTrue(writer.flush())
+        self.assertIn("dropped a line", logged.output[0])
+        self.assertEqual(writer.dropped, 1)
+        with open(writer.path) as f:
+            self.assertEqual(f.read(), "\nfirst\nlast")
+        writer.write("after")
+        writer.flush()
+        self.assertEqual(writer.written, 3)
+
+    def test_error_log_flush_gives_up_after_the_timeout(self):
+        writer = ErrorLogWriter()
+        writer._pid = os.getpid()
+        # nothing consumes this queue
+        writer._queue = queue.Queue()
+        writer._queue.put("\nstuck")
+        started = time.monotonic()
+        self.assertFalse(writer.flush(timeout=0.1))
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_a_second_app_does_not_reconfigure_the_first(self):
+        create_app(dict(TestConfig.__dict__,
+            SQL_PROFILING=False, SQL_QUERY_BUDGET=None,
+            FRAGMENT_CACHE_ENTRIES=3, ERROR_LOG_PATH="/tmp/other.log",
+            METRICS_FLUSH_INTERVAL=60))
+        profiler = app.extensions["sql_profiler"]
+        self.assertTrue(profiler.enabled)
+        self.assertEqual(profiler.budget, app.config["SQL_QUERY_BUDGET"])
+        self.assertEqual(app.extensions["fragment_cache"].max_entries,
+                         app.config.get("FRAGMENT_CACHE_ENTRIES", 128))
+        self.assertEqual(app.extensions["error_log"].path,
+                         app.config.get("ERROR_LOG_PATH", "error.log"))
+        self.assertEqual(app.extensions["metrics"].flush_interval, 5.0)
+
+    def test_sqlite_connections_are_tuned_from_config(self):
+        # pragmas only stick on a database file, not the in-memory test one
+        path = os.path.join(tempfile.mkdtemp(), "tuned.db")
+        file_app = create_app(dict(TestConfig.__dict__,
+            SQLALCHEMY_DATABASE_URI="sqlite:///" + path,
+            SQLALCHEMY_ENGINE_OPTIONS={}))
+        with file_app.app_context():
+            connection = db.engine.connect()
+            try:
+                self.assertEqual(connection.execute("PRAGMA journal_mode").scalar(), "wal")
+                self.assertEqual(connection.execute("PRAGMA synchronous").scalar(), 1)
+                self.assertEqual(
+                    connection.execute("PRAGMA busy_timeout").scalar(),
+                    file_app.config["SQLITE_BUSY_TIMEOUT"])
+            finally:
+                connection.close()
+            self.assertEqual(type(db.engine.pool).__name__, "QueuePool")
+            db.engine.dispose()
+        self.assertEqual(file_app.extensions["sqlite_engine"]["journal_mode"], "WAL")
+
+    def test_pragmas_only_tune_the_apps_own_engines(self):
+        path = os.path.join(tempfile.mkdtemp(), "tuned.db")
+        create_app(dict(TestConfig.__dict__,
+            SQLALCHEMY_DATABASE_URI="sqlite:///" + path,
+            SQLALCHEMY_ENGINE_OPTIONS={}))
+        other = sqlalchemy.create_engine("sqlite:///" + path + "-other")
+        self.addCleanup(other.dispose)
+        self.assertEqual(other.execute("PRAGMA journal_mode").scalar(), "delete")
+
+    def test_pragmas_that_do_not_take_effect_are_logged_as_warnings(self):
+        path = os.path.join(tempfile.mkdtemp(), "tuned.db")
+        file_app = create_app(dict(TestConfig.__dict__,
+            SQLALCHEMY_DATABASE_URI="sqlite:///" + path,
+            SQLALCHEMY_ENGINE_OPTIONS={},
+            SQLITE_JOURNAL_MODE="wal2"))
+        with file_app.app_context(), \
+                self.assertLogs("project.engine", "WARNING") as logs:
+            db.engine.connect().close()
+            db.engine.dispose()
+        self.assertIn("journal_mode is delete, not wal2", logs.output[0])
+
+    def test_list_reads_go_to_the_replica_until_the_client_writes(self):
+        directory = tempfile.mkdtemp()
+        primary = os.path.join(directory, "primary.db")
+        replica = os.path.join(directory, "replica.db")
+        file_app = create_app(dict(TestConfig.__dict__,
+            SQLALCHEMY_DATABASE_URI="sqlite:///" + primary,
+            SQLALCHEMY_READ_DATABASE_URI="sqlite:///" + replica,
+            SQLALCHEMY_ENGINE_OPTIONS={}))
+        # real sessions instead of the rolled back test ones
+        self.addCleanup(setattr, db, "session", db.session)
+        db.session = db.create_scoped_session()
+        with file_app.app_context():
+            db.create_all()
+            db.session.add(User("michael", "michael@realpython.com",
+                                password_hasher.hash("python"), "user"))
+            db.session.add(Task("synced", datetime.date(2020, 10, 8), 1,
+                                datetime.date(2020, 10, 1), "1", 1))
+            db.session.commit()
+            db.session.remove()
+        sync_replica(primary, replica)
+        with sqlite3.connect(primary) as connection:
+            connection.execute(
+                "INSERT INTO tasks (name, due_date, priority, status, user_id) "
+                "VALUES ('unsynced', '2020-10-09', 1, 1, 1)")
+
+        def open_names(client):
+            response = client.get("/api/tasks/open/")
+            return [task["name"] for task in json.loads(response.data)["tasks"]]
+
+        client = file_app.test_client()
+        client.post("/", data=dict(name="michael", password="python"))
+        self.assertEqual(open_names(client), ["synced"])
+        client.post("/add/", data=dict(
+            name="added", due_date="10/10/2020", priority="1"))
+        # the writer reads its own writes from the primary
+        self.assertEqual(open_names(client), ["synced", "unsynced", "added"])
+        other = file_app.test_client()
+        other.post("/", data=dict(name="michael", password="python"))
+        self.assertEqual(open_names(other), ["synced"])
+        sync_replica(primary, replica)
+        self.assertEqual(open_names(other), ["synced", "unsynced", "added"])
+        with file_app.app_context():
+            db.get_engine(file_app, "replica").dispose()
+            db.engine.dispose()
+
+    def test_static_assets_are_fingerprinted_and_cached_for_good(self):
+        response = self.app.get("/")
+        url = re.search(r'href="(/static/css/main\.\w+\.css)"',
+                        response.data.decode()).group(1)
+        response = self.app.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Cache-Control"],
+                         "public, max-age=31536000, immutable")
+        self.assertEqual(response.data, self.app.get("/static/css/main.css").data)
+        self.assertNotIn("immutable",
+                         self.app.get("/static/css/main.css").headers.get("Cache-Control", ""))
+
+    def test_build_step_precompresses_assets(self):
+        static_folder = tempfile.mkdtemp()
+        os.mkdir(os.path.join(static_folder, "css"))
+        with open(os.path.join(static_folder, "css", "site.css"), "w") as f:
+            f.write("body { color: black; }\n" * 100)
+        manifest = build(static_folder)
+        name = manifest["css/site.css"]
+        self.assertRegex(name, r"^css/site\.[0-9a-f]{12}\.css$")
+        self.assertEqual(build_manifest(static_folder), manifest)
+        asset_app = create_app(dict(TestConfig.__dict__))
+        asset_app.static_folder = static_folder
+        asset_app.extensions["assets"]["sources"] = {name: "css/site.css"}
+        response = asset_app.test_client().get(
+            "/static/" + name, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.data),
+                         b"body { color: black; }\n" * 100)
+        response.close()
+
+    def profile(self, **settings):
+        # temporarily change the test app's profiler settings
+        state = app.extensions["sql_profiler"]
+        for name, value in settings.items():
+            self.addCleanup(setattr, state, name, getattr(state, name))
+            setattr(state, name, value)
+
+    def test_slow_queries_are_logged_with_their_view_and_plan(self):
+        self.profile(slow_ms=0)
+        with self.assertLogs("project.profiling", "WARNING") as logs:
+            self.login("nobody", "python")
+        entry = app.extensions["sql_profiler"].slow_queries[-1]
+        self.assertEqual(entry["view"], "users.login")
+        self.assertIn("FROM users", entry["statement"])
+        self.assertIn("'nobody'", entry["parameters"])
+        self.assertIn("SEARCH users USING INDEX", " ".join(entry["plan"]))
+        self.assertIn("users.login", logs.output[0])
+
+    def test_views_over_their_query_budget_fail(self):
+        self.profile(budgets={"users.login": 0})
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            self.login("nobody", "python")
+        self.assertEqual(raised.exception.endpoint, "users.login")
+        self.assertIn("1 queries, budget is 0", str(raised.exception))
+
+    def test_full_scans_of_large_tables_fail(self):
+        self.profile(scan_exempt=())
+        with self.app.session_transaction() as cookie:
+            cookie.update(logged_in=True, user_id=1, role="user", name="x")
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            self.app.get("/tasks/export.csv").data
+        self.assertEqual(raised.exception.problems, ["full scan of tasks, tasks_archive"])
+
+    def test_metrics_endpoint_reports_latency_sql_and_templates(self):
+        self.app.get("/")
+        self.login("nobody", "secret")
+        with self.app.session_transaction() as cookie:
+            cookie.update(logged_in=True, user_id=1, role="admin", name="x")
+        response = self.app.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/plain")
+        text = response.data.decode()
+        self.assertIn(
+            'flasktaskr_request_duration_seconds_bucket{endpoint="users.login",le="+Inf"}', text)
+        self.assertIn('flasktaskr_requests_total{endpoint="users.login",status="200"}', text)
+        self.assertIn('flasktaskr_sql_queries_per_request_count{endpoint="users.login"}', text)
+        self.assertIn('flasktaskr_template_render_seconds_count{template="login.html"}', text)
+        self.assertIn('flasktaskr_response_size_bytes_sum{endpoint="users.login"}', text)
+
+    def test_metrics_are_only_for_admins(self):
+        self.assertEqual(self.app.get("/metrics").status_code, 403)
+        with self.app.session_transaction() as cookie:
+            cookie.update(logged_in=True, user_id=1, role="user", name="x")
+        self.assertEqual(self.app.get("/metrics").status_code, 403)
+        with self.app.session_transaction() as cookie:
+            cookie.update(role="admin")
+        self.assertEqual(self.app.get("/metrics").status_code, 200)
+
+    def test_metrics_token_lets_a_scraper_in(self):
+        self.addCleanup(app.config.pop, "METRICS_TOKEN", None)
+        app.config["METRICS_TOKEN"] = "scrape-me"
+        response = self.app.get("/metrics", headers={"Authorization": "Bearer nope"})
+        self.assertEqual(response.status_code, 403)
+        response = self.app.get("/metrics", headers={"Authorization": "Bearer scrape-me"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_failed_statements_leave_no_start_times_behind(self):
+        with db.engine.connect() as conn:
+            for _ in range(3):
+                with self.assertRaises(sqlalchemy.exc.OperationalError):
+                    conn.execute("SELECT * FROM no_such_table")
+            conn.execute("SELECT 1")
+            self.assertNotIn("metrics_started", conn.info)
+            self.assertNotIn("profiling_started", conn.info)
+
+    def test_metrics_are_summed_across_worker_snapshots(self):
+        metrics = app.extensions["metrics"]
+        directory = tempfile.mkdtemp()
+        other = Registry()
+        other.inc("flasktaskr_requests_total", dict(endpoint="tasks.tasks", status=200), 5)
+        with open(os.path.join(directory, "metrics-1.json"), "w") as f:
+            json.dump(other.snapshot(), f)
+        key = ("flasktaskr_requests_total", (("endpoint", "tasks.tasks"), ("status", 200)))
+        own = metrics.collect()[0].get(key, 0)
+        original, metrics.directory = metrics.directory, directory
+        self.addCleanup(setattr, metrics, "directory", original)
+        counters, histograms = metrics.collect()
+        self.assertEqual(counters[key], own + 5)
+
+    def test_exited_workers_are_folded_into_the_archive(self):
+        directory = tempfile.mkdtemp()
+        metrics = MetricsStore(directory)
+        key = ("flasktaskr_requests_total", (("endpoint", "tasks.tasks"), ("status", 200)))
+        other = Registry()
+        other.inc("flasktaskr_requests_total", dict(endpoint="tasks.tasks", status=200), 5)
+        with open(os.path.join(directory, "metrics-1.json"), "w") as f:
+            json.dump(other.snapshot(), f)
+        # pid 1 was killed, this process flushes and then exits cleanly
+        archive_snapshots(directory, [1])
+        metrics.registry.inc("flasktaskr_requests_total",
+                             dict(endpoint="tasks.tasks", status=200), 2)
+        metrics.flush()
+        metrics.registry.inc("flasktaskr_requests_total",
+                             dict(endpoint="tasks.tasks", status=200), 1)
+        metrics.retire()
+        self.assertEqual(sorted(name for name in os.listdir(directory)
+                                if name.endswith(".json")), ["metrics-archive.json"])
+        self.assertEqual(metrics.collect()[0][key], 8)
+        # a later process reusing the pid adds to the total
+        metrics.registry.inc("flasktaskr_requests_total",
+                             dict(endpoint="tasks.tasks", status=200), 1)
+        metrics.flush()
+        self.assertEqual(metrics.collect()[0][key], 9)
+
+    def test_self_check_accepts_the_default_worker_model(self):
+        config = dict(
+            SQLALCHEMY_DATABASE_URI="sqlite:////srv/flasktaskr.db",
+            METRICS_DIR="/tmp/metrics")
+        self.assertEqual(
+            worker_model_warnings(config, 4, 4, "gthread", 30), [])
+
+    def test_self_check_warns_about_worker_models_sqlite_cannot_serve(self):
+        config = dict(
+            SQLALCHEMY_DATABASE_URI="sqlite:////srv/flasktaskr.db",
+            SQLITE_JOURNAL_MODE="DELETE",
+            SQLITE_BUSY_TIMEOUT=60000)
+        warnings = worker_model_warnings(config, 4, 32, "gthread", 30)
+        self.assertEqual(len(warnings), 4)
+        self.assertIn("Use WAL", warnings[0])
+        self.assertIn("killed", warnings[1])
+        self.assertIn("queue for a connection", warnings[2])
+        self.assertIn("METRICS_DIR", warnings[3])
+        warnings = worker_model_warnings(
+            dict(SQLALCHEMY_DATABASE_URI="sqlite:////srv/flasktaskr.db",
+                 METRICS_DIR="/tmp/metrics", BCRYPT_WORKERS=4),
+            9, 4, "gthread", 30, cpus=4)
+        self.assertEqual(len(warnings), 1)
+        self.assertIn("36 bcrypt processes on 4 CPUs", warnings[0])
+        warnings = worker_model_warnings(
+            dict(SQLALCHEMY_DATABASE_URI="sqlite://"), 2, 1, "sync", 30)
+        self.assertIn("own, empty database", warnings[0])
+        warnings = worker_model_warnings(
+            dict(config, SQLITE_JOURNAL_MODE="WAL", SQLITE_BUSY_TIMEOUT=5000,
+                 METRICS_DIR="/tmp"), 1, 1, "gevent", 30)
+        self.assertEqual(len(warnings), 1)
+        self.assertIn("stalls every request", warnings[0])
+
     def test_500_error(self):
         bad_user = User(
             name = "Janek1",
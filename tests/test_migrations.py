@@ -0,0 +1,140 @@
+# tests/test_migrations.py
+
+import sqlite3
+import unittest
+
+from base import LegacyDatabaseTestCase
+from project import migrations
+from project.archive import archive_closed_tasks
+
+
+class MigrationTests(LegacyDatabaseTestCase):
+
+    def test_upgrade_rebuilds_legacy_tables_in_batches(self):
+        version = migrations.upgrade(self.path, batch_size=3, log=lambda m: None)
+        self.assertEqual(version, migrations.latest_version())
+        connection = sqlite3.connect(self.path)
+        self.assertIn("role", migrations.table_columns(connection, "users"))
+        self.assertIn("user_id", migrations.table_columns(connection, "tasks"))
+        rows = connection.execute(
+            "SELECT task_id, name, user_id FROM tasks ORDER BY task_id").fetchall()
+        self.assertEqual(len(rows), 11)
+        self.assertEqual(rows[4], (5, "task 5", 1))
+        indexes = [row[1] for row in connection.execute("PRAGMA index_list(tasks)")]
+        self.assertIn("ix_tasks_status_due_date", indexes)
+        connection.close()
+
+    def test_upgrade_is_a_no_op_when_current(self):
+        migrations.upgrade(self.path, log=lambda m: None)
+        applied = []
+        migrations.upgrade(self.path, log=applied.append)
+        self.assertEqual(applied, [])
+
+    def test_mirror_triggers_keep_writes_made_during_the_copy(self):
+        connection = migrations.connect(self.path)
+        original = migrations.copy_in_batches
+
+        def copy_with_concurrent_writes(*args, **kwargs):
+            connection.execute("UPDATE tasks SET status = 0 WHERE task_id = 2")
+            connection.execute("DELETE FROM tasks WHERE task_id = 3")
+            return original(*args, **kwargs)
+
+        migrations.copy_in_batches = copy_with_concurrent_writes
+        try:
+            migrations.upgrade(self.path, batch_size=2, log=lambda m: None)
+        finally:
+            migrations.copy_in_batches = original
+        rows = dict(connection.execute("SELECT task_id, status FROM tasks"))
+        connection.close()
+        self.assertEqual(rows[2], 0)
+        self.assertNotIn(3, rows)
+        self.assertEqual(len(rows), 10)
+
+    def test_indexes_are_built_on_the_new_table_before_the_copy(self):
+        statements = []
+        original = migrations.connect
+
+        def traced_connect(path):
+            connection = original(path)
+            connection.set_trace_callback(statements.append)
+            return connection
+
+        migrations.connect = traced_connect
+        try:
+            migrations.upgrade(self.path, batch_size=3, log=lambda m: None)
+        finally:
+            migrations.connect = original
+        self.assertFalse([s for s in statements
+                          if s.startswith("CREATE INDEX") and " ON tasks " in s])
+        connection = migrations.connect(self.path)
+        indexes = {row[1] for row in connection.execute("PRAGMA index_list(tasks)")}
+        self.assertEqual(indexes, {"ix_tasks_status_due_date", "ix_tasks_reminder_due",
+                                   "ix_tasks_user_next", "ix_tasks_claimed_next",
+                                   "ix_tasks_queue"})
+        triggers = {row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+            "AND tbl_name = 'tasks'")}
+        self.assertEqual(len(triggers), 9)
+        self.assertFalse([name for name in triggers if "mirror" in name])
+        connection.close()
+
+    def test_claims_move_the_task_versions_on(self):
+        migrations.upgrade(self.path, log=lambda m: None)
+        connection = migrations.connect(self.path)
+        version = "SELECT version FROM task_versions WHERE user_id = 0"
+        before = connection.execute(version).fetchone()
+        connection.execute("UPDATE tasks SET claimed_by = 2 WHERE task_id = 1")
+        self.assertNotEqual(connection.execute(version).fetchone(), before)
+        self.assertEqual(connection.execute(
+            "SELECT version FROM task_versions WHERE user_id = 2").fetchone(), (1,))
+        connection.close()
+
+    def test_search_index_is_built_and_kept_in_sync(self):
+        migrations.upgrade(self.path, log=lambda m: None)
+        connection = migrations.connect(self.path)
+        match = "SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH ? ORDER BY rowid"
+        self.assertEqual(len(connection.execute(match, ("task",)).fetchall()), 11)
+        connection.execute("UPDATE tasks SET name = 'renamed' WHERE task_id = 4")
+        connection.execute("DELETE FROM tasks WHERE task_id = 5")
+        self.assertEqual(connection.execute(match, ("renamed",)).fetchall(), [(4,)])
+        self.assertEqual(len(connection.execute(match, ("task",)).fetchall()), 9)
+        connection.execute("DROP TRIGGER tasks_fts_insert")
+        connection.execute("INSERT INTO tasks (name, due_date, priority) "
+                           "VALUES ('late', '2020-10-08', 1)")
+        self.assertEqual(connection.execute(match, ("late",)).fetchall(), [])
+        migrations.rebuild_search_index(connection)
+        self.assertEqual(connection.execute(match, ("late",)).fetchall(), [(12,)])
+        connection.close()
+
+    def test_reconcile_repairs_a_drifted_summary(self):
+        migrations.upgrade(self.path, log=lambda m: None)
+        connection = migrations.connect(self.path)
+        counts = "SELECT user_id, priority, due_date, open_count, closed_count " \
+            "FROM task_summary WHERE open_count OR closed_count"
+        self.assertEqual(connection.execute(counts).fetchall(),
+                         [(1, 1, "2020-10-08", 11, 0)])
+        connection.execute("UPDATE tasks SET status = 0 WHERE task_id = 1")
+        self.assertEqual(migrations.reconcile_summary(connection), 0)
+        connection.execute("UPDATE task_summary SET open_count = 99")
+        connection.execute("INSERT INTO task_summary VALUES (7, 1, '2020-01-01', 3, 0)")
+        self.assertEqual(migrations.reconcile_summary(connection), 2)
+        self.assertEqual(connection.execute(counts).fetchall(),
+                         [(1, 1, "2020-10-08", 10, 1)])
+        connection.close()
+
+    def test_upgrade_starts_task_ids_past_the_archive(self):
+        migrations.upgrade(self.path, target=8, log=lambda m: None)
+        connection = migrations.connect(self.path)
+        connection.execute("UPDATE tasks SET status = 0 WHERE task_id = 11")
+        archive_closed_tasks(connection, after_days=0)
+        migrations.upgrade(self.path, log=lambda m: None)
+        connection.execute("INSERT INTO tasks (name, due_date, priority, status) "
+                           "VALUES ('new', '2020-10-08', 1, 1)")
+        self.assertEqual(connection.execute(
+            "SELECT task_id FROM tasks WHERE name = 'new'").fetchone()[0], 12)
+        self.assertIn("AUTOINCREMENT", migrations.table_sql(connection, "tasks"))
+        connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+# tests/test_reminders.py
+
+import datetime
+import unittest
+
+from base import LegacyDatabaseTestCase
+from project import migrations
+from project.reminders import ReminderWorker
+
+
+class ListSink(object):
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+
+    def send(self, reminders):
+        if self.fail:
+            raise IOError("sink is down")
+        self.sent.extend(reminders)
+
+
+class ReminderTests(LegacyDatabaseTestCase):
+
+    def reminder_tasks(self):
+        # tasks 1-11 are overdue at upgrade time; 12-15 come due later
+        migrations.upgrade(self.path, log=lambda m: None)
+        connection = migrations.connect(self.path)
+        connection.executemany(
+            "INSERT INTO tasks (task_id, name, due_date, priority, status, "
+            "user_id) VALUES (?, 'later', ?, 1, ?, 1)",
+            [(12, "2030-01-03", 1), (13, "2030-01-02", 1),
+             (14, "2030-01-02", 0), (15, "2030-02-01", 1)]
+        )
+        return connection
+
+    def test_upgrade_skips_reminders_for_already_overdue_tasks(self):
+        connection = self.reminder_tasks()
+        self.assertEqual(connection.execute(
+            "SELECT count(*) FROM tasks WHERE reminded_at IS NULL "
+            "AND task_id <= 11").fetchone()[0], 0)
+        connection.close()
+
+    def test_reminder_workers_split_batches_by_lease(self):
+        connection = self.reminder_tasks()
+        now = datetime.datetime(2030, 1, 2, 8)
+        first = ReminderWorker(connection, ListSink(), batch_size=1, owner="a")
+        sink = ListSink()
+        second = ReminderWorker(connection, sink, batch_size=5, owner="b")
+        # a claims task 13 and dies before sending it
+        self.assertEqual([r["task_id"] for r in first.claim(now)], [13])
+        self.assertEqual(second.run_once(now), 1)
+        self.assertEqual([r["task_id"] for r in sink.sent], [12])
+        self.assertEqual(second.run_once(now), 0)
+        # once the lease runs out the batch is up for grabs again
+        self.assertEqual(second.run_once(now + datetime.timedelta(minutes=2)), 1)
+        self.assertEqual([r["task_id"] for r in sink.sent], [12, 13])
+        self.assertEqual(sink.sent[1]["overdue"], False)
+        self.assertEqual(first.finish([13], now, delivered=True), 0)
+        self.assertEqual(second.stats(now)["pending"], 0)
+        connection.close()
+
+    def test_failed_reminders_are_released(self):
+        connection = self.reminder_tasks()
+        now = datetime.datetime(2030, 1, 3, 8)
+        worker = ReminderWorker(connection, ListSink(fail=True))
+        self.assertEqual(worker.run_once(now), 0)
+        self.assertEqual(worker.stats(now)["failed"], 2)
+        worker.sink = ListSink()
+        self.assertEqual(worker.run_once(now), 2)
+        stats = worker.stats(now)
+        self.assertEqual((stats["sent"], stats["pending"]), (2, 0))
+        connection.close()
+
+    def test_reminder_scan_uses_the_partial_index(self):
+        connection = self.reminder_tasks()
+        now = datetime.datetime(2030, 1, 2, 12)
+        stats = ReminderWorker(connection, ListSink()).stats(now)
+        self.assertEqual((stats["pending"], stats["lag_seconds"]), (2, 36 * 3600))
+        plan = " ".join(row[3] for row in connection.execute(
+            "EXPLAIN QUERY PLAN SELECT task_id "
+            "FROM tasks INDEXED BY ix_tasks_reminder_due "
+            "WHERE status = 1 AND reminded_at IS NULL AND due_date <= ? "
+            "AND (lease_expires IS NULL OR lease_expires < ?) "
+            "ORDER BY due_date LIMIT ?", ("2030-01-03", "", 10)))
+        self.assertIn("ix_tasks_reminder_due", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+        connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,16 +1,28 @@
 # project/test_tasks.py
 
+import gzip
+import io
+import json
 import os
+import re
+import sqlite3
+import tempfile
 import unittest
 
-from project import app, db, bcrypt
-from project._config import basedir
-from project.models import User, Task
+from sqlalchemy import event
+
+from base import FlaskTestCase, app
+from project import db, bcrypt
+from project.archive import COLUMNS
+from project.cache import FragmentStore, SQLiteBackend
+from project.csrf import unmask
+from project.models import User, Task, TaskArchive, TaskRow, TaskSummary, \
+    task_rows
+from project.tasks.views import closed_tasks, open_tasks
 import datetime
 
-TEST_DB = "test.db"
 
-class AllTest(unittest.TestCase):
+class AllTest(FlaskTestCase):
 
     # helper methods
     def register(self, name, email, password, confirm):
@@ -53,27 +65,31 @@ class AllTest(unittest.TestCase):
             status="1"
             ), follow_redirects=True)
 
+    def count_queries(self, url):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            # the savepoints are the test transaction's, not the app's
+            if not statement.startswith(("SAVEPOINT", "RELEASE", "ROLLBACK")):
+                statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            self.app.get(url)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        return len(statements)
+
     ############################
     #### setup and teardown ####
     ############################
 
     # executed prior to each test
     def setUp(self):
-        app.config["TESTING"] = True
-        app.config["WTF_CSRF_ENABLED"] = False
-        app.config["DEBUG"] = False
-        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + \
-            os.path.join(basedir, TEST_DB)
-        self.app = app.test_client()
-        db.create_all()
+        super().setUp()
 
         self.assertEquals(app.debug, False)
 
-    # executed after each test
-    def tearDown(self):
-        db.session.remove()
-        db.drop_all()
-
     #each test should start with "test"
 
 
@@ -162,6 +178,451 @@ class AllTest(unittest.TestCase):
         response = self.app.get("delete/1/", follow_redirects=True)
         self.assertIn(b"The task was deleted.", response.data)
 
+    def test_open_tasks_are_paginated_by_cursor(self):
+        app.config["TASKS_PER_PAGE"] = 2
+        self.addCleanup(app.config.pop, "TASKS_PER_PAGE", None)
+        self.get_in()
+        for _ in range(3):
+            self.create_task()
+        response = self.app.get("tasks/")
+        self.assertIn(b"open_after=2020-10-08_2", response.data)
+        self.assertIn(b"delete/1/", response.data)
+        self.assertNotIn(b"delete/3/", response.data)
+        response = self.app.get("tasks/?open_after=2020-10-08_2")
+        self.assertIn(b"delete/3/", response.data)
+        self.assertNotIn(b"delete/1/", response.data)
+        self.assertNotIn(b"Next page", response.data)
+
+    def test_invalid_cursor_starts_from_first_page(self):
+        self.get_in()
+        self.create_task()
+        response = self.app.get("tasks/?open_after=garbage")
+        self.assertIn(b"delete/1/", response.data)
+
+    def test_task_list_query_count_does_not_grow_with_rows(self):
+        self.get_in()
+        self.create_task()
+        self.app.get("complete/1/")
+        self.create_task()
+        app.extensions["fragment_cache"].clear()
+        baseline = self.count_queries("tasks/")
+
+        self.logout()
+        self.get_in_admin()
+        for _ in range(5):
+            self.create_task()
+        self.app.get("complete/3/")
+        app.extensions["fragment_cache"].clear()
+        self.assertEqual(self.count_queries("tasks/"), baseline)
+
+    def test_completing_a_missing_task_does_not_crash(self):
+        self.get_in()
+        response = self.app.get("complete/42/", follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"You can only update tasks that belong to you", response.data)
+        response = self.app.get("delete/42/", follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"You can only delete tasks that belong to you", response.data)
+
+    def test_can_complete_and_delete_tasks_in_bulk(self):
+        self.get_in()
+        for _ in range(3):
+            self.create_task()
+        response = self.app.post("complete/", data=dict(
+            task_ids=["1", "2", "2"]), follow_redirects=True)
+        self.assertIn(b"2 task(s) marked as complete.", response.data)
+        self.assertEqual(Task.query.filter_by(status=0).count(), 2)
+        response = self.app.post("delete/", data=dict(
+            task_ids=["1", "3"]), follow_redirects=True)
+        self.assertIn(b"2 task(s) deleted.", response.data)
+        self.assertEqual(Task.query.count(), 1)
+
+    def test_bulk_complete_skips_tasks_not_created_by_user(self):
+        self.get_in()
+        self.create_task()
+        self.logout()
+
+        self.register("Romano", 'rrr@mm.com', "python", "python")
+        self.login("Romano", "python")
+        self.create_task()
+        response = self.app.post("complete/", data=dict(
+            task_ids=["1", "2"]), follow_redirects=True)
+        self.assertIn(b"1 task(s) marked as complete.", response.data)
+        self.assertIn(b"You can only update tasks that belong to you", response.data)
+        self.assertEqual(Task.query.get(1).status, 1)
+
+    def test_can_export_tasks_as_csv_and_ndjson(self):
+        self.get_in()
+        self.create_task()
+        self.create_task()
+        response = self.app.get("tasks/export.csv")
+        self.assertEqual(response.mimetype, "text/csv")
+        lines = response.data.decode().splitlines()
+        self.assertEqual(lines[0], "task_id,name,due_date,priority,posted_date,status,user_id")
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith("1,Test task,10/08/2020,1,"))
+        response = self.app.get("tasks/export.ndjson")
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([row["task_id"] for row in rows], [1, 2])
+
+    def test_can_import_tasks_and_invalid_rows_are_reported(self):
+        self.get_in()
+        upload = io.BytesIO(
+            b"name,due_date,priority\n"
+            b"First,10/08/2020,3\n"
+            b",10/08/2020,3\n"
+            b"Third,2020-10-08,3\n"
+            b"Fourth,11/08/2020,10\n"
+        )
+        response = self.app.post("tasks/import/", data=dict(
+            file=(upload, "tasks.csv")), follow_redirects=True)
+        self.assertIn(b"2 task(s) imported.", response.data)
+        self.assertIn(b"2 row(s) were rejected.", response.data)
+        self.assertIn(b"Row 2: name", response.data)
+        self.assertEqual(Task.query.filter_by(status=1).count(), 2)
+
+    def test_exported_ndjson_can_be_imported_again(self):
+        self.get_in()
+        self.create_task()
+        exported = self.app.get("tasks/export.ndjson").data
+        response = self.app.post("tasks/import/", data=dict(
+            file=(io.BytesIO(exported), "tasks.ndjson")), follow_redirects=True)
+        self.assertIn(b"1 task(s) imported.", response.data)
+        self.assertEqual(Task.query.filter_by(name="Test task").count(), 2)
+
+    def test_closed_tasks_stay_closed_through_export_and_import(self):
+        self.get_in()
+        self.create_task()
+        self.create_task()
+        self.app.get("complete/2/")
+        for fmt in ("ndjson", "csv"):
+            exported = self.app.get(f"tasks/export.{fmt}").data
+            response = self.app.post("tasks/import/", data=dict(
+                file=(io.BytesIO(exported), f"tasks.{fmt}")), follow_redirects=True)
+            self.assertIn(b"2 task(s) imported.", response.data)
+            imported = Task.query.filter(Task.task_id > 2)
+            self.assertEqual(
+                [task.status for task in imported.order_by(Task.task_id)], [1, 0])
+            imported.delete()
+            db.session.commit()
+
+    def test_task_tables_are_served_from_cache_until_a_write(self):
+        self.get_in()
+        self.create_task()
+        self.app.get("tasks/")
+        self.assertEqual(self.count_queries("tasks/"), 1)
+        hits = app.extensions["fragment_cache"].hits
+        self.app.get("tasks/")
+        self.assertEqual(app.extensions["fragment_cache"].hits, hits + 2)
+        self.app.get("complete/1/")
+        response = self.app.get("tasks/")
+        self.assertNotIn(b"complete/1/", response.data)
+
+    def test_fragment_cache_evicts_least_recently_used(self):
+        cache = FragmentStore()
+        cache.max_entries = 2
+        cache.set("a", ("<a>", None))
+        cache.set("b", ("<b>", None))
+        cache.get("a")
+        cache.set("c", ("<c>", None))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), ("<a>", None))
+        stats = cache.stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["entries"], 2)
+
+    def test_an_unreadable_shared_cache_is_a_miss(self):
+        cache = FragmentStore()
+        cache.backend = SQLiteBackend(os.path.join(tempfile.mkdtemp(), "cache.db"))
+        cache.set("a", ("<a>", None))
+        cache.clear()
+        with sqlite3.connect(cache.backend.path) as connection:
+            connection.execute("DROP TABLE fragments")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_task_list_can_be_streamed(self):
+        self.get_in()
+        self.create_task()
+        self.create_task()
+        self.app.get("complete/2/")
+        response = self.app.get("tasks/?stream=1")
+        self.assertTrue(response.is_streamed)
+        self.assertIn(b"Add a new task:", response.data)
+        self.assertIn(b"complete/1/", response.data)
+        self.assertIn(b"delete/2/", response.data)
+        self.assertNotIn(b"Next page", response.data)
+
+    def test_streamed_pages_link_to_the_next_page(self):
+        app.config["TASKS_STREAM_PER_PAGE"] = 1
+        self.addCleanup(app.config.pop, "TASKS_STREAM_PER_PAGE", None)
+        self.get_in()
+        self.create_task()
+        self.create_task()
+        response = self.app.get("tasks/?stream=1")
+        self.assertIn(b"open_after=2020-10-08_1", response.data)
+        self.assertNotIn(b"delete/2/", response.data)
+
+    def test_flash_messages_are_consumed_by_streamed_page(self):
+        self.get_in()
+        self.app.get("complete/42/")
+        response = self.app.get("tasks/?stream=1")
+        self.assertIn(b"You can only update tasks", response.data)
+        response = self.app.get("tasks/?stream=1")
+        self.assertNotIn(b"You can only update tasks", response.data)
+
+    def test_task_list_is_gzipped_without_an_etag(self):
+        # the test profile renders its forms without CSRF tokens
+        self.get_in()
+        self.create_task()
+        plain = self.app.get("tasks/")
+        response = self.app.get("tasks/", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+        self.assertLess(len(response.data), len(plain.data))
+        self.assertNotIn("ETag", response.headers)
+
+    def test_pages_with_a_csrf_token_are_compressed_with_the_token_masked(self):
+        self.get_in()
+        self.create_task()
+        app.config["WTF_CSRF_ENABLED"] = True
+        self.addCleanup(app.config.__setitem__, "WTF_CSRF_ENABLED", False)
+        token = re.compile(rb'name="csrf_token" type="hidden" value="([^"]+)"')
+        tokens = []
+        for url in ("tasks/", "tasks/?stream=1"):
+            response = self.app.get(url, headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(response.headers["Content-Encoding"], "gzip")
+            tokens.append(token.search(gzip.decompress(response.data)).group(1))
+        # the same session token, masked differently on every page
+        self.assertNotEqual(tokens[0], tokens[1])
+        self.assertEqual(unmask(tokens[0].decode()), unmask(tokens[1].decode()))
+        for csrf_token, name in ((tokens[1].decode(), "Masked"), ("forged", "Forged")):
+            self.app.post("add/", data=dict(
+                name=name, due_date="10/08/2020", priority="1",
+                csrf_token=csrf_token))
+        names = [task.name for task in Task.query.order_by(Task.task_id)]
+        self.assertEqual(names, ["Test task", "Masked"])
+
+    def test_json_is_revalidated_with_an_etag(self):
+        self.get_in()
+        response = self.app.get("api/tasks/search/?q=milk")
+        self.assertIn("ETag", response.headers)
+        response = self.app.get("api/tasks/search/?q=milk", headers={
+            "If-None-Match": response.headers["ETag"]})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+    def test_streamed_task_list_is_gzipped_chunk_by_chunk(self):
+        self.get_in()
+        self.create_task()
+        response = self.app.get("tasks/?stream=1",
+                                headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn(b"complete/1/", gzip.decompress(response.data))
+
+    def test_small_responses_are_not_compressed(self):
+        self.get_in()
+        response = self.app.get("api/tasks/open/",
+                                headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_can_search_tasks_by_name(self):
+        self.get_in()
+        for name in ("Buy milk", "Water the plants", "Buy more milk"):
+            self.app.post("add/", data=dict(
+                name=name, due_date="10/08/2020", priority="1"))
+        self.app.get("complete/3/")
+        response = self.app.get("tasks/search/?q=mil")
+        self.assertIn(b"Buy milk", response.data)
+        self.assertIn(b"Buy more milk", response.data)
+        self.assertNotIn(b"Water the plants", response.data)
+        response = self.app.get("tasks/search/?q=milk&status=open")
+        self.assertNotIn(b"Buy more milk", response.data)
+        self.app.get("delete/1/")
+        response = self.app.get("tasks/search/?q=milk")
+        self.assertNotIn(b"Buy milk", response.data)
+
+    def test_search_input_is_not_fts_syntax(self):
+        self.get_in()
+        self.create_task()
+        response = self.app.get('tasks/search/?q="test" (task*')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"Test task", response.data)
+
+    def test_summary_follows_every_write_path(self):
+        self.get_in()
+        for due_date in ("10/08/2020", "10/08/2020", "10/08/2999", "10/08/2999"):
+            self.app.post("add/", data=dict(
+                name="Test task", due_date=due_date, priority="2"))
+        self.app.get("complete/1/")
+        self.app.get("delete/3/")
+        self.app.post("complete/", data=dict(task_ids=["4"]))
+        rows = db.session.query(
+            TaskSummary.due_date, TaskSummary.open_count, TaskSummary.closed_count
+        ).filter(TaskSummary.open_count + TaskSummary.closed_count > 0).order_by(
+            TaskSummary.due_date).all()
+        self.assertEqual(rows, [
+            (datetime.date(2020, 10, 8), 1, 1),
+            (datetime.date(2999, 10, 8), 0, 1)
+        ])
+
+    def test_dashboard_reads_only_the_summary(self):
+        self.get_in()
+        self.app.post("add/", data=dict(
+            name="Test task", due_date="10/08/2020", priority="2"))
+        self.create_task()
+        self.app.get("complete/2/")
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            response = self.app.get("dashboard/")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        self.assertIn(b"<strong>1</strong> open", response.data)
+        self.assertIn(b"<strong>1</strong> overdue", response.data)
+        self.assertIn(b"<strong>1</strong> closed", response.data)
+        self.assertIn(b"Marek1", response.data)
+        self.assertFalse([s for s in statements if "FROM tasks" in s])
+
+    def archive(self, *task_ids):
+        # what project/archive.py does, but inside the test's transaction
+        for task in Task.query.filter(Task.task_id.in_(task_ids)):
+            db.session.add(TaskArchive(
+                archived_at=datetime.datetime.utcnow(),
+                **{column: getattr(task, column) for column in COLUMNS}))
+            db.session.delete(task)
+        db.session.commit()
+
+    def test_next_up_lists_own_tasks_and_claims_from_the_queue(self):
+        self.get_in()
+        self.create_task()
+        response = self.app.get("tasks/next/")
+        self.assertIn(b"Your most urgent open tasks", response.data)
+        self.assertIn(b"Test task", response.data)
+        response = self.app.post("tasks/claim/", follow_redirects=True)
+        self.assertIn(b"You claimed &#34;Test task&#34;", response.data)
+        response = self.app.post("tasks/claim/", follow_redirects=True)
+        self.assertIn(b"There are no unclaimed open tasks.", response.data)
+
+    def test_task_lists_load_plain_rows_not_orm_instances(self):
+        self.get_in()
+        self.create_task()
+        self.create_task()
+        self.app.get("complete/2/")
+        with app.test_request_context():
+            session = db.session()
+            open_rows = task_rows(open_tasks().all())
+            closed_rows = task_rows(closed_tasks().all())
+            self.assertEqual(
+                open_rows, [TaskRow(1, "Test task", datetime.date(2020, 10, 8),
+                                    1, datetime.date.today(), 1, 1, None,
+                                    "Marek1")])
+            self.assertEqual([row.poster_name for row in closed_rows], ["Marek1"])
+            self.assertFalse(hasattr(open_rows[0], "__dict__"))
+            self.assertFalse(any(isinstance(instance, Task)
+                                 for instance in session.identity_map.values()))
+
+    def test_a_zero_page_size_still_shows_one_task_per_page(self):
+        app.config["TASKS_PER_PAGE"] = 0
+        self.addCleanup(app.config.pop, "TASKS_PER_PAGE", None)
+        self.get_in()
+        for _ in range(2):
+            self.create_task()
+        response = self.app.get("tasks/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"delete/1/", response.data)
+        self.assertIn(b"open_after=2020-10-08_1", response.data)
+
+    def test_closed_tasks_read_across_hot_and_archived_rows(self):
+        app.config["TASKS_PER_PAGE"] = 1
+        self.addCleanup(app.config.pop, "TASKS_PER_PAGE", None)
+        self.get_in()
+        self.create_task()
+        self.app.post("add/", data=dict(
+            name="Test task", due_date="10/08/2999", priority="1"))
+        self.app.get("complete/1/")
+        self.app.get("complete/2/")
+        self.archive(1)
+        self.assertEqual(db.session.query(Task).count(), 1)
+        response = self.app.get("tasks/")
+        self.assertIn(b"delete/1/", response.data)
+        self.assertIn(b"closed_after=2020-10-08_1", response.data)
+        response = self.app.get("tasks/?closed_after=2020-10-08_1")
+        self.assertIn(b"delete/2/", response.data)
+        response = self.app.get("api/tasks/closed/?limit=5")
+        self.assertEqual(
+            [task["task_id"] for task in response.get_json()["tasks"]], [1, 2])
+        response = self.app.get("dashboard/")
+        self.assertIn(b"<strong>2</strong> closed", response.data)
+
+    def test_archived_tasks_are_still_found_by_search(self):
+        self.get_in()
+        for name in ("Buy milk", "Buy more milk"):
+            self.app.post("add/", data=dict(
+                name=name, due_date="10/08/2020", priority="1"))
+        self.app.get("complete/1/")
+        self.archive(1)
+        response = self.app.get("api/tasks/search/?q=milk")
+        # live tasks first, the archived ones after them
+        self.assertEqual(
+            [task["task_id"] for task in response.get_json()["tasks"]], [2, 1])
+        response = self.app.get("tasks/search/?q=milk&status=closed")
+        self.assertIn(b"Buy milk", response.data)
+        self.assertNotIn(b"Buy more milk", response.data)
+        response = self.app.get("tasks/search/?q=milk&status=open")
+        self.assertNotIn(b"Buy milk", response.data)
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            response = self.app.get("api/tasks/search/?q=milk&status=open")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        self.assertEqual(
+            [task["task_id"] for task in response.get_json()["tasks"]], [2])
+        self.assertTrue([s for s in statements if "tasks_fts" in s])
+        self.assertFalse([s for s in statements if "tasks_archive_fts" in s])
+        self.app.get("delete/1/")
+        response = self.app.get("api/tasks/search/?q=milk")
+        self.assertEqual(
+            [task["task_id"] for task in response.get_json()["tasks"]], [2])
+
+    def test_archived_tasks_can_be_deleted(self):
+        self.get_in()
+        self.create_task()
+        self.create_task()
+        self.app.get("complete/1/")
+        self.app.get("complete/2/")
+        self.archive(1, 2)
+        self.app.get("tasks/")
+        self.app.get("delete/1/")
+        self.app.post("delete/", data=dict(task_ids=["2"]))
+        response = self.app.get("tasks/")
+        self.assertNotIn(b"delete/1/", response.data)
+        self.assertNotIn(b"delete/2/", response.data)
+        response = self.app.get("dashboard/")
+        self.assertIn(b"<strong>0</strong> closed", response.data)
+
+    def test_new_tasks_never_reuse_an_archived_id(self):
+        self.get_in()
+        self.create_task()
+        self.create_task()
+        self.app.get("complete/2/")
+        self.archive(2)
+        self.create_task()
+        self.assertEqual([task.task_id for task in Task.query.order_by(Task.task_id)],
+                         [1, 3])
+        self.app.get("delete/3/")
+        self.assertEqual(db.session.query(TaskArchive.task_id).all(), [(2,)])
+        self.assertEqual([task.task_id for task in Task.query], [1])
 
     def test_task_repr(self):
         new_task = Task(
@@ -1,16 +1,20 @@
 # project/test.py
 
+import io
 import os
 import unittest
+from concurrent.futures import Future
+from unittest import mock
 
-from project import app, db, bcrypt
-from project._config import basedir
+from base import FlaskTestCase, app
+from project import db, bcrypt, fragment_cache, password_hasher
+from project.hashing import HasherBusy, hash_password
 from project.models import User, Task
+from project.users import provisioning
 import datetime
 
-TEST_DB = "test.db"
 
-class AllTest(unittest.TestCase):
+class AllTest(FlaskTestCase):
 
     # helper methods
     def register(self, name, email, password, confirm):
@@ -58,21 +62,10 @@ class AllTest(unittest.TestCase):
 
     # executed prior to each test
     def setUp(self):
-        app.config["TESTING"] = True
-        app.config["WTF_CSRF_ENABLED"] = False
-        app.config["DEBUG"] = False
-        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + \
-            os.path.join(basedir, TEST_DB)
-        self.app = app.test_client()
-        db.create_all()
+        super().setUp()
 
         self.assertEquals(app.debug, False)
 
-    # executed after each test
-    def tearDown(self):
-        db.session.remove()
-        db.drop_all()
-
     #each test should start with "test"
 
     def test_users_cannot_login_unless_registered(self):
@@ -163,6 +156,124 @@ class AllTest(unittest.TestCase):
         self.assertIn(b"complete/2/", response.data)
         self.assertIn(b"delete/2/", response.data)
 
+    def test_login_rehashes_password_when_work_factor_changes(self):
+        self.register("Michael", "Michael@realpython.com", "python", "python")
+        self.assertTrue(User.query.first().password.startswith("$2b$04$"))
+        app.config["BCRYPT_LOG_ROUNDS"] = 5
+        self.addCleanup(app.config.__setitem__, "BCRYPT_LOG_ROUNDS", 4)
+        response = self.login("Michael", "python")
+        self.assertIn(b"Welcome!", response.data)
+        self.assertTrue(User.query.first().password.startswith("$2b$05$"))
+        self.logout()
+        response = self.login("Michael", "python")
+        self.assertIn(b"Welcome!", response.data)
+
+    def test_login_skips_the_rehash_when_hashing_is_saturated(self):
+        self.register("Michael", "Michael@realpython.com", "python", "python")
+        app.config["BCRYPT_LOG_ROUNDS"] = 5
+        self.addCleanup(app.config.__setitem__, "BCRYPT_LOG_ROUNDS", 4)
+        with mock.patch.object(password_hasher, "hash", side_effect=HasherBusy):
+            response = self.login("Michael", "python")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"Welcome!", response.data)
+        self.assertTrue(User.query.first().password.startswith("$2b$04$"))
+
+    def test_login_returns_503_when_hashing_is_saturated(self):
+        self.register("Michael", "Michael@realpython.com", "python", "python")
+        # the test profile hashes inline, the queue only exists with a pool
+        app.config.update(BCRYPT_WORKERS=1, BCRYPT_QUEUE_DEPTH=0)
+        self.addCleanup(app.config.update, BCRYPT_WORKERS=0)
+        self.addCleanup(app.config.pop, "BCRYPT_QUEUE_DEPTH")
+        response = self.login("Michael", "python")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+
+    def provision(self, *lines):
+        data = "\n".join(("name,email,password,role",) + lines).encode()
+        return self.app.post("users/provision/", data=dict(
+            file=(io.BytesIO(data), "users.csv")), follow_redirects=True)
+
+    def test_admins_can_provision_users_from_csv(self):
+        self.get_in_admin()
+        response = self.provision(
+            "Michael,michael@realpython.com,python,",
+            "Superadmin,other@realpython.com,python,",
+            "Michael2,michael@realpython.com,python,",
+            "Michael3,not-an-email,python,",
+            "Michael4,michael4@realpython.com,python,root",
+            "Michael5,michael5@realpython.com,python,admin"
+        )
+        self.assertIn(b"2 user(s) created, 4 row(s) rejected.", response.data)
+        self.assertIn(b"name: Superadmin is already taken.", response.data)
+        self.assertIn(b"email: michael@realpython.com appears earlier in the file.",
+                      response.data)
+        self.assertEqual(
+            [(user.name, user.role) for user in User.query.order_by(User.id)],
+            [("Superadmin", "admin"), ("Michael", "user"), ("Michael5", "admin")])
+        self.logout()
+        response = self.login("Michael", "python")
+        self.assertIn(b"Welcome!", response.data)
+
+    def test_large_files_are_sent_to_the_command_line(self):
+        self.get_in_admin()
+        app.config["USERS_PROVISION_MAX_ROWS"] = 2
+        self.addCleanup(app.config.pop, "USERS_PROVISION_MAX_ROWS")
+        response = self.provision(
+            "Michael1,michael1@realpython.com,python,",
+            "Michael2,michael2@realpython.com,python,",
+            "Michael3,michael3@realpython.com,python,")
+        self.assertIn(b"Files over 2 rows have to be provisioned with db_provision.py.",
+                      response.data)
+        self.assertEqual(User.query.count(), 1)
+
+    def test_bulk_hashing_leaves_room_for_logins(self):
+        # a queue depth of one: a login still gets in while a bulk chunk
+        # is in flight
+        app.config.update(BCRYPT_WORKERS=2, BCRYPT_QUEUE_DEPTH=1)
+        self.addCleanup(app.config.update, BCRYPT_WORKERS=0)
+        self.addCleanup(app.config.pop, "BCRYPT_QUEUE_DEPTH")
+        pw_hash = hash_password("python", 4)
+        seen = []
+
+        class Pool(object):
+            def map(self, func, passwords, rounds):
+                seen.append((password_hasher.bulk_pending,
+                             password_hasher.check(pw_hash, "python")))
+                return ["hash"] * len(passwords)
+
+            def submit(self, func, *args):
+                future = Future()
+                future.set_result(func(*args))
+                return future
+
+        with app.app_context(), \
+                mock.patch.object(password_hasher, "_pool", return_value=Pool()):
+            hashes = password_hasher.hash_many(["python"] * 5)
+        self.assertEqual(hashes, ["hash"] * 5)
+        self.assertEqual(seen, [(2, True), (2, True), (1, True)])
+        self.assertEqual(password_hasher.bulk_pending, 0)
+
+    def test_only_admins_can_provision_users(self):
+        self.get_in("Marek1")
+        response = self.provision("Michael,michael@realpython.com,python,")
+        self.assertIn(b"Only admins can provision users.", response.data)
+        self.assertEqual(User.query.count(), 1)
+
+    def test_a_clash_missed_by_the_check_only_rejects_its_row(self):
+        self.get_in("Marek1")
+        # as if Marek1 had registered between the check and the insert
+        original = provisioning.taken
+        provisioning.taken = lambda batch: dict(name=set(), email=set())
+        self.addCleanup(setattr, provisioning, "taken", original)
+        with app.test_request_context():
+            created, failed, errors = provisioning.provision_users([
+                dict(name="Michael", email="michael@realpython.com", password="python"),
+                dict(name="Marek1", email="marek2@rp.com", password="python"),
+            ])
+        self.assertEqual((created, failed), (1, 1))
+        self.assertEqual(errors, [(2, ["That username and/or email already exists."])])
+        self.assertEqual(User.query.count(), 2)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,5 @@
+# project/wsgi.py
+# WSGI entry point for the production server, see gunicorn_config.py
+from project import create_app
+
+app = create_app()